@@ -0,0 +1,217 @@
+"""Estimation of the numbers of cycles and chains by random sampling.
+
+Cycles are counted exactly by searching, from each low vertex v, a tree
+whose nodes are the paths from v through higher-indexed vertices; a path
+with k vertices whose last vertex has an edge to v is a cycle of length k.
+Chains are counted by searching a similar tree from each NDD edge. Each
+sample here takes one random root-to-leaf probe through one of these trees
+(Knuth's estimator): the probe follows a random child at each level, and
+the product of the numbers of children seen so far is an unbiased estimate
+of the number of nodes at the next level.
+
+The root of each probe is chosen by importance sampling, with probability
+proportional to a cheap estimate of the size of its tree, and the probe's
+contribution is divided by that probability. Confidence intervals use the
+normal approximation to the distribution of the mean of the samples.
+"""
+
+import bisect
+import math
+import random
+import time
+
+from parallel_enumeration import estimate_cycle_work
+
+# The default maximum number of probes
+DEFAULT_SAMPLES = 100000
+
+# The number of probes between checks of the time limit
+SAMPLES_PER_TIME_CHECK = 1000
+
+class CountEstimate(object):
+    """Estimated numbers of cycles or chains of each length.
+
+    Data members:
+        counts_by_size: counts_by_size[k] is the estimated number of cycles
+            or chains with k vertices
+        half_widths: half_widths[k] is the half-width of the confidence
+            interval for counts_by_size[k]
+        total, total_half_width: the estimated total count, and the
+            half-width of its confidence interval
+        samples: the number of probes taken
+        confidence: the confidence level of the intervals
+    """
+
+    def __init__(self, counts_by_size, half_widths, total, total_half_width, samples,
+                 confidence):
+        self.counts_by_size = counts_by_size
+        self.half_widths = half_widths
+        self.total = total
+        self.total_half_width = total_half_width
+        self.samples = samples
+        self.confidence = confidence
+
+def normal_quantile(p):
+    """Returns x such that a standard normal variable is less than x with
+    probability p, for 0 < p < 1."""
+
+    lo, hi = -40.0, 40.0
+    for __ in range(200):
+        mid = (lo + hi) / 2
+        if 0.5 * math.erfc(-mid / math.sqrt(2)) < p:
+            lo = mid
+        else:
+            hi = mid
+    return (lo + hi) / 2
+
+class _Sampler(object):
+    """Accumulates per-length sample values, and runs probes within a
+    sample and time budget."""
+
+    def __init__(self, max_length, weights, rng):
+        self.max_length = max_length
+        self.rng = rng
+        self.sums = [0.0] * (max_length + 1)
+        self.sums_of_squares = [0.0] * (max_length + 1)
+        self.total_sum = 0.0
+        self.total_sum_of_squares = 0.0
+        self.samples = 0
+        self.weight_total = float(sum(weights))
+        self.cumulative_weights = []
+        cumulative = 0.0
+        for w in weights:
+            cumulative += w
+            self.cumulative_weights.append(cumulative)
+
+    def run(self, probe, max_samples, time_limit):
+        """Take up to max_samples samples, stopping early if time_limit (if
+        not None) seconds have passed. Each sample calls probe(root, values),
+        which must add its contribution for each length k to values[k]."""
+
+        if self.weight_total <= 0:
+            return
+        start_time = time.time()
+        values = [0.0] * (self.max_length + 1)
+        while self.samples < max_samples:
+            if (time_limit is not None and self.samples % SAMPLES_PER_TIME_CHECK == 0 and
+                    self.samples > 0 and time.time() - start_time > time_limit):
+                break
+            x = self.rng.random() * self.weight_total
+            root = min(bisect.bisect_right(self.cumulative_weights, x),
+                       len(self.cumulative_weights) - 1)
+            for k in range(len(values)):
+                values[k] = 0.0
+            probe(root, values)
+            scale = self.weight_total / (self.cumulative_weights[root] -
+                                         (self.cumulative_weights[root-1] if root else 0.0))
+            total = 0.0
+            for k, value in enumerate(values):
+                value *= scale
+                self.sums[k] += value
+                self.sums_of_squares[k] += value * value
+                total += value
+            self.total_sum += total
+            self.total_sum_of_squares += total * total
+            self.samples += 1
+
+    def estimate(self, confidence):
+        z = normal_quantile(0.5 + confidence / 2)
+        def mean_and_half_width(s, ss):
+            if self.samples == 0:
+                return 0.0, 0.0
+            mean = s / self.samples
+            if self.samples == 1:
+                return mean, float("inf") if mean else 0.0
+            variance = max(0.0, (ss - self.samples * mean * mean) / (self.samples - 1))
+            return mean, z * math.sqrt(variance / self.samples)
+        per_length = [mean_and_half_width(s, ss)
+                      for s, ss in zip(self.sums, self.sums_of_squares)]
+        total, total_half_width = mean_and_half_width(self.total_sum, self.total_sum_of_squares)
+        return CountEstimate([m for m, __ in per_length], [h for __, h in per_length],
+                             total, total_half_width, self.samples, confidence)
+
+def estimate_cycle_counts(digraph, max_length, max_samples=DEFAULT_SAMPLES, time_limit=None,
+                          seed=None, confidence=0.95):
+    """Estimate the number of cycles of each length up to max_length.
+
+    Args:
+        digraph: the Digraph
+        max_length: the cycle cap
+        max_samples: the maximum number of probes
+        time_limit: if not None, stop taking probes after about this many
+            seconds
+        seed: the random seed, or None
+        confidence: the confidence level of the intervals
+
+    Returns:
+        a CountEstimate
+    """
+
+    csr = digraph.csr()
+    out_nbrs = [tuple(csr.targets[csr.offsets[v]:csr.offsets[v+1]]) for v in range(digraph.n)]
+    transp = digraph.transpose_csr()
+    in_nbr_sets = [frozenset(transp.targets[transp.offsets[v]:transp.offsets[v+1]])
+                   for v in range(digraph.n)]
+    vtx_used = [False] * digraph.n
+    rng = random.Random(seed)
+
+    def probe(low_vtx, values):
+        closing = in_nbr_sets[low_vtx]
+        path = [low_vtx]
+        weight = 1.0
+        last = low_vtx
+        for k in range(2, max_length + 1):
+            children = [w for w in out_nbrs[last] if w > low_vtx and not vtx_used[w]]
+            if not children:
+                break
+            # Count the children that close a cycle exactly
+            values[k] = weight * sum(1 for w in children if w in closing)
+            if k == max_length:
+                break
+            weight *= len(children)
+            last = children[rng.randrange(len(children))]
+            vtx_used[last] = True
+            path.append(last)
+        for v in path:
+            vtx_used[v] = False
+
+    sampler = _Sampler(max_length, estimate_cycle_work(digraph, max_length) if max_length >= 2
+                       else [], rng)
+    sampler.run(probe, max_samples, time_limit)
+    return sampler.estimate(confidence)
+
+def estimate_chain_counts(digraph, ndds, max_chain, max_samples=DEFAULT_SAMPLES, time_limit=None,
+                          seed=None, confidence=0.95):
+    """Estimate the number of chains with each number of edges up to
+    max_chain. The arguments and result are as for estimate_cycle_counts."""
+
+    csr = digraph.csr()
+    out_nbrs = [tuple(csr.targets[csr.offsets[v]:csr.offsets[v+1]]) for v in range(digraph.n)]
+    vtx_used = [False] * digraph.n
+    tgt_ids = [e.target_v.id for ndd in ndds for e in ndd.edges] if max_chain > 0 else []
+    rng = random.Random(seed)
+
+    def probe(edge_idx, values):
+        last = tgt_ids[edge_idx]
+        path = [last]
+        vtx_used[last] = True
+        values[1] = 1.0
+        weight = 1.0
+        for k in range(2, max_chain + 1):
+            children = [w for w in out_nbrs[last] if not vtx_used[w]]
+            if not children:
+                break
+            weight *= len(children)
+            values[k] = weight
+            if k == max_chain:
+                break
+            last = children[rng.randrange(len(children))]
+            vtx_used[last] = True
+            path.append(last)
+        for v in path:
+            vtx_used[v] = False
+
+    # Weight each NDD edge by the out-degree of its target
+    sampler = _Sampler(max_chain, [1 + len(out_nbrs[v]) for v in tgt_ids], rng)
+    sampler.run(probe, max_samples, time_limit)
+    return sampler.estimate(confidence)
@@ -0,0 +1,75 @@
+"""
+A program for comparing the IP solver backends. Each instance is solved
+with each formulation and backend, and the build and solve times (as for
+time_model_build.py) and the total score are printed.
+
+For the CBC backend, the solve time includes the time taken by PuLP to
+write the model to a file for CBC and to read the solution back.
+"""
+
+import argparse
+import copy
+import os
+
+import ip_backend
+import kidney_io
+import kidney_ip
+from time_model_build import time_formulation
+
+def read_instance_files(input_path):
+    """Reads an instance from a .input file, and from the .ndds file with the
+    same base name if there is one."""
+
+    digraph = kidney_io.read_digraph_file(input_path)
+    ndds_path = os.path.splitext(input_path)[0] + ".ndds"
+    if os.path.exists(ndds_path):
+        return digraph, kidney_io.read_ndds_file(ndds_path, digraph)
+    return digraph, []
+
+def start():
+    parser = argparse.ArgumentParser(
+            "Compare build and solve times for each IP solver backend")
+    parser.add_argument("cycle_cap", type=int,
+            help="The maximum permitted cycle length")
+    parser.add_argument("chain_cap", type=int,
+            help="The maximum permitted number of edges in a chain")
+    parser.add_argument("instances", nargs="+", metavar="INPUT_FILE",
+            help="The .input files of the instances; NDDs are read from the " +
+                 ".ndds file with the same base name, if it exists")
+    parser.add_argument("--formulations", "-f", nargs="+",
+            default=["picef", "cf", "hpief_prime", "eef"],
+            help="The IP formulations to time (as for kidney_solver.py; " +
+                 "default: picef cf hpief_prime eef)")
+    parser.add_argument("--backends", "-b", nargs="+", choices=ip_backend.BACKENDS,
+            default=list(ip_backend.BACKENDS),
+            help="The IP solvers to compare (default: all)")
+    parser.add_argument("--repeats", "-n", type=int, default=3,
+            help="The number of runs of each formulation; the fastest is reported " +
+                 "(default: 3)")
+    parser.add_argument("--timelimit", "-t", type=float, default=None,
+            help="IP solver time limit in seconds (default: no time limit)")
+
+    args = parser.parse_args()
+
+    print "instance\tformulation\tbackend\tbuild_time\tsolve_time\ttotal_score"
+    for input_path in args.instances:
+        d, altruists = read_instance_files(input_path)
+        name = os.path.splitext(os.path.basename(input_path))[0]
+        cfg = kidney_ip.OptConfig(d, altruists, args.cycle_cap, args.chain_cap,
+                                  timelimit=args.timelimit)
+        for formulation in args.formulations:
+            for backend in args.backends:
+                backend_cfg = copy.copy(cfg)
+                backend_cfg.backend = backend
+                try:
+                    build_time, solve_time, total_score = time_formulation(
+                            backend_cfg, formulation.lower(), args.repeats)
+                except Exception as e:
+                    # For example, Gurobi may not be licensed on this machine
+                    print "{}\t{}\t{}\tfailed: {}".format(name, formulation, backend, e)
+                    continue
+                print "{}\t{}\t{}\t{:.3f}\t{:.3f}\t{}".format(
+                        name, formulation, backend, build_time, solve_time, total_score)
+
+if __name__=="__main__":
+    start()
@@ -0,0 +1,139 @@
+"""Exact counting of short cycles and chains without enumerating them.
+
+With A the digraph's adjacency matrix, the number of 2-cycles is half the
+number of edges whose reverse edge exists, and the number of 3-cycles is
+trace(A^3) / 3. Since the digraph has no loops, every closed walk of
+length 3 is a cycle, counted once for each of its three rotations. The
+trace is computed from a dense product A*A, which is only worthwhile if
+the digraph is small or dense enough; otherwise CycleEnumerator, which
+prunes its search, is faster than computing the trace sparsely.
+
+Similarly, an NDD edge to v begins outdeg(v) chains with two vertices, and
+each of these chains, v->w, can be extended to outdeg(w) chains with three
+vertices, less one if the edge w->v exists.
+"""
+
+import numpy as np
+
+from kidney_digraph import _as_numpy
+
+# The largest cycle and chain caps for which counts can be calculated here
+MAX_CYCLE_CAP = 3
+MAX_CHAIN_CAP = 3
+
+# The maximum number of two-edge paths held in memory at once
+PATH_CHUNK_SIZE = 1 << 20
+
+# 3-cycles are counted here only in digraphs with at most MAX_DENSE_N
+# vertices, and if n**3 is at most DENSE_COST_RATIO times the number of
+# two-edge paths (a rough measure of the cost of enumerating them)
+MAX_DENSE_N = 4096
+DENSE_COST_RATIO = 256
+
+class _EdgeArrays(object):
+    """NumPy views of a digraph's CSR arrays, with a sorted array of edge
+    keys (src << 32 | tgt) for testing whether edges exist."""
+
+    def __init__(self, digraph):
+        csr = digraph.csr()
+        self.offsets = _as_numpy(csr.offsets, np.int64)
+        self.targets = _as_numpy(csr.targets, np.int64)
+        self.out_degrees = np.diff(self.offsets)
+        self.sources = np.repeat(np.arange(digraph.n, dtype=np.int64), self.out_degrees)
+        self.sorted_keys = np.sort(self.sources << 32 | self.targets)
+
+    def edges_exist(self, src_ids, tgt_ids):
+        """Returns a boolean array saying whether there is an edge from
+        src_ids[i] to tgt_ids[i], for each i."""
+
+        keys = src_ids << 32 | tgt_ids
+        pos = np.searchsorted(self.sorted_keys, keys)
+        pos[pos == len(self.sorted_keys)] = 0
+        return self.sorted_keys[pos] == keys
+
+    def extend(self, starts, ends):
+        """Generate, in chunks, the paths start->end->w for each pair
+        (starts[i], ends[i]) and each out-neighbour w of ends[i], as
+        triples of arrays (starts, ends, ws)."""
+
+        degrees = self.out_degrees[ends]
+        path_ends = np.cumsum(degrees)
+        lo = 0
+        while lo < len(ends):
+            # Take at least one pair, and as many as fit in a chunk
+            base = path_ends[lo] - degrees[lo]
+            hi = max(lo + 1, np.searchsorted(path_ends, base + PATH_CHUNK_SIZE, 'right'))
+            chunk_degrees = degrees[lo:hi]
+            chunk_ends = ends[lo:hi]
+            first_in_group = np.cumsum(chunk_degrees) - chunk_degrees
+            pos = (np.arange(chunk_degrees.sum()) +
+                   np.repeat(self.offsets[chunk_ends] - first_in_group, chunk_degrees))
+            yield (np.repeat(starts[lo:hi], chunk_degrees), np.repeat(chunk_ends, chunk_degrees),
+                   self.targets[pos])
+            lo = hi
+
+def can_count_cycles(digraph, max_length):
+    """Returns True if count_cycles is expected to be faster than
+    enumeration for the digraph and cycle cap max_length."""
+
+    if max_length <= 2:
+        return True
+    if max_length > MAX_CYCLE_CAP or digraph.n > MAX_DENSE_N:
+        return False
+    out_degrees = np.diff(_as_numpy(digraph.csr().offsets, np.int64))
+    two_path_count = int(out_degrees[_as_numpy(digraph.edge_tgt, np.int64)].sum())
+    return digraph.n**3 <= DENSE_COST_RATIO * two_path_count
+
+def count_cycles(digraph, max_length):
+    """Count cycles of length up to max_length, which must be at most
+    MAX_CYCLE_CAP. Counting 3-cycles takes O(n^3) time, so should only be
+    done if can_count_cycles(digraph, max_length) is True.
+
+    Returns:
+        a list counts_by_size of length max_length+1, where counts_by_size[k]
+        is the number of cycles with k vertices
+    """
+
+    if max_length > MAX_CYCLE_CAP:
+        raise ValueError("Cycle cap {} is greater than {}".format(max_length, MAX_CYCLE_CAP))
+    counts_by_size = [0] * (max_length + 1)
+    if max_length < 2:
+        return counts_by_size
+
+    edges = _EdgeArrays(digraph)
+    counts_by_size[2] = int(edges.edges_exist(edges.targets, edges.sources).sum()) // 2
+    if max_length >= 3:
+        # trace(A^3) is the sum of (A*A)[v, u] over edges u->v. The entries
+        # of A*A are at most n, so float32 arithmetic is exact.
+        n = digraph.n
+        adj = np.zeros((n, n), dtype=np.float32)
+        adj[edges.sources, edges.targets] = 1
+        closed_walks = int(adj.dot(adj)[edges.targets, edges.sources].astype(np.int64).sum())
+        counts_by_size[3] = closed_walks // 3
+    return counts_by_size
+
+def count_chains(digraph, ndds, max_chain):
+    """Count chains with up to max_chain edges, which must be at most
+    MAX_CHAIN_CAP.
+
+    Returns:
+        a list counts_by_size of length max_chain+1, where counts_by_size[k]
+        is the number of chains with k vertices
+    """
+
+    if max_chain > MAX_CHAIN_CAP:
+        raise ValueError("Chain cap {} is greater than {}".format(max_chain, MAX_CHAIN_CAP))
+    counts_by_size = [0] * (max_chain + 1)
+    if max_chain == 0:
+        return counts_by_size
+
+    ndd_targets = np.array([e.target_v.id for ndd in ndds for e in ndd.edges], dtype=np.int64)
+    counts_by_size[1] = len(ndd_targets)
+    if max_chain >= 2 and len(ndd_targets):
+        edges = _EdgeArrays(digraph)
+        counts_by_size[2] = int(edges.out_degrees[ndd_targets].sum())
+        if max_chain >= 3:
+            for __, vs, ws in edges.extend(ndd_targets, ndd_targets):
+                counts_by_size[3] += int(edges.out_degrees[ws].sum() -
+                                         edges.edges_exist(ws, vs).sum())
+    return counts_by_size
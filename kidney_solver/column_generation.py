@@ -0,0 +1,270 @@
+"""The cycle formulation, solved by column generation.
+
+Rather than enumerating every cycle and chain up front, the LP relaxation
+of the cycle formulation is solved over a growing set of columns (the
+restricted master problem). After each LP solve, the vertex and NDD
+constraints' dual values are used to search for cycles and chains with
+positive reduced cost, which are added as new columns. When no such column
+exists, the restricted LP's optimal value is the LP relaxation bound of the
+full cycle formulation.
+
+The IP is then solved over the generated columns only (price-and-branch).
+This is a heuristic: its solution is feasible, but may be worse than the
+optimum, so the gap to the LP bound is reported.
+
+The reduced-cost searches assume that edge scores are non-negative. They
+prune any path that cannot be extended to a column with positive reduced
+cost. The bound used is, for each vertex v and number of steps k, the
+largest increase in reduced cost from extending a path at v by a walk of
+up to k vertices (a walk may repeat vertices, so this is a relaxation),
+which is found by dynamic programming over the edges.
+"""
+
+import numpy as np
+
+from kidney_digraph import failure_aware_cycle_score, _as_numpy
+from kidney_ndds import Chain
+from kidney_ip import OptSolution, create_ip_model, optimise
+from ip_backend import LESS_EQUAL
+
+# The maximum number of cycles, and of chains, added in each round
+MAX_COLUMNS_PER_ROUND = 500
+
+# Columns are added only if their reduced cost exceeds this
+REDUCED_COST_TOLERANCE = 1e-6
+
+class ColumnGenerationStats(object):
+    """Statistics from a column-generation run.
+
+    Data members:
+        rounds: the number of restricted LPs solved
+        cycle_columns, chain_columns: the numbers of columns generated
+        lp_bound: the optimal value of the LP relaxation
+        obj_val: the objective value of the IP solution
+        gap: (lp_bound - obj_val) / lp_bound, or 0 if lp_bound is 0
+    """
+
+    def __init__(self, rounds, cycle_columns, chain_columns, lp_bound, obj_val):
+        self.rounds = rounds
+        self.cycle_columns = cycle_columns
+        self.chain_columns = chain_columns
+        self.lp_bound = lp_bound
+        self.obj_val = obj_val
+        self.gap = max(0.0, (lp_bound - obj_val) / lp_bound) if lp_bound > 0 else 0.0
+
+    def display(self):
+        """Print the statistics to standard output."""
+
+        print "cg_rounds: {}".format(self.rounds)
+        print "cg_cycle_columns: {}".format(self.cycle_columns)
+        print "cg_chain_columns: {}".format(self.chain_columns)
+        print "cg_lp_bound: {}".format(self.lp_bound)
+        print "cg_gap: {}".format(self.gap)
+
+class ColumnPricer(object):
+    """Finds cycles and chains with positive reduced cost, given the dual
+    values of the vertex and NDD constraints."""
+
+    def __init__(self, digraph, ndds, max_cycle, max_chain, edge_success_prob=1):
+        self.max_cycle = max_cycle
+        self.max_chain = max_chain
+        self.edge_success_prob = edge_success_prob
+        csr = digraph.csr()
+        # Out-edges of each vertex, as tuples of (target ID, score) pairs
+        self.out_edges = [tuple(zip(csr.targets[csr.offsets[v]:csr.offsets[v+1]],
+                                    csr.scores[csr.offsets[v]:csr.offsets[v+1]]))
+                          for v in range(digraph.n)]
+        self.edge_scores = {}
+        self.max_in_score = [0.0] * digraph.n
+        for v, edges in enumerate(self.out_edges):
+            for w, score in edges:
+                self.edge_scores[v, w] = score
+                self.max_in_score[w] = max(self.max_in_score[w], score)
+        self.ndd_edges = [[(e.target_v.id, e.score) for e in ndd.edges] for ndd in ndds]
+        self.vtx_used = [False] * digraph.n
+
+        self.edge_src = np.repeat(np.arange(digraph.n), np.diff(_as_numpy(csr.offsets, np.int64)))
+        self.edge_tgt = _as_numpy(csr.targets, np.int64)
+        self.edge_score = _as_numpy(csr.scores, np.float64)
+
+    def _future_gains(self, vtx_duals, max_steps):
+        """Returns a list gains such that gains[k][v] is an upper bound on
+        the increase in reduced cost from extending a path ending at vertex
+        v by up to k vertices, for k from 0 to max_steps."""
+
+        n = len(vtx_duals)
+        edge_gain = self.edge_score - np.asarray(vtx_duals, dtype=np.float64)[self.edge_tgt]
+        gains = [np.zeros(n)]
+        for __ in range(max_steps):
+            best = np.zeros(n)
+            np.maximum.at(best, self.edge_src, edge_gain + gains[-1][self.edge_tgt])
+            gains.append(best)
+        return [g.tolist() for g in gains]
+
+    def price_cycles(self, vtx_duals, max_columns=MAX_COLUMNS_PER_ROUND):
+        """Returns a list of up to max_columns cycles with positive reduced
+        cost, each as a list of vertex IDs starting with its lowest ID."""
+
+        columns = []
+        if self.max_cycle < 2:
+            return columns
+        gains = self._future_gains(vtx_duals, self.max_cycle - 2)
+        max_in_score = self.max_in_score
+        out_edges = self.out_edges
+        vtx_used = self.vtx_used
+        edge_scores = self.edge_scores
+        max_cycle = self.max_cycle
+        p = self.edge_success_prob
+        path = []
+
+        def search(low_vtx, last, score, dual_sum):
+            # score and dual_sum are the totals for the path so far
+            k = len(path)
+            if k >= 2:
+                back_score = edge_scores.get((last, low_vtx))
+                if (back_score is not None and
+                        (score + back_score) * p**k - dual_sum > REDUCED_COST_TOLERANCE):
+                    columns.append(path[:])
+                    if len(columns) >= max_columns:
+                        return True
+            if k == max_cycle:
+                return False
+            for w, edge_score in out_edges[last]:
+                if w <= low_vtx or vtx_used[w]:
+                    continue
+                new_score = score + edge_score
+                new_dual_sum = dual_sum + vtx_duals[w]
+                # The path can gain at most gains[...][w] before the edge
+                # back to low_vtx
+                if (new_score - new_dual_sum + gains[max_cycle - k - 1][w] +
+                        max_in_score[low_vtx] <= REDUCED_COST_TOLERANCE):
+                    continue
+                vtx_used[w] = True
+                path.append(w)
+                done = search(low_vtx, w, new_score, new_dual_sum)
+                path.pop()
+                vtx_used[w] = False
+                if done:
+                    return True
+            return False
+
+        for v in range(len(out_edges)):
+            path.append(v)
+            done = search(v, v, 0.0, vtx_duals[v])
+            path.pop()
+            if done:
+                break
+        return columns
+
+    def price_chains(self, vtx_duals, ndd_duals, max_columns=MAX_COLUMNS_PER_ROUND):
+        """Returns a list of up to max_columns chains with positive reduced
+        cost, as Chain objects."""
+
+        columns = []
+        if self.max_chain < 1:
+            return columns
+        gains = self._future_gains(vtx_duals, self.max_chain - 1)
+        out_edges = self.out_edges
+        vtx_used = self.vtx_used
+        max_chain = self.max_chain
+        p = self.edge_success_prob
+        path = []
+
+        def search(ndd_idx, score, reduced_cost):
+            k = len(path)
+            if reduced_cost > REDUCED_COST_TOLERANCE:
+                columns.append(Chain(ndd_idx, path[:], score))
+                if len(columns) >= max_columns:
+                    return True
+            if k == max_chain:
+                return False
+            for w, edge_score in out_edges[path[-1]]:
+                if vtx_used[w]:
+                    continue
+                new_score = score + edge_score * p**(k+1)
+                new_reduced_cost = reduced_cost + edge_score * p**(k+1) - vtx_duals[w]
+                if new_reduced_cost + gains[max_chain - k - 1][w] <= REDUCED_COST_TOLERANCE:
+                    continue
+                vtx_used[w] = True
+                path.append(w)
+                done = search(ndd_idx, new_score, new_reduced_cost)
+                path.pop()
+                vtx_used[w] = False
+                if done:
+                    return True
+            return False
+
+        for ndd_idx, edges in enumerate(self.ndd_edges):
+            for v, edge_score in edges:
+                reduced_cost = edge_score * p - ndd_duals[ndd_idx] - vtx_duals[v]
+                if reduced_cost + gains[max_chain - 1][v] <= REDUCED_COST_TOLERANCE:
+                    continue
+                vtx_used[v] = True
+                path.append(v)
+                done = search(ndd_idx, edge_score * p, reduced_cost)
+                path.pop()
+                vtx_used[v] = False
+                if done:
+                    return columns
+        return columns
+
+def optimise_ccf_column_generation(cfg):
+    """Optimise using the cycle formulation, generating cycle and chain
+    columns as they are needed, and then solving the IP over the generated
+    columns.
+
+    Args:
+        cfg: an OptConfig object
+
+    Returns:
+        an OptSolution object, with an extra data member
+        column_generation holding a ColumnGenerationStats object
+    """
+
+    digraph = cfg.digraph
+    pricer = ColumnPricer(digraph, cfg.ndds, cfg.max_cycle, cfg.max_chain, cfg.edge_success_prob)
+
+    m = create_ip_model(cfg)
+    m.set_objective([], [])
+    vtx_constrs = [m.add_constr([], None, LESS_EQUAL, 1) for __ in digraph.vs]
+    ndd_constrs = [m.add_constr([], None, LESS_EQUAL, 1) for __ in cfg.ndds]
+
+    cycles = []
+    cycle_vars = []
+    chains = []
+    chain_vars = []
+    rounds = 0
+    while True:
+        m.optimize()
+        rounds += 1
+        vtx_duals = m.get_duals(vtx_constrs)
+        ndd_duals = m.get_duals(ndd_constrs)
+        new_cycles = pricer.price_cycles(vtx_duals)
+        new_chains = pricer.price_chains(vtx_duals, ndd_duals)
+        if not new_cycles and not new_chains:
+            break
+        for c in new_cycles:
+            cycle = [digraph.vs[v_id] for v_id in c]
+            score = failure_aware_cycle_score(cycle, digraph, cfg.edge_success_prob)
+            cycles.append(cycle)
+            cycle_vars.append(m.add_column(score, [vtx_constrs[v] for v in c]))
+        for c in new_chains:
+            chains.append(c)
+            chain_vars.append(m.add_column(
+                    c.score,
+                    [ndd_constrs[c.ndd_index]] + [vtx_constrs[v] for v in c.vtx_indices]))
+    lp_bound = m.obj_val if cycle_vars or chain_vars else 0.0
+
+    m.set_binary(cycle_vars + chain_vars)
+    optimise(m, cfg)
+
+    opt_result = OptSolution(ip_model=m,
+                             cycles=[c for c, val in zip(cycles, m.get_values(cycle_vars))
+                                     if val > 0.5],
+                             chains=[c for c, val in zip(chains, m.get_values(chain_vars))
+                                     if val > 0.5],
+                             digraph=digraph,
+                             edge_success_prob=cfg.edge_success_prob)
+    opt_result.column_generation = ColumnGenerationStats(
+            rounds, len(cycles), len(chains), lp_bound, opt_result.total_score)
+    return opt_result
@@ -5,71 +5,82 @@ instance, up to given cycle and chain caps.
 
 import argparse
 import sys
+import time
 
-import kidney_digraph
-import kidney_ndds
+import approximate_counting
+import closed_form_counts
+import kidney_io
+import parallel_enumeration
 
-def count_cycles(digraph, max_length):
-    """Find cycles of length up to max_length in the digraph.
+def count_cycles(digraph, max_length, jobs=1, progress=None):
+    """Count cycles of length up to max_length in the digraph.
 
-    Return value: a list of cycles, in which each cycle is represented
-    as a list of vertices, with the first vertex not repeated.
-    """
+    Args:
+        digraph: the Digraph
+        max_length: the cycle cap
+        jobs: the number of worker processes to use (None means one per CPU)
+        progress: if not None, a function called with partial counts, as
+            for parallel_enumeration.count_cycles
 
-    counts_by_size = [0] * (max_length + 1)
+    If closed_form_counts.can_count_cycles is True (for example, if
+    max_length is 2), the cycles are counted without being enumerated.
 
-    if max_length < 2:
-        return counts_by_size
+    Return value: a list counts_by_size of length max_length+1, where
+    counts_by_size[k] is the number of cycles with k vertices.
+    """
 
-    vtx_used = [False] * len(digraph.vs)
-
-    def cycle(first_vtx, last_vtx, num_vertices):
-        if digraph.edge_exists(last_vtx, first_vtx):
-            counts_by_size[num_vertices] += 1
-        if num_vertices < max_length:
-            for e in last_vtx.edges: 
-                v = e.tgt
-                if (num_vertices + shortest_paths_to_low_vtx[v.id] <= max_length
-                            and not vtx_used[v.id]):
-                    vtx_used[v.id] = True
-                    cycle(first_vtx, v, num_vertices + 1)
-                    vtx_used[v.id] = False
-
-    # Adjacency lists for transpose graph
-    transp_adj_lists = [[] for v in digraph.vs]
-    for edge in digraph.es:
-        transp_adj_lists[edge.tgt.id].append(edge.src)
-
-    for v in digraph.vs:
-        shortest_paths_to_low_vtx = digraph.calculate_shortest_path_lengths(
-                v, max_length - 1,
-                lambda u: (w for w in transp_adj_lists[u.id] if w.id > v.id))
-        vtx_used[v.id] = True
-        cycle(v, v, 1)
-        vtx_used[v.id] = False
-    return counts_by_size
-
-def count_chains(digraph, ndds, max_chain):
-    vtx_used = [False] * len(digraph.vs)
-    def find_chains_recurse(last_vtx, length):
-        counts_by_size[length] += 1
-        if length < max_chain:
-            for e in digraph.vs[last_vtx].edges:
-                if not vtx_used[e.tgt.id]:
-                    vtx_used[e.tgt.id] = True
-                    find_chains_recurse(e.tgt.id, length+1)
-                    vtx_used[e.tgt.id] = False
-    counts_by_size = [0] * (max_chain + 1)
-
-    if max_chain == 0:
+    if closed_form_counts.can_count_cycles(digraph, max_length):
+        counts_by_size = closed_form_counts.count_cycles(digraph, max_length)
+        if progress is not None:
+            progress(1, 1, counts_by_size)
         return counts_by_size
-    for ndd_idx, ndd in enumerate(ndds):
-        for e in ndd.edges:
-            vtx_used[e.target_v.id] = True
-            find_chains_recurse(e.target_v.id, 1)
-            vtx_used[e.target_v.id] = False
-    return counts_by_size
+    return parallel_enumeration.count_cycles(digraph, max_length, jobs, progress)
+
+def count_chains(digraph, ndds, max_chain, jobs=1, progress=None):
+    """Count chains with up to max_chain edges.
+
+    Args:
+        digraph: the Digraph
+        ndds: the list of NDDs
+        max_chain: the chain cap
+        jobs: the number of worker processes to use (None means one per CPU)
+        progress: if not None, a function called with partial counts, as
+            for parallel_enumeration.count_chains
+
+    If max_chain is at most closed_form_counts.MAX_CHAIN_CAP, the chains
+    are counted without being enumerated.
 
+    Return value: a list counts_by_size of length max_chain+1, where
+    counts_by_size[k] is the number of chains with k edges.
+    """
+
+    if max_chain <= closed_form_counts.MAX_CHAIN_CAP:
+        counts_by_size = closed_form_counts.count_chains(digraph, ndds, max_chain)
+        if progress is not None:
+            progress(1, 1, counts_by_size)
+        return counts_by_size
+    return parallel_enumeration.count_chains(digraph, ndds, max_chain, jobs, progress)
+
+class ProgressReporter(object):
+    """A progress function for count_cycles and count_chains that writes
+    partial counts to a stream, at most once per interval seconds."""
+
+    def __init__(self, label, interval, stream=sys.stderr):
+        self.label = label
+        self.interval = interval
+        self.stream = stream
+        self.start_time = time.time()
+        self.last_report_time = self.start_time
+
+    def __call__(self, shards_done, shard_count, counts_by_size):
+        now = time.time()
+        if shards_done < shard_count and now - self.last_report_time < self.interval:
+            return
+        self.last_report_time = now
+        self.stream.write("{}: {}/{} shards after {:.1f}s, partial total {}, by length {}\n".format(
+                self.label, shards_done, shard_count, now - self.start_time,
+                sum(counts_by_size), " ".join(str(c) for c in counts_by_size[1:])))
+        self.stream.flush()
 
 def start():
     parser = argparse.ArgumentParser(
@@ -78,23 +89,59 @@ def start():
             help="The maximum permitted cycle length")
     parser.add_argument("chain_cap", type=int,
             help="The maximum permitted number of edges in a chain")
+    parser.add_argument("--jobs", "-j", type=int, default=1,
+            help="Number of worker processes for counting (0 means one per CPU; " +
+                 "default: 1)")
+    parser.add_argument("--progress", "-p", type=float, default=None, metavar="SECONDS",
+            help="Write partial counts to standard error at most once every " +
+                 "SECONDS seconds while counting")
+    parser.add_argument("--estimate", "-e", action="store_true",
+            help="Estimate the counts by random sampling, with confidence intervals, " +
+                 "rather than counting exactly")
+    parser.add_argument("--samples", type=int, default=approximate_counting.DEFAULT_SAMPLES,
+            help="Maximum number of samples for each of cycles and chains, with --estimate " +
+                 "(default: {})".format(approximate_counting.DEFAULT_SAMPLES))
+    parser.add_argument("--time-limit", type=float, default=None, metavar="SECONDS",
+            help="Maximum sampling time for each of cycles and chains, with --estimate")
+    parser.add_argument("--confidence", type=float, default=0.95,
+            help="Confidence level of the intervals, with --estimate (default: 0.95)")
+    parser.add_argument("--seed", type=int, default=None,
+            help="Random seed, with --estimate")
             
     args = parser.parse_args()
-
-    input_lines = [line for line in sys.stdin]
-    n_digraph_edges = int(input_lines[0].split()[1])
-    digraph_lines = input_lines[:n_digraph_edges + 2]
-
-    d = kidney_digraph.read_digraph(digraph_lines)
-
-    if len(input_lines) > len(digraph_lines):
-        ndd_lines = input_lines[n_digraph_edges + 2:]
-        altruists = kidney_ndds.read_ndds(ndd_lines, d)
-    else:
-        altruists = []
+    jobs = args.jobs or None
+
+    d, altruists = kidney_io.read_instance(sys.stdin)
+
+    if args.estimate:
+        cycle_estimate = approximate_counting.estimate_cycle_counts(
+                d, args.cycle_cap, args.samples, args.time_limit, args.seed, args.confidence)
+        chain_estimate = approximate_counting.estimate_chain_counts(
+                d, altruists, args.chain_cap, args.samples, args.time_limit, args.seed,
+                args.confidence)
+        fmt = lambda count, half_width: "{:.0f} +/- {:.0f}".format(count, half_width)
+        print "confidence: {}".format(args.confidence)
+        print "cycle samples: {}".format(cycle_estimate.samples)
+        print "chain samples: {}".format(chain_estimate.samples)
+        print "cycles: {}".format(fmt(cycle_estimate.total, cycle_estimate.total_half_width))
+        print "chains: {}".format(fmt(chain_estimate.total, chain_estimate.total_half_width))
+        print "cycles by length:"
+        for i in range(2, args.cycle_cap+1):
+            print "{}\t{}".format(i, fmt(cycle_estimate.counts_by_size[i],
+                                          cycle_estimate.half_widths[i]))
+        print "chains by length:"
+        for i in range(1, args.chain_cap+1):
+            print "{}\t{}".format(i, fmt(chain_estimate.counts_by_size[i],
+                                          chain_estimate.half_widths[i]))
+        return
+
+    cycle_progress = chain_progress = None
+    if args.progress is not None:
+        cycle_progress = ProgressReporter("cycles", args.progress)
+        chain_progress = ProgressReporter("chains", args.progress)
         
-    cycle_counts_by_size = count_cycles(d, args.cycle_cap)
-    chain_counts_by_size = count_chains(d, altruists, args.chain_cap)
+    cycle_counts_by_size = count_cycles(d, args.cycle_cap, jobs, cycle_progress)
+    chain_counts_by_size = count_chains(d, altruists, args.chain_cap, jobs, chain_progress)
     print "cycles: {}".format(sum(cycle_counts_by_size))
     print "chains: {}".format(sum(chain_counts_by_size))
     print "cycles by length:"
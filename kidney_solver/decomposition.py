@@ -0,0 +1,196 @@
+"""Solving the components of an instance independently.
+
+Two vertices can be in the same cycle or chain only if they are in the same
+weakly connected component of the graph whose vertices are the donor-patient
+pairs and the NDDs, and whose edges are the digraph's edges and the NDDs'
+edges. Each such component (with at least one edge) can therefore be
+optimised separately, and the optimal solutions combined. The components
+are solved in a pool of worker processes.
+"""
+
+import copy
+import multiprocessing
+
+import numpy as np
+
+from kidney_digraph import digraph_from_arrays, _as_numpy
+from kidney_ndds import Chain, Ndd, NddEdge
+from kidney_ip import OptSolution, relabel_mip_start
+from parallel_enumeration import get_job_count
+
+class Component(object):
+    """A component of an instance.
+
+    Data members:
+        digraph: the component's Digraph
+        ndds: the component's list of NDDs
+        vertex_ids: vertex i of digraph is vertex vertex_ids[i] of the
+            instance
+        ndd_ids: NDD i of ndds is NDD ndd_ids[i] of the instance
+    """
+
+    def __init__(self, digraph, ndds, vertex_ids, ndd_ids):
+        self.digraph = digraph
+        self.ndds = ndds
+        self.vertex_ids = vertex_ids
+        self.ndd_ids = ndd_ids
+
+def _find_root(parent, i):
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+def component_labels(digraph, ndds):
+    """Label the weakly connected components of an instance, treating each
+    NDD as a vertex with ID digraph.n plus its index.
+
+    Returns:
+        a NumPy array of length digraph.n + len(ndds), containing the label
+        of each vertex and NDD. Labels are the lowest ID in the component.
+    """
+
+    n = digraph.n
+    parent = range(n + len(ndds))
+    edges = zip(digraph.edge_src, digraph.edge_tgt)
+    edges += [(n + i, e.target_v.id) for i, ndd in enumerate(ndds) for e in ndd.edges]
+    for u, v in edges:
+        root_u = _find_root(parent, u)
+        root_v = _find_root(parent, v)
+        if root_u < root_v:
+            parent[root_v] = root_u
+        elif root_v < root_u:
+            parent[root_u] = root_v
+    return np.array([_find_root(parent, i) for i in range(len(parent))], dtype=np.int64)
+
+def split_instance(digraph, ndds):
+    """Split an instance into its weakly connected components, omitting
+    components that have no edges. Vertices and edges keep their relative
+    order within each component.
+
+    Returns:
+        a list of Component objects, in order of lowest vertex or NDD ID
+    """
+
+    n = digraph.n
+    labels = component_labels(digraph, ndds)
+    edge_src = _as_numpy(digraph.edge_src, np.int64)
+    edge_tgt = _as_numpy(digraph.edge_tgt, np.int64)
+    edge_score = _as_numpy(digraph.edge_score, np.float64)
+    has_edge = np.zeros(len(labels), dtype=bool)
+    has_edge[labels[edge_src]] = True
+    for i, ndd in enumerate(ndds):
+        if ndd.edges:
+            has_edge[labels[n + i]] = True
+
+    # Local ID of each vertex and NDD within its component
+    ids_by_label = {}
+    local_ids = np.zeros(len(labels), dtype=np.int64)
+    for i, label in enumerate(labels.tolist()):
+        if has_edge[label]:
+            ids = ids_by_label.setdefault(label, [])
+            local_ids[i] = len(ids)
+            ids.append(i)
+
+    # Group the edges by component, keeping their order
+    edge_order = np.argsort(labels[edge_src], kind='mergesort')
+    edge_labels = labels[edge_src][edge_order]
+
+    components = []
+    for label in sorted(ids_by_label):
+        ids = np.array(ids_by_label[label], dtype=np.int64)
+        vertex_ids = ids[ids < n]
+        ndd_ids = ids[ids >= n] - n
+        start, end = np.searchsorted(edge_labels, [label, label + 1])
+        positions = edge_order[start:end]
+        component_digraph = digraph_from_arrays(
+                len(vertex_ids), local_ids[edge_src[positions]], local_ids[edge_tgt[positions]],
+                edge_score[positions])
+        component_ndds = []
+        vs = component_digraph.vs
+        for ndd_id in ndd_ids.tolist():
+            ndd = Ndd()
+            for e in ndds[ndd_id].edges:
+                ndd.add_edge(NddEdge(vs[int(local_ids[e.target_v.id])], e.score))
+            component_ndds.append(ndd)
+        components.append(Component(component_digraph, component_ndds,
+                                    vertex_ids.tolist(), ndd_ids.tolist()))
+    return components
+
+def _solve_component(formulation_fun, cfg, component):
+    """Optimise a component, and return its optimal cycles and chains as
+    lists of cycles (lists of vertex IDs) and (NDD index, vertex IDs, score)
+    tuples, with IDs and indices in the whole instance."""
+
+    component_cfg = copy.copy(cfg)
+    component_cfg.digraph = component.digraph
+    component_cfg.ndds = component.ndds
+    relabel_mip_start(cfg, component_cfg,
+                      {v_id: i for i, v_id in enumerate(component.vertex_ids)},
+                      {ndd_id: i for i, ndd_id in enumerate(component.ndd_ids)})
+    opt_result = formulation_fun(component_cfg)
+    cycles = [[component.vertex_ids[v.id] for v in c] for c in opt_result.cycles]
+    chains = [(component.ndd_ids[c.ndd_index], [component.vertex_ids[v] for v in c.vtx_indices],
+               c.score)
+              for c in opt_result.chains]
+    return cycles, chains
+
+# The formulation, OptConfig and components used by tasks in a worker process
+_worker_args = None
+
+def _init_component_worker(formulation_fun, cfg, components):
+    global _worker_args
+    _worker_args = (formulation_fun, cfg, components)
+
+def _solve_component_task(i):
+    formulation_fun, cfg, components = _worker_args
+    return _solve_component(formulation_fun, cfg, components[i])
+
+def optimise_components(formulation_fun, cfg):
+    """Optimise each weakly connected component of the instance separately,
+    using a pool of cfg.jobs worker processes, and combine the solutions.
+
+    Within each component, cycle enumeration runs in a single process. If
+    cfg.lp_file is set or cfg.relax is True, or if the instance has only one
+    component, the whole instance is optimised at once.
+
+    Args:
+        formulation_fun: the function to optimise each component
+        cfg: an OptConfig object
+
+    Returns:
+        an OptSolution object. Since there is no single IP model, its
+        ip_model member is None unless the whole instance was optimised at
+        once.
+    """
+
+    if cfg.lp_file or cfg.relax:
+        return formulation_fun(cfg)
+    components = split_instance(cfg.digraph, cfg.ndds)
+    if len(components) == 1 and components[0].digraph.n == cfg.digraph.n and \
+            len(components[0].ndds) == len(cfg.ndds):
+        return formulation_fun(cfg)
+
+    # Solve the largest components first, to balance the load
+    order = sorted(range(len(components)), key=lambda i: -len(components[i].digraph.es))
+    jobs = min(get_job_count(cfg.jobs), len(components))
+    component_cfg = copy.copy(cfg)
+    component_cfg.jobs = 1
+    if jobs <= 1:
+        results = [_solve_component(formulation_fun, component_cfg, components[i]) for i in order]
+    else:
+        pool = multiprocessing.Pool(jobs, _init_component_worker,
+                                    (formulation_fun, component_cfg, components))
+        try:
+            results = pool.map(_solve_component_task, order, chunksize=1)
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+
+    results = [result for __, result in sorted(zip(order, results))]
+    vs = cfg.digraph.vs
+    cycles = [[vs[v_id] for v_id in c] for cycles, __ in results for c in cycles]
+    chains = [Chain(ndd_index, vtx_indices, score)
+              for __, chains in results for ndd_index, vtx_indices, score in chains]
+    return OptSolution(None, cycles, chains, cfg.digraph, cfg.edge_success_prob)
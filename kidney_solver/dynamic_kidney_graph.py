@@ -28,11 +28,15 @@ class DynamicKidneyGraph:
         self.ndds = dict((i, Ndd()) for i, v in enumerate(new_ndds))
         self.ndd_id_name = dict((i, v) for i, v in enumerate(new_ndds))
         self.ndd_name_id = dict((v, i) for i, v in enumerate(new_ndds))
+        self.ndd_edge_index = NddEdgeIndex()
         for edge in ndd_edges:
             source, target, score = edge
             source = self.ndd_name_id[source]
             target = self.digraph.vs[self.digraph_name_id[target]]
-            self.ndds[source].add_edge(NddEdge(target, score))
+            ndd_edge = NddEdge(target, score)
+            if not self.ndd_edge_index.add(source, ndd_edge):
+                raise Exception('Duplicate edge!')
+            self.ndds[source].add_edge(ndd_edge)
 
     def get_digraph_vertices(self):
         '''
@@ -61,13 +65,8 @@ class DynamicKidneyGraph:
         Given the names of source ndd and target vertex, check if edge exists.
         '''
         source = self.ndd_name_id[source]
-        source_ndd = self.ndds[source]
         target = self.digraph_name_id[target]
-        target_vertex = self.digraph.vs[target]
-        for edge in source_ndd.edges:
-            if edge.target_v == target_vertex:
-                return True
-        return False
+        return self.ndd_edge_index.edge_exists(source, target)
 
     def get_digraph_edges(self, source):
         '''
@@ -109,13 +108,7 @@ class DynamicKidneyGraph:
                 new_vertices.append(v)
                 self.digraph_name_id[v] = len(self.digraph_name_id)
                 self.digraph_id_name[self.digraph_name_id[v]] = v
-        # expand the adjacent matrix
-        for i in range(len(self.digraph.vs)):
-            self.digraph.adj_mat[i] += [None] * len(new_vertices)
-        new_vs = [Vertex(self.digraph_name_id[i]) for i in new_vertices]
-        self.digraph.vs += new_vs
-        self.digraph.adj_mat += [[None] * len(self.digraph.vs) for _ in
-                range(len(new_vs))]
+        self.digraph.add_vertices(len(new_vertices))
 
         for edge in digraph_edges:
             source, target, score = edge
@@ -123,7 +116,7 @@ class DynamicKidneyGraph:
             target = self.digraph_name_id[target]
             source_v = self.digraph.vs[source]
             target_v = self.digraph.vs[target]
-            if self.digraph.adj_mat[source][target] is not None:
+            if self.digraph.get_edge(source, target) is not None:
                 raise Exception('Duplicate')
             self.digraph.add_edge(score, source_v, target_v)
 
@@ -144,7 +137,10 @@ class DynamicKidneyGraph:
             source, target, score = edge
             source = self.ndd_name_id[source]
             target = self.digraph.vs[self.digraph_name_id[target]]
-            self.ndds[source].add_edge(NddEdge(target, score))
+            ndd_edge = NddEdge(target, score)
+            if not self.ndd_edge_index.add(source, ndd_edge):
+                raise Exception('Duplicate')
+            self.ndds[source].add_edge(ndd_edge)
 
     def remove_digraph_edges(self, digraph_edges):
         '''
@@ -157,11 +153,7 @@ class DynamicKidneyGraph:
                 source, target, _ = edge
             src_id = self.digraph_name_id[source]
             trg_id = self.digraph_name_id[target]
-            for e in self.digraph.es:
-                if e.src.id == src_id and e.tgt.id == trg_id:
-                    self.digraph.es.remove(e)
-                    self.digraph.adj_mat[src_id][trg_id] = None
-                    break
+            self.digraph.remove_edge(src_id, trg_id)
 
     def remove_ndd_edges(self, ndd_edges):
         '''
@@ -173,11 +165,9 @@ class DynamicKidneyGraph:
             elif len(edge) == 3:
                 source, target, _ = edge
             src = self.ndd_name_id[source]
-            trg = self.digraph.vs[self.digraph_name_id[target]]
-            for e in self.ndds[src].edges:
-                if e.target_v == trg:
-                    self.ndds[src].edges.remove(e)
-                    break
+            e = self.ndd_edge_index.remove(src, self.digraph_name_id[target])
+            if e is not None:
+                self.ndds[src].edges.remove(e)
 
     def remove_digraph_vertices(self, vertices):
         '''
@@ -207,6 +197,7 @@ class DynamicKidneyGraph:
                     edges.append(NddEdge(new_graph.vs[trg_id], e.score))
             v.edges = edges
         
+        self.ndd_edge_index = NddEdgeIndex(self.ndds)
         self.digraph = new_graph
         self.digraph_id_name = digraph_id_name
         self.digraph_name_id = digraph_name_id
@@ -216,7 +207,8 @@ class DynamicKidneyGraph:
         Remove a set of ndds.
         '''
         for ndd in ndds:
-            self.ndds.pop(self.ndd_name_id[ndd])
+            ndd_id = self.ndd_name_id[ndd]
+            self.ndd_edge_index.remove_ndd(ndd_id, self.ndds.pop(ndd_id))
 
     def _get_vertices_from_edges(self, digraph_edges):
         '''
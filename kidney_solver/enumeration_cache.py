@@ -0,0 +1,232 @@
+"""An on-disk cache of enumerated cycles and chains.
+
+Entries are keyed by a fingerprint of the instance's edges, together with
+the cycle or chain cap (and, for chains, the edge success probability used
+to calculate chain scores). Each entry is a .npz file of flat arrays in
+the cache directory. A request for a cap that is lower than that of a
+cached entry is answered by filtering the entry, which gives the same
+result, in the same order, as a fresh enumeration.
+
+When the total size of the entries exceeds the cache's size limit, the
+least-recently-used entries are deleted. An entry's modification time
+records when it was last used.
+"""
+
+import hashlib
+import os
+import re
+import tempfile
+from array import array
+
+import numpy as np
+
+from kidney_digraph import CycleSet, _as_numpy
+from kidney_ndds import ChainSet, find_chain_set
+
+# The default maximum total size of a cache's entries
+DEFAULT_MAX_BYTES = 1 << 30
+
+def instance_fingerprint(digraph, ndds=None):
+    """Returns a hex digest of the digraph's vertex count and edges, and of
+    the edges of ndds if this is not None."""
+
+    h = hashlib.sha1()
+    h.update("digraph {} {}\n".format(digraph.n, len(digraph.edge_src)))
+    h.update(_as_numpy(digraph.edge_src, np.int32).tostring())
+    h.update(_as_numpy(digraph.edge_tgt, np.int32).tostring())
+    h.update(_as_numpy(digraph.edge_score, np.float64).tostring())
+    if ndds is not None:
+        h.update("ndds {}\n".format(len(ndds)))
+        for ndd in ndds:
+            h.update(np.array([e.target_v.id for e in ndd.edges], dtype=np.int32).tostring())
+            h.update(np.array([e.score for e in ndd.edges], dtype=np.float64).tostring())
+    return h.hexdigest()
+
+def _filter_by_length(offsets, max_length):
+    """Returns the indices of the sequences of a flat representation whose
+    lengths are at most max_length, and the positions of their elements."""
+
+    offsets = np.asarray(offsets, dtype=np.int64)
+    lengths = np.diff(offsets)
+    keep = np.flatnonzero(lengths <= max_length)
+    kept_lengths = lengths[keep]
+    positions = (np.repeat(offsets[keep] - np.cumsum(kept_lengths) + kept_lengths,
+                           kept_lengths) + np.arange(kept_lengths.sum()))
+    new_offsets = np.zeros(len(keep) + 1, dtype=np.int64)
+    np.cumsum(kept_lengths, out=new_offsets[1:])
+    return keep, positions, new_offsets
+
+class EnumerationCache(object):
+    """A size-bounded, least-recently-used cache of cycles and chains,
+    stored as files in a directory."""
+
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _path(self, name):
+        return os.path.join(self.directory, name + ".npz")
+
+    def _find_entry(self, prefix, suffix, cap):
+        """Returns the name of the cached entry named prefix + cap' + suffix
+        with the smallest cap' >= cap, or None if there is no such entry."""
+
+        pattern = re.compile(re.escape(prefix) + r"(\d+)" + re.escape(suffix) + r"\.npz$")
+        best = None
+        for filename in os.listdir(self.directory):
+            match = pattern.match(filename)
+            if match and int(match.group(1)) >= cap:
+                if best is None or int(match.group(1)) < best[0]:
+                    best = (int(match.group(1)), filename[:-len(".npz")])
+        return None if best is None else best[1]
+
+    def _load(self, name):
+        """Returns a dict of the arrays in an entry, marking it as used, or
+        None if the entry cannot be read (for example, because another
+        process has evicted it)."""
+
+        path = self._path(name)
+        try:
+            with np.load(path) as data:
+                arrays = {key: data[key] for key in data.files}
+            os.utime(path, None)
+        except (IOError, OSError, ValueError):
+            return None
+        return arrays
+
+    def _store(self, name, **arrays):
+        fd, tmp_path = tempfile.mkstemp(suffix=".tmp", dir=self.directory)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f, **arrays)
+            os.rename(tmp_path, self._path(name))
+        except:
+            os.remove(tmp_path)
+            raise
+        self.evict()
+
+    def evict(self):
+        """Delete least-recently-used entries until the total size of the
+        entries is at most max_bytes."""
+
+        entries = []
+        for filename in os.listdir(self.directory):
+            if filename.endswith(".npz"):
+                try:
+                    st = os.stat(os.path.join(self.directory, filename))
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, filename))
+        total_size = sum(size for __, size, __ in entries)
+        for __, size, filename in sorted(entries):
+            if total_size <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, filename))
+            except OSError:
+                pass
+            total_size -= size
+
+    def _find_cycle_arrays(self, digraph, max_length, jobs, with_scores):
+        """Returns a tuple (vertices, offsets, scores) of NumPy arrays of the
+        cycles of length up to max_length, from the cache if possible. If
+        with_scores is False, scores may be None."""
+
+        prefix = "{}-cycles-".format(instance_fingerprint(digraph))
+        name = self._find_entry(prefix, "", max_length)
+        arrays = None if name is None else self._load(name)
+        if arrays is None:
+            cycle_vertices, cycle_offsets = digraph.find_cycles_flat(max_length, jobs=jobs)
+            vertices = _as_numpy(cycle_vertices, np.int32)
+            offsets = _as_numpy(cycle_offsets, np.int64)
+            if not with_scores:
+                self._store(prefix + str(max_length), vertices=vertices, offsets=offsets)
+                return vertices, offsets, None
+            scores = CycleSet(digraph, vertices, offsets).scores
+            self._store(prefix + str(max_length), vertices=vertices, offsets=offsets,
+                        scores=scores)
+            return vertices, offsets, scores
+
+        vertices, offsets = arrays["vertices"], arrays["offsets"]
+        scores = arrays.get("scores")
+        if name != prefix + str(max_length):
+            keep, positions, offsets = _filter_by_length(offsets, max_length)
+            vertices = vertices[positions]
+            scores = None if scores is None else scores[keep]
+        if with_scores and scores is None:
+            scores = CycleSet(digraph, vertices, offsets).scores
+            if name == prefix + str(max_length):
+                # Add the scores to the entry
+                self._store(name, vertices=vertices, offsets=offsets, scores=scores)
+        return vertices, offsets, scores
+
+    def find_cycles_flat(self, digraph, max_length, jobs=1):
+        """Returns the result of digraph.find_cycles_flat(max_length,
+        jobs=jobs), from the cache if possible."""
+
+        vertices, offsets, __ = self._find_cycle_arrays(digraph, max_length, jobs, False)
+        cycle_vertices = array('i')
+        cycle_vertices.fromstring(vertices.astype(np.int32).tostring())
+        cycle_offsets = array('l')
+        cycle_offsets.fromstring(offsets.astype(np.dtype('l')).tostring())
+        return cycle_vertices, cycle_offsets
+
+    def find_cycle_set(self, digraph, max_length, jobs=1):
+        """Returns the result of digraph.find_cycle_set(max_length, jobs),
+        from the cache if possible. Cycle scores are cached too."""
+
+        vertices, offsets, scores = self._find_cycle_arrays(digraph, max_length, jobs, True)
+        return CycleSet(digraph, vertices, offsets, scores)
+
+    def find_chain_set(self, digraph, ndds, max_chain, edge_success_prob=1):
+        """Returns the result of find_chain_set(digraph, ndds, max_chain,
+        edge_success_prob), from the cache if possible."""
+
+        prefix = "{}-chains-".format(instance_fingerprint(digraph, ndds))
+        suffix = "-p{!r}".format(float(edge_success_prob))
+        name = self._find_entry(prefix, suffix, max_chain)
+        arrays = None if name is None else self._load(name)
+        if arrays is None:
+            chains = find_chain_set(digraph, ndds, max_chain, edge_success_prob)
+            self._store(prefix + str(max_chain) + suffix, ndd_indices=chains.ndd_indices,
+                        vertices=chains.vertices, offsets=chains.offsets, scores=chains.scores)
+            return chains
+
+        ndd_indices, vertices = arrays["ndd_indices"], arrays["vertices"]
+        offsets, scores = arrays["offsets"], arrays["scores"]
+        if name != prefix + str(max_chain) + suffix:
+            keep, positions, offsets = _filter_by_length(offsets, max_chain)
+            ndd_indices, vertices, scores = ndd_indices[keep], vertices[positions], scores[keep]
+        return ChainSet(ndd_indices, vertices, offsets, scores)
+
+    def find_chains(self, digraph, ndds, max_chain, edge_success_prob=1):
+        """Returns the result of find_chains(digraph, ndds, max_chain,
+        edge_success_prob), from the cache if possible."""
+
+        return list(self.find_chain_set(digraph, ndds, max_chain, edge_success_prob))
+
+def find_cycles_flat(digraph, max_length, jobs=1, cache=None):
+    """Find cycles as for Digraph.find_cycles_flat, using cache (an
+    EnumerationCache) if it is not None."""
+
+    if cache is None:
+        return digraph.find_cycles_flat(max_length, jobs=jobs)
+    return cache.find_cycles_flat(digraph, max_length, jobs)
+
+def find_cycle_set(digraph, max_length, jobs=1, cache=None):
+    """Find cycles as for Digraph.find_cycle_set, using cache (an
+    EnumerationCache) if it is not None."""
+
+    if cache is None:
+        return digraph.find_cycle_set(max_length, jobs)
+    return cache.find_cycle_set(digraph, max_length, jobs)
+
+def find_chain_set_cached(digraph, ndds, max_chain, edge_success_prob=1, cache=None):
+    """Find chains as for kidney_ndds.find_chain_set, using cache (an
+    EnumerationCache) if it is not None."""
+
+    if cache is None:
+        return find_chain_set(digraph, ndds, max_chain, edge_success_prob)
+    return cache.find_chain_set(digraph, ndds, max_chain, edge_success_prob)
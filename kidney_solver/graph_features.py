@@ -61,7 +61,7 @@ class GraphFeatures:
         return count_cycles_and_chains.count_cycles(self.graph.digraph, MAX_CYCLE)
 
     def calculate_chains(self):
-        return count_cycles_and_chains.count_chains(self.graph.digraph, self.graph.get_ndds(), MAX_CHAIN)
+        return count_cycles_and_chains.count_chains(self.graph.digraph, self.graph.ndds.values(), MAX_CHAIN)
 
     #~~~How to do this~~~
     def calculate_centrality(self):
@@ -0,0 +1,92 @@
+"""Removal of vertices and edges that cannot be in any cycle or chain.
+
+An edge can be in a cycle only if both of its endpoints are in the same
+strongly connected component (SCC) of the digraph, and it can be in a chain
+only if its source can be reached from an NDD by a chain with fewer than
+max_chain edges. Removing the other edges, and any vertices left without a
+use, shrinks every formulation's model without changing its optimal
+objective value.
+"""
+
+import numpy as np
+
+from kidney_digraph import digraph_from_arrays, _as_numpy
+from kidney_ndds import Ndd, NddEdge
+import kidney_utils
+
+class GraphReduction(object):
+    """A reduced copy of an instance.
+
+    Data members:
+        digraph: the reduced Digraph
+        ndds: the reduced list of NDDs. NDD i of the reduced list
+            corresponds to NDD i of the original list.
+        kept_vertices: a list such that vertex i of the reduced digraph
+            corresponds to the original Vertex kept_vertices[i]
+        original_vertex_count, original_edge_count, original_ndd_edge_count:
+            the sizes of the original instance
+    """
+
+    def __init__(self, digraph, ndds, kept_vertices, original_digraph, original_ndds):
+        self.digraph = digraph
+        self.ndds = ndds
+        self.kept_vertices = kept_vertices
+        self.original_vertex_count = original_digraph.n
+        self.original_edge_count = len(original_digraph.es)
+        self.original_ndd_edge_count = sum(len(ndd.edges) for ndd in original_ndds)
+
+    def display(self):
+        """Print the sizes of the original and reduced instances to standard
+        output."""
+
+        print "reduction_vertices: {} of {}".format(self.digraph.n, self.original_vertex_count)
+        print "reduction_edges: {} of {}".format(len(self.digraph.es), self.original_edge_count)
+        print "reduction_ndd_edges: {} of {}".format(
+                sum(len(ndd.edges) for ndd in self.ndds), self.original_ndd_edge_count)
+
+def reduce_instance(digraph, ndds, max_cycle, max_chain):
+    """Remove the vertices and edges that cannot be in any cycle with at
+    most max_cycle vertices or in any chain with at most max_chain edges
+    (including the edge from the NDD).
+
+    The remaining vertices and edges keep their relative order.
+
+    Returns:
+        a GraphReduction
+    """
+
+    n = digraph.n
+    edge_src = _as_numpy(digraph.edge_src, np.int64)
+    edge_tgt = _as_numpy(digraph.edge_tgt, np.int64)
+
+    keep_edge = np.zeros(len(edge_src), dtype=bool)
+    if max_cycle >= 2:
+        component_ids = np.array(digraph.strongly_connected_components(), dtype=np.int64)
+        keep_edge |= component_ids[edge_src] == component_ids[edge_tgt]
+    if max_chain > 0:
+        dists_from_ndd = np.array(kidney_utils.get_dist_from_nearest_ndd(digraph, ndds),
+                                  dtype=np.int64)
+        keep_edge |= dists_from_ndd[edge_src] < max_chain
+
+    keep_vtx = np.zeros(n, dtype=bool)
+    keep_vtx[edge_src[keep_edge]] = True
+    keep_vtx[edge_tgt[keep_edge]] = True
+    if max_chain > 0:
+        keep_vtx |= dists_from_ndd == 1
+
+    kept_ids = np.flatnonzero(keep_vtx)
+    new_ids = np.full(n, -1, dtype=np.int64)
+    new_ids[kept_ids] = np.arange(len(kept_ids))
+    reduced_digraph = digraph_from_arrays(
+            len(kept_ids), new_ids[edge_src[keep_edge]], new_ids[edge_tgt[keep_edge]],
+            _as_numpy(digraph.edge_score, np.float64)[keep_edge])
+
+    reduced_ndds = [Ndd() for __ in ndds]
+    if max_chain > 0:
+        vs = reduced_digraph.vs
+        for reduced_ndd, ndd in zip(reduced_ndds, ndds):
+            for e in ndd.edges:
+                reduced_ndd.add_edge(NddEdge(vs[int(new_ids[e.target_v.id])], e.score))
+
+    kept_vertices = [digraph.vs[v_id] for v_id in kept_ids.tolist()]
+    return GraphReduction(reduced_digraph, reduced_ndds, kept_vertices, digraph, ndds)
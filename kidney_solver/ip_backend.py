@@ -0,0 +1,418 @@
+"""Interfaces to the IP solvers used by the formulations.
+
+Each formulation builds and solves its model through an IPModel, created by
+create_model, so that the same code can be solved by Gurobi or, on machines
+without a Gurobi licence, by the open-source CBC solver through PuLP. The
+models are maximisation problems. Variables are the solver's own variable
+objects, and are passed to the model's methods in lists; their values are
+read with get_values after solving.
+
+gurobipy and pulp are imported only if they are installed, and a backend
+fails when a model is created if its solver is not available.
+"""
+
+import time
+
+try:
+    import gurobipy
+except ImportError:
+    gurobipy = None
+
+try:
+    import pulp
+except ImportError:
+    pulp = None
+
+GUROBI = "gurobi"
+CBC = "cbc"
+BACKENDS = (GUROBI, CBC)
+
+# Constraint senses
+LESS_EQUAL = "<="
+GREATER_EQUAL = ">="
+EQUAL = "=="
+
+class IPModel(object):
+    """A maximisation IP model. The subclasses implement the methods for
+    each solver.
+
+    Data members (read-only, and meaningful only after optimize):
+        obj_val: the objective value of the solution
+        status: the solver's status for the solve
+        is_optimal: True if and only if the solver proved its solution optimal
+        runtime: the time spent solving, in seconds
+        build_time: the time in seconds from the model's creation until
+            optimize was first called
+        num_vars, num_constrs: the size of the model
+    """
+
+    def __init__(self):
+        self.created_time = time.time()
+        self.build_time = None
+
+    def _stop_build_timer(self):
+        """Record build_time, if optimize has not been called before."""
+
+        if self.build_time is None:
+            self.build_time = time.time() - self.created_time
+
+    def add_binary_vars(self, count):
+        """Add count binary variables, and return them as a list."""
+        raise NotImplementedError
+
+    def add_column(self, obj, constrs):
+        """Add a non-negative continuous variable with objective coefficient
+        obj and coefficient 1 in each constraint in the list constrs (as
+        returned by add_constr), and return it."""
+        raise NotImplementedError
+
+    def set_binary(self, variables):
+        """Make each of a list of variables binary."""
+        raise NotImplementedError
+
+    def add_constr(self, variables, coeffs, sense, rhs):
+        """Add the constraint that the sum of the variables, each multiplied
+        by the corresponding element of coeffs (or by 1 if coeffs is None),
+        is LESS_EQUAL, GREATER_EQUAL or EQUAL to rhs, and return it."""
+        raise NotImplementedError
+
+    def set_objective(self, variables, coeffs):
+        """Maximise the sum of the variables multiplied by coeffs."""
+        raise NotImplementedError
+
+    def set_start(self, start_vars):
+        """Give the solver a complete starting solution, in which the
+        variables in start_vars are 1 and all other variables are 0."""
+        raise NotImplementedError
+
+    def optimize(self, lazy_cuts=None):
+        """Solve the model.
+
+        If lazy_cuts is not None, it is called with a function get_values
+        (like the get_values method) for each integer solution that the
+        solver finds, and must return a list of (variables, bound) pairs,
+        each meaning that at most bound of the variables may be 1. These
+        constraints are added to the model, and the solution is rejected
+        if it violates them.
+        """
+        raise NotImplementedError
+
+    def get_values(self, variables):
+        """Returns the values of a list of variables in the solution."""
+        raise NotImplementedError
+
+    def get_duals(self, constrs):
+        """Returns the dual values of a list of constraints, after an LP
+        (a model with no integer variables) has been solved."""
+        raise NotImplementedError
+
+    def solve_relaxation(self):
+        """Solve the LP relaxation of the model, and return a pair
+        (objective value, solver status)."""
+        raise NotImplementedError
+
+    def write(self, filename):
+        """Write the model to a .lp file."""
+        raise NotImplementedError
+
+###################################################################################################
+#                                                                                                 #
+#                                              Gurobi                                             #
+#                                                                                                 #
+###################################################################################################
+
+class GurobiModel(IPModel):
+    """An IPModel solved by Gurobi."""
+
+    def __init__(self, time_limit, verbose, barrier=False, presolve=True):
+        if gurobipy is None:
+            raise ImportError("The gurobi backend requires gurobipy")
+        IPModel.__init__(self)
+        self.model = gurobipy.Model("kidney-mip")
+        if not verbose:
+            self.model.params.outputflag = 0
+        self.model.params.mipGap = 0
+        if time_limit is not None:
+            self.model.params.timelimit = time_limit
+        if barrier:
+            self.model.params.method = 2
+        if not presolve:
+            self.model.params.presolve = 0
+
+    def add_binary_vars(self, count):
+        if count == 0:
+            return []
+        new_vars = self.model.addVars(count, vtype=gurobipy.GRB.BINARY)
+        self.model.update()
+        return [new_vars[i] for i in range(count)]
+
+    def add_column(self, obj, constrs):
+        var = self.model.addVar(obj=obj, vtype=gurobipy.GRB.CONTINUOUS,
+                                column=gurobipy.Column([1.0] * len(constrs), constrs))
+        self.model.update()
+        return var
+
+    def set_binary(self, variables):
+        for var in variables:
+            var.vtype = gurobipy.GRB.BINARY
+        self.model.update()
+
+    def add_constr(self, variables, coeffs, sense, rhs):
+        if coeffs is None:
+            coeffs = [1.0] * len(variables)
+        expr = gurobipy.LinExpr(coeffs, variables)
+        if sense == LESS_EQUAL:
+            return self.model.addConstr(expr <= rhs)
+        elif sense == GREATER_EQUAL:
+            return self.model.addConstr(expr >= rhs)
+        else:
+            return self.model.addConstr(expr == rhs)
+
+    def set_objective(self, variables, coeffs):
+        self.model.setObjective(gurobipy.LinExpr(coeffs, variables), gurobipy.GRB.MAXIMIZE)
+
+    def set_start(self, start_vars):
+        self.model.update()
+        all_vars = self.model.getVars()
+        self.model.setAttr(gurobipy.GRB.Attr.Start, all_vars, [0.0] * len(all_vars))
+        self.model.setAttr(gurobipy.GRB.Attr.Start, start_vars, [1.0] * len(start_vars))
+
+    def optimize(self, lazy_cuts=None):
+        # Apply the pending changes, so that they count towards build_time
+        self.model.update()
+        self._stop_build_timer()
+        if lazy_cuts is None:
+            self.model.optimize()
+            return
+
+        def callback(model, where):
+            if where != gurobipy.GRB.Callback.MIPSOL:
+                return
+            for variables, bound in lazy_cuts(model.cbGetSolution):
+                model.cbLazy(gurobipy.LinExpr([1.0] * len(variables), variables) <= bound)
+
+        self.model.params.lazyConstraints = 1
+        self.model.optimize(callback)
+
+    def get_values(self, variables):
+        if not variables:
+            return []
+        return self.model.getAttr(gurobipy.GRB.Attr.X, variables)
+
+    def get_duals(self, constrs):
+        if not constrs:
+            return []
+        return self.model.getAttr(gurobipy.GRB.Attr.Pi, constrs)
+
+    def solve_relaxation(self):
+        self.model.update()
+        r = self.model.relax()
+        r.optimize()
+        return r.ObjVal, r.Status
+
+    def write(self, filename):
+        self.model.update()
+        self.model.write(filename)
+
+    @property
+    def obj_val(self):
+        return self.model.ObjVal
+
+    @property
+    def status(self):
+        return self.model.Status
+
+    @property
+    def is_optimal(self):
+        return self.model.Status == gurobipy.GRB.OPTIMAL
+
+    @property
+    def runtime(self):
+        return self.model.Runtime
+
+    @property
+    def num_vars(self):
+        return self.model.NumVars
+
+    @property
+    def num_constrs(self):
+        return self.model.NumConstrs
+
+###################################################################################################
+#                                                                                                 #
+#                                          CBC (via PuLP)                                         #
+#                                                                                                 #
+###################################################################################################
+
+def _cbc_solver(**options):
+    """Returns a PuLP solver object for CBC, using the CBC binary bundled
+    with PuLP if it can run here, or else a cbc on the path."""
+
+    solver = pulp.PULP_CBC_CMD(**options)
+    if not solver.available():
+        solver = pulp.COIN_CMD(**options)
+    return solver
+
+class CbcModel(IPModel):
+    """An IPModel solved by CBC, through PuLP.
+
+    CBC has no callback for lazy constraints, so optimize re-solves the
+    model each time lazy_cuts returns new constraints. The time limit
+    applies to the whole sequence of solves; if it runs out before a
+    solution satisfies the lazy constraints, the model has no solution. The
+    barrier and presolve options of create_model are ignored.
+    """
+
+    def __init__(self, time_limit, verbose, barrier=False, presolve=True):
+        if pulp is None:
+            raise ImportError("The cbc backend requires pulp")
+        IPModel.__init__(self)
+        self.problem = pulp.LpProblem("kidney-mip", pulp.LpMaximize)
+        self.time_limit = time_limit
+        self.verbose = verbose
+        self.variables = []
+        self.warm_start = False
+        self.has_solution = False
+        self.status = None
+        self.runtime = 0.0
+
+    def _linear_expr(self, variables, coeffs):
+        # Repeated variables are summed, as in a Gurobi LinExpr
+        expr = pulp.LpAffineExpression()
+        for var, coeff in zip(variables, coeffs):
+            expr.addterm(var, coeff)
+        return expr
+
+    def add_binary_vars(self, count):
+        start = len(self.variables)
+        new_vars = [pulp.LpVariable("x{}".format(i), cat=pulp.LpBinary)
+                    for i in range(start, start + count)]
+        self.problem.addVariables(new_vars)
+        self.variables.extend(new_vars)
+        return new_vars
+
+    def add_column(self, obj, constrs):
+        var = pulp.LpVariable("x{}".format(len(self.variables)), lowBound=0)
+        self.problem.addVariable(var)
+        self.variables.append(var)
+        self.problem.objective.addterm(var, obj)
+        for constr in constrs:
+            constr.addterm(var, 1.0)
+        return var
+
+    def set_binary(self, variables):
+        for var in variables:
+            var.cat = pulp.LpInteger
+            var.lowBound = 0
+            var.upBound = 1
+
+    def add_constr(self, variables, coeffs, sense, rhs):
+        if coeffs is None:
+            coeffs = [1.0] * len(variables)
+        pulp_sense = {LESS_EQUAL: pulp.LpConstraintLE,
+                      GREATER_EQUAL: pulp.LpConstraintGE,
+                      EQUAL: pulp.LpConstraintEQ}[sense]
+        constr = pulp.LpConstraint(self._linear_expr(variables, coeffs), pulp_sense, rhs=rhs)
+        self.problem.addConstraint(constr, "c{}".format(len(self.problem.constraints)))
+        return constr
+
+    def set_objective(self, variables, coeffs):
+        self.problem.setObjective(self._linear_expr(variables, coeffs))
+
+    def set_start(self, start_vars):
+        for var in self.variables:
+            var.setInitialValue(0)
+        for var in start_vars:
+            var.setInitialValue(1)
+        self.warm_start = True
+
+    def _solve(self, time_limit):
+        solver = _cbc_solver(msg=self.verbose, timeLimit=time_limit, gapRel=0,
+                             warmStart=self.warm_start)
+        self.problem.solve(solver)
+        self.status = pulp.LpStatus[self.problem.status]
+        self.has_solution = self.problem.sol_status in (pulp.LpSolutionOptimal,
+                                                        pulp.LpSolutionIntegerFeasible)
+
+    def optimize(self, lazy_cuts=None):
+        self._stop_build_timer()
+        start_time = time.time()
+        time_limit = self.time_limit
+        while True:
+            self._solve(time_limit)
+            if lazy_cuts is None or not self.has_solution:
+                break
+            cuts = lazy_cuts(self.get_values)
+            if not cuts:
+                break
+            for variables, bound in cuts:
+                self.add_constr(variables, None, LESS_EQUAL, bound)
+            if self.time_limit is not None:
+                time_limit = self.time_limit - (time.time() - start_time)
+                if time_limit <= 0:
+                    self.has_solution = False
+                    self.status = pulp.LpStatus[pulp.LpStatusNotSolved]
+                    break
+        self.runtime = time.time() - start_time
+
+    def get_values(self, variables):
+        if not self.has_solution:
+            raise RuntimeError("CBC found no solution ({})".format(self.status))
+        return [var.varValue or 0.0 for var in variables]
+
+    def get_duals(self, constrs):
+        return [constr.pi or 0.0 for constr in constrs]
+
+    def solve_relaxation(self):
+        categories = [var.cat for var in self.variables]
+        for var in self.variables:
+            var.cat = pulp.LpContinuous
+        try:
+            self._solve(self.time_limit)
+        finally:
+            for var, cat in zip(self.variables, categories):
+                var.cat = cat
+        return self.obj_val, self.status
+
+    def write(self, filename):
+        self.problem.writeLP(filename)
+
+    @property
+    def obj_val(self):
+        # PuLP adds a dummy variable, with no value, to an empty objective
+        objective = self.problem.objective
+        return objective.constant + sum(coeff * (var.varValue or 0.0)
+                                        for var, coeff in objective.items())
+
+    @property
+    def is_optimal(self):
+        # After a time limit, PuLP reports the status as optimal but the
+        # solution status as merely feasible
+        return self.has_solution and self.problem.sol_status == pulp.LpSolutionOptimal
+
+    @property
+    def num_vars(self):
+        return len(self.variables)
+
+    @property
+    def num_constrs(self):
+        return len(self.problem.constraints)
+
+def create_model(backend, time_limit, verbose, barrier=False, presolve=True):
+    """Create an IPModel.
+
+    Args:
+        backend: the name of the solver, GUROBI or CBC
+        time_limit: the solver time limit in seconds, or None
+        verbose: True if and only if solver output should be shown
+        barrier: True if the LP relaxations should be solved by the barrier
+            method (a hint that is used only by Gurobi)
+        presolve: False if presolve should be turned off (used only by Gurobi)
+    """
+
+    if backend == GUROBI:
+        return GurobiModel(time_limit, verbose, barrier, presolve)
+    elif backend == CBC:
+        return CbcModel(time_limit, verbose, barrier, presolve)
+    else:
+        raise ValueError("Unrecognised IP solver backend: {}".format(backend))
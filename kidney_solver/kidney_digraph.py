@@ -3,11 +3,21 @@
 some related methods.
 """
 
+from array import array
 from collections import deque
 
+import numpy as np
+
 class KidneyReadException(Exception):
     pass
 
+# The distance used to represent unreachable vertices in shortest-path arrays
+_INFINITY = 999999999
+
+# The distance used to represent unreachable vertices in the int8 distance
+# matrices computed by BoundedBfsEngine
+INT8_UNREACHABLE = 127
+
 def cycle_score(cycle, digraph):
     """Calculate the sum of a cycle's edge scores.
 
@@ -16,7 +26,7 @@ def cycle_score(cycle, digraph):
         digraph: The digraph in which this cycle appears.
     """
 
-    return sum(digraph.adj_mat[cycle[i-1].id][cycle[i].id].score
+    return sum(digraph.get_edge(cycle[i-1].id, cycle[i].id).score
                         for i in range(len(cycle)))
 
 def failure_aware_cycle_score(cycle, digraph, edge_success_prob):
@@ -28,46 +38,619 @@ def failure_aware_cycle_score(cycle, digraph, edge_success_prob):
         edge_success_prob: The problem that any given edge will NOT fail
     """
 
-    return sum(digraph.adj_mat[cycle[i-1].id][cycle[i].id].score
+    return sum(digraph.get_edge(cycle[i-1].id, cycle[i].id).score
                     for i in range(len(cycle))) * edge_success_prob**len(cycle)
 
-class Vertex:
-    """A vertex in a directed graph (see the Digraph class)."""
+class Vertex(object):
+    """A vertex in a directed graph (see the Digraph class).
 
-    def __init__(self, id):
+    A Vertex is a lightweight view onto its Digraph; its out-edges are read
+    from the digraph's edge arrays each time the edges attribute is accessed.
+    """
+
+    __slots__ = ('id', 'digraph')
+
+    def __init__(self, id, digraph):
         self.id = id
-        self.edges = []
+        self.digraph = digraph
+
+    @property
+    def edges(self):
+        """A list of the Edges leaving this vertex."""
+        csr = self.digraph.csr()
+        return [Edge(edge_id, self.digraph)
+                for edge_id in csr.edge_ids[csr.offsets[self.id]:csr.offsets[self.id+1]]]
 
     def __str__(self):
         return ("V{}".format(self.id))
 
-class Edge:
-    """An edge in a directed graph (see the Digraph class)."""
+class Edge(object):
+    """An edge in a directed graph (see the Digraph class).
 
-    def __init__(self, id, score, src, tgt):
+    An Edge is a lightweight view of position id in its Digraph's parallel
+    source, target and score arrays. Two Edge objects viewing the same edge
+    compare equal.
+    """
+
+    __slots__ = ('id', 'digraph')
+
+    def __init__(self, id, digraph):
         self.id = id
-        self.score = score
-        self.src = src   # source vertex
-        self.tgt = tgt # target vertex
+        self.digraph = digraph
+
+    @property
+    def src(self):
+        """The source Vertex"""
+        return self.digraph.vs[self.digraph.edge_src[self.id]]
+
+    @property
+    def tgt(self):
+        """The target Vertex"""
+        return self.digraph.vs[self.digraph.edge_tgt[self.id]]
+
+    @property
+    def score(self):
+        return self.digraph.edge_score[self.id]
+
+    def __eq__(self, other):
+        return (isinstance(other, Edge) and self.id == other.id and
+                self.digraph is other.digraph)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.id)
 
     def __str__(self):
         return ("V" + str(self.src.id) + "-V" + str(self.tgt.id))
 
+class EdgeList(object):
+    """A read-only sequence of Edge views, one for each edge of a Digraph."""
+
+    __slots__ = ('digraph',)
+
+    def __init__(self, digraph):
+        self.digraph = digraph
+
+    def __len__(self):
+        return len(self.digraph.edge_src)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [Edge(j, self.digraph) for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("edge index out of range")
+        return Edge(i, self.digraph)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield Edge(i, self.digraph)
+
+class CsrAdjacency(object):
+    """A compressed sparse row (CSR) representation of a digraph's edges.
+
+    The out-edges of vertex v occupy positions offsets[v] to offsets[v+1]-1
+    of the targets, scores and edge_ids arrays, in the order in which the
+    edges were added to the digraph.
+
+    Data members:
+        offsets: an array of n+1 positions
+        targets: the target vertex ID of each edge
+        scores: the score of each edge
+        edge_ids: the ID of each Edge object
+    """
+
+    def __init__(self, n, edge_src, edge_tgt, edge_score):
+        edge_src = _as_numpy(edge_src, np.int64)
+        # A stable sort keeps each vertex's out-edges in the order added
+        order = np.argsort(edge_src, kind='mergesort')
+        offsets = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(edge_src, minlength=n), out=offsets[1:])
+
+        self.offsets = _to_array('l', offsets)
+        self.targets = _to_array('l', _as_numpy(edge_tgt, np.int64)[order])
+        self.scores = _to_array('d', _as_numpy(edge_score, np.float64)[order])
+        self.edge_ids = _to_array('l', order)
+
+def _as_numpy(values, dtype):
+    """Returns values as a NumPy array of the given dtype. An array.array is
+    viewed through its buffer rather than iterated over."""
+
+    if isinstance(values, array):
+        values = np.frombuffer(values, dtype=values.typecode)
+    return np.asarray(values, dtype=dtype)
+
+def _to_array(typecode, values):
+    """Copy a NumPy array into a new array.array with the given typecode."""
+
+    result = array(typecode)
+    result.fromstring(np.asarray(values, dtype=np.dtype(typecode)).tostring())
+    return result
+
+class BoundedBfsEngine(object):
+    """Computes bounded breadth-first search distances from many low vertices
+    at once, using NumPy arrays.
+
+    For a low vertex v, only vertices with index greater than v may be
+    visited. The searches for a batch of low vertices are carried out
+    together, one level at a time. While the frontier is small, it is held as
+    arrays of (low vertex, vertex) pairs and expanded using the CSR arrays;
+    once expanding it sparsely would cost more than a dense step, the next
+    level is found by multiplying the frontier matrix by a dense adjacency
+    matrix (if the graph is small enough for one to be stored).
+
+    Data members:
+        n: the number of vertices
+        offsets, targets: the CSR arrays, as NumPy arrays
+    """
+
+    # Maximum number of low vertices searched together
+    BATCH_SIZE = 256
+
+    # The dense adjacency matrix is only used for graphs with at most this
+    # many vertices
+    MAX_DENSE_N = 4096
+
+    # A dense step for b low vertices is used if there are more than
+    # b*n*n/DENSE_COST_RATIO candidate pairs to expand sparsely
+    DENSE_COST_RATIO = 256
+
+    def __init__(self, n, csr):
+        self.n = n
+        self.offsets = np.frombuffer(csr.offsets, dtype=csr.offsets.typecode).astype(np.int64)
+        self.targets = np.frombuffer(csr.targets, dtype=csr.targets.typecode).astype(np.int64)
+        self._degrees = np.diff(self.offsets)
+        self._dense_adj = None
+
+    def _get_dense_adj(self):
+        if self._dense_adj is None:
+            # Fill the matrix before publishing it, so that a thread sharing
+            # the digraph never sees it half-built
+            dense_adj = np.zeros((self.n, self.n), dtype=np.float32)
+            srcs = np.repeat(np.arange(self.n), self._degrees)
+            dense_adj[srcs, self.targets] = 1
+            self._dense_adj = dense_adj
+        return self._dense_adj
+
+    def distances(self, low_vertices, max_dist):
+        """Returns an int8 array dist of shape (len(low_vertices), n), where
+        dist[i, w] is the length of the shortest path from low_vertices[i] to
+        w through vertices with higher indices than low_vertices[i] if that
+        length is at most max_dist, or INT8_UNREACHABLE otherwise.
+
+        Args:
+            low_vertices: a sequence of vertex IDs
+            max_dist: the maximum distance of interest (at most 126)
+        """
+
+        if max_dist >= INT8_UNREACHABLE:
+            raise ValueError("max_dist must be less than {}".format(INT8_UNREACHABLE))
+        n = self.n
+        low_vertices = np.asarray(low_vertices, dtype=np.int64)
+        b = len(low_vertices)
+        dist = np.full((b, n), INT8_UNREACHABLE, dtype=np.int8)
+        frontier_rows = np.arange(b)
+        frontier_v = low_vertices
+        dist[frontier_rows, frontier_v] = 0
+        use_dense = n <= self.MAX_DENSE_N
+
+        for d in range(1, max_dist + 1):
+            degs = self._degrees[frontier_v]
+            n_candidates = degs.sum()
+            if n_candidates == 0:
+                break
+            if use_dense and n_candidates * self.DENSE_COST_RATIO > b * n * n:
+                frontier = np.zeros((b, n), dtype=np.float32)
+                frontier[frontier_rows, frontier_v] = 1
+                reached = np.dot(frontier, self._get_dense_adj()) > 0
+                reached &= dist == INT8_UNREACHABLE
+                reached &= np.arange(n)[None, :] > low_vertices[:, None]
+                frontier_rows, frontier_v = np.nonzero(reached)
+                dist[reached] = d
+                continue
+
+            # Candidate (row, w) pairs, for each edge u->w from each frontier pair (row, u)
+            first_candidate = np.cumsum(degs) - degs
+            edge_pos = (np.repeat(self.offsets[frontier_v] - first_candidate, degs) +
+                        np.arange(n_candidates))
+            rows = np.repeat(frontier_rows, degs)
+            ws = self.targets[edge_pos]
+            keep = ws > low_vertices[rows]
+            rows = rows[keep]
+            ws = ws[keep]
+            keep = dist[rows, ws] == INT8_UNREACHABLE
+            # Keep one copy of each pair
+            pairs = np.unique(rows[keep] * n + ws[keep])
+            frontier_rows = pairs // n
+            frontier_v = pairs % n
+            dist[frontier_rows, frontier_v] = d
+
+        return dist
+
+    def generate_rows(self, low_vertices, max_dist):
+        """Generate (low_vtx, dist_row) pairs, where dist_row is the row
+        of the matrix returned by distances() for low_vtx. The distances are
+        computed in batches of BATCH_SIZE low vertices."""
+
+        low_vertices = list(low_vertices)
+        for start in range(0, len(low_vertices), self.BATCH_SIZE):
+            batch = low_vertices[start:start+self.BATCH_SIZE]
+            dist = self.distances(batch, max_dist)
+            for i, low_vtx in enumerate(batch):
+                yield low_vtx, dist[i]
+
+class CycleEnumerator(object):
+    """Finds the cycles of a digraph with up to max_length vertices, working
+    on integer vertex IDs and the digraph's CSR arrays.
+
+    Cycles are found separately for each "low" vertex: the cycles found for
+    low vertex v are those in which v is the lowest-indexed vertex, and each
+    cycle starts with v. The search uses an explicit stack rather than
+    recursion, and prunes any path that cannot return to the low vertex
+    within the cycle cap, using the lengths of shortest paths to the low
+    vertex. The search buffers are allocated once and reused for every low
+    vertex.
+    """
+
+    def __init__(self, digraph, max_length):
+        self.n = digraph.n
+        self.max_length = max_length
+        csr = digraph.csr()
+        # Out-neighbour and in-neighbour IDs of each vertex, as tuples
+        self.out_nbrs = [tuple(csr.targets[csr.offsets[v]:csr.offsets[v+1]])
+                         for v in range(digraph.n)]
+        transp = digraph.transpose_csr()
+        self.in_nbrs = [tuple(transp.targets[transp.offsets[v]:transp.offsets[v+1]])
+                        for v in range(digraph.n)]
+        # Searches backwards from the low vertices, for add_cycles_for_low_vertices
+        self.bfs_engine = BoundedBfsEngine(digraph.n, transp)
+
+        # dist_to_low[v] is the length of the shortest path from v to the
+        # current low vertex, or _INFINITY if it is longer than max_length-1
+        self.dist_to_low = [_INFINITY] * digraph.n
+        self.vtx_used = [False] * digraph.n
+        self.path = [0] * max(max_length, 1)
+        self.iters = [None] * max(max_length, 1)
+
+    def _set_distances_to_low_vtx(self, low_vtx):
+        """Fill dist_to_low with distances to low_vtx, using only paths through
+        vertices with higher indices. Returns the list of vertices whose distance
+        was set, so that they can be reset afterwards."""
+
+        in_nbrs = self.in_nbrs
+        dist = self.dist_to_low
+        dist[low_vtx] = 0
+        touched = [low_vtx]
+        frontier = [low_vtx]
+        d = 0
+        while frontier and d < self.max_length - 1:
+            d += 1
+            next_frontier = []
+            for u in frontier:
+                for w in in_nbrs[u]:
+                    if w > low_vtx and dist[w] == _INFINITY:
+                        dist[w] = d
+                        next_frontier.append(w)
+            touched += next_frontier
+            frontier = next_frontier
+        return touched
+
+    def _set_distances_from_row(self, dist_row):
+        """Fill dist_to_low from a row of distances computed by bfs_engine,
+        and return the list of vertices whose distance was set."""
+
+        dist = self.dist_to_low
+        touched = np.flatnonzero(dist_row != INT8_UNREACHABLE)
+        for v, d in zip(touched.tolist(), dist_row[touched].tolist()):
+            dist[v] = d
+        return touched.tolist()
+
+    def _distance_list(self, dist_row):
+        """Returns a pair (dist, touched), where dist is a list of distances to
+        the low vertex built from dist_row, and touched is the list of entries
+        of dist that must be reset to _INFINITY afterwards.
+
+        If most vertices are reachable, a new list is returned in which
+        unreachable vertices have distance INT8_UNREACHABLE (which is greater
+        than any permitted cycle length); otherwise, dist_to_low is filled
+        in."""
+
+        if np.count_nonzero(dist_row != INT8_UNREACHABLE) * 8 > self.n:
+            return dist_row.tolist(), []
+        return self.dist_to_low, self._set_distances_from_row(dist_row)
+
+    def add_cycles_for_low_vertices(self, low_vertices, cycle_vertices, cycle_offsets,
+                                    counts_by_size=None):
+        """Call add_cycles for each vertex in the iterable low_vertices, in
+        order. The distances to the low vertices are computed in batches by
+        bfs_engine."""
+
+        if self.max_length < 2:
+            return
+        if self.max_length > INT8_UNREACHABLE:
+            for low_vtx in low_vertices:
+                self.add_cycles(low_vtx, cycle_vertices, cycle_offsets, counts_by_size)
+            return
+        for low_vtx, dist_row in self.bfs_engine.generate_rows(low_vertices, self.max_length - 1):
+            self.add_cycles(low_vtx, cycle_vertices, cycle_offsets, counts_by_size, dist_row)
+
+    def add_cycles(self, low_vtx, cycle_vertices, cycle_offsets, counts_by_size=None,
+                   dist_row=None):
+        """Find the cycles whose lowest-indexed vertex is low_vtx.
+
+        Each cycle's vertex IDs are appended to the cycle_vertices array,
+        starting with low_vtx, and the end position of the cycle in
+        cycle_vertices is appended to cycle_offsets. If counts_by_size is not
+        None, the cycles are not stored; instead, counts_by_size[k] is
+        incremented for each cycle with k vertices.
+
+        If dist_row is not None, it is low_vtx's row of the distance matrix
+        computed by bfs_engine for max_dist=max_length-1; otherwise, the
+        distances to low_vtx are found by a breadth-first search.
+
+        The cycles are collected in list buffers, which are faster to extend
+        than arrays, and copied to the output arrays in one step.
+        """
+
+        max_length = self.max_length
+        if max_length < 2:
+            return
+
+        out_nbrs = self.out_nbrs
+        used = self.vtx_used
+        path = self.path
+        iters = self.iters
+        store = counts_by_size is None
+        vertices_buf = []
+        # The end positions of the cycles in cycle_vertices
+        ends_buf = []
+        base = len(cycle_vertices) if store else 0
+
+        if dist_row is None:
+            dist = self.dist_to_low
+            touched = self._set_distances_to_low_vtx(low_vtx)
+        else:
+            dist, touched = self._distance_list(dist_row)
+
+        # closing[w] lists the out-neighbours of w with an edge to the low
+        # vertex, for each w that has been the second-last vertex of a path
+        closing = {}
+
+        path[0] = low_vtx
+        used[low_vtx] = True
+        iters[0] = iter(out_nbrs[low_vtx])
+        depth = 0   # path[:depth+1] is the current path
+        while depth >= 0:
+            # Find the next vertex w that may extend the current path
+            path_len = depth + 1
+            for w in iters[depth]:
+                if path_len + dist[w] <= max_length and not used[w]:
+                    break
+            else:
+                used[path[depth]] = False
+                depth -= 1
+                continue
+            depth += 1
+            path[depth] = w
+            if dist[w] == 1:
+                # There is an edge from w back to the low vertex
+                if store:
+                    vertices_buf.extend(path[:depth+1])
+                    ends_buf.append(base + len(vertices_buf))
+                else:
+                    counts_by_size[depth+1] += 1
+            if depth + 2 < max_length:
+                used[w] = True
+                iters[depth] = iter(out_nbrs[w])
+            else:
+                if depth + 2 == max_length:
+                    # Any vertex added after w would be the last in its cycle,
+                    # so it must be one of w's closing targets
+                    xs = closing.get(w)
+                    if xs is None:
+                        xs = closing[w] = [x for x in out_nbrs[w] if dist[x] == 1]
+                    if xs:
+                        for v in path[1:depth]:
+                            if v in xs:
+                                xs = [x for x in xs if not used[x]]
+                                break
+                        k = len(xs)
+                        if not store:
+                            counts_by_size[max_length] += k
+                        elif k:
+                            # Write the k cycles, which share all but their
+                            # last vertex, in one step
+                            block = (path[:depth+1] + [0]) * k
+                            block[max_length-1::max_length] = xs
+                            start = base + len(vertices_buf)
+                            vertices_buf.extend(block)
+                            ends_buf.extend(xrange(start + max_length,
+                                                   start + len(block) + 1, max_length))
+                depth -= 1
+
+        for v in touched:
+            dist[v] = _INFINITY
+
+        if ends_buf:
+            cycle_vertices.fromlist(vertices_buf)
+            cycle_offsets.fromlist(ends_buf)
+
+class CycleSet(object):
+    """A collection of cycles in a digraph, stored in flat NumPy arrays.
+
+    Cycle i has vertex IDs vertices[offsets[i]:offsets[i+1]]. Indexing a
+    CycleSet with an integer returns this slice of vertices (a view, not a
+    copy), and iterating over it yields these slices in order. Indexing it
+    with a slice returns a CycleSet that shares the arrays of the original.
+
+    The vertex-to-cycle incidence structure (see the vertex_incidence
+    method) is built on demand.
+
+    Data members:
+        digraph: the Digraph containing the cycles
+        vertices: an int32 array of vertex IDs
+        offsets: an int64 array of len(self)+1 positions in vertices
+        lengths: an int32 array of cycle lengths
+        scores: a float64 array of cycle scores (see cycle_score)
+    """
+
+    def __init__(self, digraph, vertices, offsets, scores=None):
+        self.digraph = digraph
+        self.vertices = np.asarray(vertices, dtype=np.int32)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.lengths = np.diff(self.offsets).astype(np.int32)
+        if scores is None:
+            scores = self._calculate_scores()
+        self.scores = scores
+        self._incidence = None
+
+    # Number of cycles whose scores are calculated together, limiting the
+    # size of temporary arrays
+    SCORE_CHUNK_SIZE = 1 << 16
+
+    def _calculate_scores(self):
+        scores = np.zeros(len(self))
+        edge_score = np.frombuffer(self.digraph.edge_score, dtype=np.float64)
+        for chunk_start in range(0, len(self), self.SCORE_CHUNK_SIZE):
+            chunk_end = min(chunk_start + self.SCORE_CHUNK_SIZE, len(self))
+            starts = self.offsets[chunk_start:chunk_end]
+            ends = self.offsets[chunk_start+1:chunk_end+1]
+            # Each vertex slot's predecessor in its cycle. The scores of the edges
+            # into each slot are summed in the same order as in cycle_score.
+            slot_vertices = self.vertices[starts[0]:ends[-1]]
+            prev = np.empty_like(slot_vertices)
+            prev[1:] = slot_vertices[:-1]
+            prev[starts - starts[0]] = self.vertices[ends - 1]
+            edge_ids = self.digraph.edge_ids(prev, slot_vertices)
+            scores[chunk_start:chunk_end] = np.add.reduceat(edge_score[edge_ids], starts - starts[0])
+        return scores
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            start, stop, step = i.indices(len(self))
+            if step != 1:
+                raise ValueError("CycleSet slices must have a step of 1")
+            stop = max(start, stop)
+            return CycleSet(self.digraph, self.vertices, self.offsets[start:stop+1],
+                            self.scores[start:stop])
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("CycleSet index out of range")
+        return self.vertices[self.offsets[i]:self.offsets[i+1]]
+
+    def __iter__(self):
+        vertices = self.vertices
+        offsets = self.offsets.tolist()
+        for i in range(len(offsets) - 1):
+            yield vertices[offsets[i]:offsets[i+1]]
+
+    def vertex_list(self, i):
+        """Returns cycle i as a list of Vertex objects."""
+
+        vs = self.digraph.vs
+        return [vs[v_id] for v_id in self[i].tolist()]
+
+    def failure_aware_scores(self, edge_success_prob):
+        """Returns an array of the cycles' scores, as calculated by
+        failure_aware_cycle_score."""
+
+        if edge_success_prob == 1:
+            return self.scores
+        return self.scores * edge_success_prob ** self.lengths.astype(np.float64)
+
+    def vertex_incidence(self):
+        """Returns a pair (vtx_offsets, cycle_ids) of arrays, such that
+        cycle_ids[vtx_offsets[v]:vtx_offsets[v+1]] lists the indices of the
+        cycles containing vertex v, in ascending order."""
+
+        if self._incidence is None:
+            self._incidence = flat_vertex_incidence(self.digraph.n, self.vertices, self.offsets)
+        return self._incidence
+
+def flat_vertex_incidence(n, vertices, offsets):
+    """Returns a pair (vtx_offsets, item_ids) of arrays for the sequences of
+    vertices (such as cycles or chains) in the flat representation given by
+    the NumPy arrays vertices and offsets, such that
+    item_ids[vtx_offsets[v]:vtx_offsets[v+1]] lists the indices of the
+    sequences containing vertex v, in ascending order."""
+
+    slot_vertices = vertices[offsets[0]:offsets[-1]]
+    slot_items = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+    order = np.argsort(slot_vertices, kind='mergesort')
+    vtx_offsets = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(slot_vertices, minlength=n), out=vtx_offsets[1:])
+    return vtx_offsets, slot_items[order]
+
+def _bounded_bfs(nbrs, low_vtx, max_dist):
+    """Breadth-first search from low_vtx using the neighbour lists nbrs,
+    visiting only vertices with higher indices. Returns a dict mapping
+    each vertex at distance at most max_dist to its distance."""
+
+    dist = {low_vtx: 0}
+    frontier = [low_vtx]
+    d = 0
+    while frontier and d < max_dist:
+        d += 1
+        next_frontier = []
+        for u in frontier:
+            for w in nbrs[u]:
+                if w > low_vtx and w not in dist:
+                    dist[w] = d
+                    next_frontier.append(w)
+        frontier = next_frontier
+    return dist
+
+def _distance_row_to_dict(dist_row):
+    """Returns a dict mapping each vertex with a finite distance in the
+    BoundedBfsEngine row dist_row to its distance."""
+
+    reached = np.flatnonzero(dist_row != INT8_UNREACHABLE)
+    return dict(zip(reached.tolist(), dist_row[reached].tolist()))
+
+def _edge_key(src_id, tgt_id):
+    """The key used in Digraph's hashed edge lookup for an edge from
+    vertex src_id to vertex tgt_id."""
+
+    return (src_id << 32) | tgt_id
+
 class Digraph:
     """A directed graph, in which each edge has a numeric score.
 
+    Edges are stored sparsely, so that memory use grows with the number of
+    edges rather than with the square of the number of vertices. Edge i is
+    described by edge_src[i], edge_tgt[i] and edge_score[i]. A hash table
+    mapping each (source, target) pair to its edge ID, a CSR view of the
+    adjacency structure (see the csr method) and a reverse index of
+    in-edges (see the transpose_csr method) are built on demand. The Vertex
+    and Edge objects are views onto these arrays.
+
     Data members:
         n: the number of vertices in the digraph
         vs: an array of Vertex objects, such that vs[i].id == i
-        es: an array of Edge objects, such that es[i].id = i
+        es: a sequence of Edge objects, such that es[i].id = i
+        edge_src, edge_tgt: arrays of source and target vertex IDs of edges
+        edge_score: an array of edge scores
     """
 
     def __init__(self, n):
         """Create a Digraph with n vertices"""
         self.n = n
-        self.vs = [Vertex(i) for i in range(n)]
-        self.adj_mat = [[None for x in range(n)] for x in range(n)]
-        self.es = []
+        self.vs = [Vertex(i, self) for i in range(n)]
+        self.es = EdgeList(self)
+        self.edge_src = array('i')
+        self.edge_tgt = array('i')
+        self.edge_score = array('d')
+        self._edge_lookup = None
+        self._csr = None
+        self._transpose_csr = None
+        self._sorted_edge_keys = None
 
     def add_edge(self, score, source, tgt):
         """Add an edge to the digraph
@@ -78,21 +661,151 @@ class Digraph:
             tgt: the edge's target Vertex
         """
 
-        id = len(self.es)
-        e = Edge(id, score, source, tgt)
-        self.es.append(e)
-        source.edges.append(e)
-        self.adj_mat[source.id][tgt.id] = e
-    
-    def find_cycles(self, max_length):
+        if self._edge_lookup is not None:
+            self._edge_lookup[_edge_key(source.id, tgt.id)] = len(self.edge_src)
+        self.edge_src.append(source.id)
+        self.edge_tgt.append(tgt.id)
+        self.edge_score.append(score)
+        self._invalidate_adjacency()
+
+    def add_vertices(self, count):
+        """Add count new vertices, with IDs n, n+1, ..., to the digraph."""
+
+        self.vs += [Vertex(i, self) for i in range(self.n, self.n + count)]
+        self.n += count
+        self._invalidate_adjacency()
+
+    def remove_edge(self, src_id, tgt_id):
+        """Remove the edge from vertex src_id to vertex tgt_id, if it exists.
+
+        The edges following the removed edge are renumbered so that
+        es[i].id == i still holds; Edge objects obtained before the removal
+        should not be used afterwards.
+        """
+
+        edge_lookup = self._get_edge_lookup()
+        edge_id = edge_lookup.pop(_edge_key(src_id, tgt_id), None)
+        if edge_id is None:
+            return
+        del self.edge_src[edge_id]
+        del self.edge_tgt[edge_id]
+        del self.edge_score[edge_id]
+        for i in range(edge_id, len(self.edge_src)):
+            edge_lookup[_edge_key(self.edge_src[i], self.edge_tgt[i])] = i
+        self._invalidate_adjacency()
+
+    def get_edge(self, src_id, tgt_id):
+        """Returns the Edge from the vertex with ID src_id to the vertex with
+        ID tgt_id, or None if no such edge exists."""
+
+        edge_id = self._get_edge_lookup().get(_edge_key(src_id, tgt_id))
+        if edge_id is None:
+            return None
+        return Edge(edge_id, self)
+
+    def _get_edge_lookup(self):
+        if self._edge_lookup is None:
+            self._edge_lookup = {_edge_key(src_id, tgt_id): i for i, (src_id, tgt_id)
+                                 in enumerate(zip(self.edge_src, self.edge_tgt))}
+        return self._edge_lookup
+
+    def _invalidate_adjacency(self):
+        self._csr = None
+        self._transpose_csr = None
+        self._sorted_edge_keys = None
+
+    def csr(self):
+        """Returns a CsrAdjacency for the digraph's current edges."""
+
+        if self._csr is None:
+            self._csr = CsrAdjacency(self.n, self.edge_src, self.edge_tgt, self.edge_score)
+        return self._csr
+
+    def transpose_csr(self):
+        """Returns a CsrAdjacency for the transpose of the digraph, so that
+        its "targets" for vertex v are the sources of edges entering v. Its
+        edge_ids refer to the digraph's edges."""
+
+        if self._transpose_csr is None:
+            self._transpose_csr = CsrAdjacency(self.n, self.edge_tgt, self.edge_src, self.edge_score)
+        return self._transpose_csr
+
+    def out_neighbour_ids(self, v_id):
+        """Returns an array of the IDs of the targets of edges leaving the
+        vertex with ID v_id."""
+
+        csr = self.csr()
+        return csr.targets[csr.offsets[v_id]:csr.offsets[v_id+1]]
+
+    def in_neighbour_ids(self, v_id):
+        """Returns an array of the IDs of the sources of edges entering the
+        vertex with ID v_id."""
+
+        transp = self.transpose_csr()
+        return transp.targets[transp.offsets[v_id]:transp.offsets[v_id+1]]
+
+    def find_cycles(self, max_length, jobs=1):
         """Find cycles of length up to max_length in the digraph.
 
+        Args:
+            max_length: the cycle cap
+            jobs: the number of worker processes to use (None means one
+                per CPU). The result does not depend on this.
+
         Returns:
             a list of cycles. Each cycle is represented as a list of
             vertices, with the first vertex _not_ repeated at the end.
         """
         
-        return [cycle for cycle in self.generate_cycles(max_length)]
+        if jobs == 1:
+            return [cycle for cycle in self.generate_cycles(max_length)]
+        cycle_vertices, cycle_offsets = self.find_cycles_flat(max_length, jobs=jobs)
+        vs = self.vs
+        return [[vs[v_id] for v_id in cycle_vertices[cycle_offsets[i]:cycle_offsets[i+1]]]
+                for i in range(len(cycle_offsets) - 1)]
+
+    def find_cycles_flat(self, max_length, low_vertices=None, jobs=1):
+        """Find cycles of length up to max_length in the digraph, as flat arrays.
+
+        Args:
+            max_length: the cycle cap
+            low_vertices: if not None, only cycles whose lowest-indexed
+                vertex is in this iterable of vertex IDs are found
+            jobs: the number of worker processes to use (None means one
+                per CPU). The result does not depend on this.
+
+        Returns:
+            a pair (cycle_vertices, cycle_offsets) of arrays. Cycle i has
+            vertex IDs cycle_vertices[cycle_offsets[i]:cycle_offsets[i+1]],
+            starting with its lowest-indexed vertex.
+        """
+
+        if jobs != 1:
+            import parallel_enumeration
+            return parallel_enumeration.find_cycles_flat(self, max_length, jobs, low_vertices)
+
+        cycle_vertices = array('i')
+        cycle_offsets = array('l', [0])
+        enumerator = CycleEnumerator(self, max_length)
+        if low_vertices is None:
+            low_vertices = range(self.n)
+        enumerator.add_cycles_for_low_vertices(low_vertices, cycle_vertices, cycle_offsets)
+        return cycle_vertices, cycle_offsets
+
+    def find_cycle_set(self, max_length, jobs=1):
+        """Find cycles of length up to max_length in the digraph, as a CycleSet.
+
+        The cycles are in the same order as those returned by find_cycles.
+
+        Args:
+            max_length: the cycle cap
+            jobs: the number of worker processes to use (None means one
+                per CPU). The result does not depend on this.
+        """
+
+        cycle_vertices, cycle_offsets = self.find_cycles_flat(max_length, jobs=jobs)
+        return CycleSet(self, np.frombuffer(cycle_vertices, dtype=np.int32),
+                        np.frombuffer(cycle_offsets, dtype=cycle_offsets.typecode))
 
     def generate_cycles(self, max_length):
         """Generate cycles of length up to max_length in the digraph.
@@ -101,37 +814,17 @@ class Digraph:
         vertices, with the first vertex _not_ repeated at the end.
         """
 
-        vtx_used = [False] * len(self.vs)  # vtx_used[i]==True iff vertex i is in current path
-
-        def cycle(current_path):
-            last_vtx = current_path[-1]
-            if self.edge_exists(last_vtx, current_path[0]):
-                yield current_path[:]
-            if len(current_path) < max_length:
-                for e in last_vtx.edges: 
-                    v = e.tgt
-                    if (len(current_path) + shortest_paths_to_low_vtx[v.id] <= max_length
-                                and not vtx_used[v.id]):
-                        current_path.append(v)
-                        vtx_used[v.id] = True
-                        for c in cycle(current_path):
-                            yield c
-                        vtx_used[v.id] = False
-                        del current_path[-1]
-
-        # Adjacency lists for transpose graph
-        transp_adj_lists = [[] for v in self.vs]
-        for edge in self.es:
-            transp_adj_lists[edge.tgt.id].append(edge.src)
-
-        for v in self.vs:
-            shortest_paths_to_low_vtx = self.calculate_shortest_path_lengths(
-                    v, max_length - 1,
-                    lambda u: (w for w in transp_adj_lists[u.id] if w.id > v.id))
-            vtx_used[v.id] = True
-            for c in cycle([v]):
-                yield c
-            vtx_used[v.id] = False
+        enumerator = CycleEnumerator(self, max_length)
+        vs = self.vs
+        batch_size = BoundedBfsEngine.BATCH_SIZE
+        for start in range(0, self.n, batch_size):
+            cycle_vertices = array('i')
+            cycle_offsets = array('l', [0])
+            enumerator.add_cycles_for_low_vertices(range(start, min(start + batch_size, self.n)),
+                                                   cycle_vertices, cycle_offsets)
+            for i in range(len(cycle_offsets) - 1):
+                yield [vs[v_id] for v_id in
+                       cycle_vertices[cycle_offsets[i]:cycle_offsets[i+1]]]
     
     def get_shortest_path_from_low_vtx(self, low_vtx, max_path):
         """ Returns an array of path lengths. For each v > low_vtx, if the shortest
@@ -139,23 +832,80 @@ class Digraph:
             will be the length of this shortest path. Otherwise, element v will be
             999999999."""
         return self.calculate_shortest_path_lengths(self.vs[low_vtx], max_path,
-                    adj_list_accessor=lambda v: (e.tgt for e in v.edges if e.tgt.id >= low_vtx))
+                    adj_list_accessor=lambda v: (self.vs[w_id] for w_id in self.out_neighbour_ids(v.id)
+                                                 if w_id >= low_vtx))
 
     def get_shortest_path_to_low_vtx(self, low_vtx, max_path):
         """ Returns an array of path lengths. For each v > low_vtx, if the shortest
             path to low_vtx from v is shorter than max_path, then element v of the array
             will be the length of this shortest path. Otherwise, element v will be
             999999999."""
-        def adj_list_accessor(v):
-            for i in range(low_vtx, len(self.vs)):
-                if self.adj_mat[i][v.id]:
-                    yield self.vs[i]
-            
         return self.calculate_shortest_path_lengths(self.vs[low_vtx], max_path,
-                    adj_list_accessor=adj_list_accessor)
+                    adj_list_accessor=lambda v: (self.vs[w_id] for w_id in self.in_neighbour_ids(v.id)
+                                                 if w_id >= low_vtx))
+
+    def generate_low_vtx_distances(self, max_dist, low_vertices=None):
+        """Generate bounded shortest-path lengths from and to each low vertex.
+
+        For each low vertex low_vtx, two breadth-first searches are carried
+        out, using only vertices with index greater than or equal to low_vtx:
+        one forwards from low_vtx and one backwards to low_vtx. The searches
+        are run in batches by BoundedBfsEngine.
+
+        Args:
+            max_dist: The maximum distance we're interested in
+            low_vertices: An iterable of low vertex IDs (default: all vertices)
 
-    def calculate_shortest_path_lengths(self, from_v, max_dist,
-                adj_list_accessor=lambda v: (e.tgt for e in v.edges)):
+        Yields:
+            (low_vtx, dist_from_lv, dist_to_lv) tuples, where dist_from_lv and
+            dist_to_lv are dicts mapping the ID of each vertex whose shortest
+            path from (respectively, to) low_vtx has length at most max_dist
+            to that length.
+        """
+
+        if low_vertices is None:
+            low_vertices = range(self.n)
+        low_vertices = list(low_vertices)
+
+        if max_dist >= INT8_UNREACHABLE:
+            csr = self.csr()
+            transp = self.transpose_csr()
+            out_nbrs = [tuple(csr.targets[csr.offsets[v]:csr.offsets[v+1]])
+                        for v in range(self.n)]
+            in_nbrs = [tuple(transp.targets[transp.offsets[v]:transp.offsets[v+1]])
+                       for v in range(self.n)]
+            for low_vtx in low_vertices:
+                yield (low_vtx, _bounded_bfs(out_nbrs, low_vtx, max_dist),
+                       _bounded_bfs(in_nbrs, low_vtx, max_dist))
+            return
+
+        from_rows = BoundedBfsEngine(self.n, self.csr()).generate_rows(low_vertices, max_dist)
+        to_rows = BoundedBfsEngine(self.n, self.transpose_csr()).generate_rows(low_vertices, max_dist)
+        for (low_vtx, from_row), (__, to_row) in zip(from_rows, to_rows):
+            yield low_vtx, _distance_row_to_dict(from_row), _distance_row_to_dict(to_row)
+
+    def low_vtx_distance_matrices(self, max_dist, low_vertices=None):
+        """Compute bounded shortest-path lengths from and to each low vertex,
+        as for generate_low_vtx_distances, as a pair of matrices.
+
+        Args:
+            max_dist: The maximum distance we're interested in (at most 126)
+            low_vertices: A sequence of low vertex IDs (default: all vertices)
+
+        Returns:
+            a pair (dist_from, dist_to) of int8 arrays of shape
+            (len(low_vertices), n). dist_from[i, v] is the length of the
+            shortest path from low_vertices[i] to v, and dist_to[i, v] is the
+            length of the shortest path from v to low_vertices[i], or
+            INT8_UNREACHABLE if this is greater than max_dist.
+        """
+
+        if low_vertices is None:
+            low_vertices = range(self.n)
+        return (BoundedBfsEngine(self.n, self.csr()).distances(low_vertices, max_dist),
+                BoundedBfsEngine(self.n, self.transpose_csr()).distances(low_vertices, max_dist))
+
+    def calculate_shortest_path_lengths(self, from_v, max_dist, adj_list_accessor=None):
         """Calculate the length of the shortest path from vertex from_v to each
         vertex with a greater or equal index, using paths containing
         only vertices indexed greater than or equal to from_v.
@@ -168,11 +918,14 @@ class Digraph:
             from_v: The starting vertex
             max_dist: The maximum distance we're interested in
             adj_list_accessor: A function taking a vertex and returning an
-                iterable of out-edge targets
+                iterable of out-edge targets (default: the vertex's out-neighbours)
         """
+        if adj_list_accessor is None:
+            adj_list_accessor = lambda v: (self.vs[w_id] for w_id in self.out_neighbour_ids(v.id))
+
         # Breadth-first search
         q = deque([from_v])
-        distances = [999999999] * len(self.vs)
+        distances = [_INFINITY] * len(self.vs)
         distances[from_v.id] = 0
 
         while q:
@@ -181,55 +934,222 @@ class Digraph:
             if distances[v.id] >= max_dist:
                 break
             for w in adj_list_accessor(v):
-                if distances[w.id] == 999999999:
+                if distances[w.id] == _INFINITY:
                     distances[w.id] = distances[v.id] + 1
                     q.append(w)
 
         return distances
 
+    def edge_ids(self, src_ids, tgt_ids):
+        """Returns an array of the IDs of the edges from src_ids[i] to tgt_ids[i],
+        for arrays src_ids and tgt_ids of vertex IDs. Each of these edges must
+        exist."""
+
+        if self._sorted_edge_keys is None:
+            keys = (np.frombuffer(self.edge_src, dtype=np.int32).astype(np.int64) << 32 |
+                    np.frombuffer(self.edge_tgt, dtype=np.int32))
+            order = np.argsort(keys)
+            self._sorted_edge_keys = (keys[order], order)
+        sorted_keys, order = self._sorted_edge_keys
+        keys = np.asarray(src_ids, dtype=np.int64) << 32 | np.asarray(tgt_ids, dtype=np.int64)
+        return order[np.searchsorted(sorted_keys, keys)]
+
     def edge_exists(self, v1, v2):
         """Returns true if and only if an edge exists from Vertex v1 to Vertex v2."""
 
-        return self.adj_mat[v1.id][v2.id] is not None
+        return ((v1.id << 32) | v2.id) in self._get_edge_lookup()
                     
+    def strongly_connected_components(self):
+        """Find the strongly connected components of the digraph, using an
+        iterative version of Tarjan's algorithm.
+
+        Returns:
+            a list component_ids, where component_ids[v] is the index of the
+            component containing the vertex with ID v. Components are
+            numbered in reverse topological order.
+        """
+
+        csr = self.csr()
+        offsets = csr.offsets
+        targets = csr.targets
+        index = [-1] * self.n
+        lowlink = [0] * self.n
+        on_stack = [False] * self.n
+        component_ids = [-1] * self.n
+        stack = []
+        next_index = 0
+        n_components = 0
+
+        for root in range(self.n):
+            if index[root] != -1:
+                continue
+            index[root] = lowlink[root] = next_index
+            next_index += 1
+            stack.append(root)
+            on_stack[root] = True
+            # The DFS path, as (vertex, position of next out-edge) pairs
+            path = [(root, offsets[root])]
+            while path:
+                v, pos = path[-1]
+                if pos < offsets[v+1]:
+                    path[-1] = (v, pos + 1)
+                    w = targets[pos]
+                    if index[w] == -1:
+                        index[w] = lowlink[w] = next_index
+                        next_index += 1
+                        stack.append(w)
+                        on_stack[w] = True
+                        path.append((w, offsets[w]))
+                    elif on_stack[w] and index[w] < lowlink[v]:
+                        lowlink[v] = index[w]
+                    continue
+                path.pop()
+                if path and lowlink[v] < lowlink[path[-1][0]]:
+                    lowlink[path[-1][0]] = lowlink[v]
+                if lowlink[v] == index[v]:
+                    while True:
+                        w = stack.pop()
+                        on_stack[w] = False
+                        component_ids[w] = n_components
+                        if w == v:
+                            break
+                    n_components += 1
+
+        return component_ids
+
     def induced_subgraph(self, vertices):
         """Returns the subgraph indiced by a given list of vertices."""
 
+        new_ids = {v.id: i for i, v in enumerate(vertices)}
+        csr = self.csr()
         subgraph = Digraph(len(vertices))
         for i, v in enumerate(vertices):
-            for j, w in enumerate(vertices):
-                e = self.adj_mat[v.id][w.id]
-                if e is not None:
-                    new_src = subgraph.vs[i]
-                    new_tgt = subgraph.vs[j]
-                    subgraph.add_edge(e.score, new_src, new_tgt)
+            out_edges = []
+            for pos in range(csr.offsets[v.id], csr.offsets[v.id + 1]):
+                j = new_ids.get(csr.targets[pos])
+                if j is not None:
+                    out_edges.append((j, csr.scores[pos]))
+            # Add edges in order of target index in the subgraph
+            for j, score in sorted(out_edges):
+                subgraph.add_edge(score, subgraph.vs[i], subgraph.vs[j])
         return subgraph
 
     def __str__(self):
         return "\n".join([str(v) for v in self.vs])
 
-def read_digraph(lines):
-    """Reads a digraph from an array of strings in the input format."""
+def _tokens_per_line(text):
+    """Returns a NumPy array of the number of whitespace-separated tokens on
+    each non-blank line of text."""
 
-    vtx_count, edge_count = [int(x) for x in lines[0].split()]
-    digraph = Digraph(vtx_count)
-    for line in lines[1:edge_count+1]:
-        tokens = [x for x in line.split()]
-        src_id = int(tokens[0])
-        tgt_id = int(tokens[1])
+    chars = np.frombuffer(text, dtype=np.uint8)
+    if len(chars) == 0:
+        return np.zeros(0, dtype=np.int64)
+    is_space = (chars == ord(" ")) | ((chars >= ord("\t")) & (chars <= ord("\r")))
+    token_starts = ~is_space
+    token_starts[1:] &= is_space[:-1]
+    line_ends = np.append(np.flatnonzero(chars == ord("\n")), len(chars))
+    tokens_before_end = np.searchsorted(np.flatnonzero(token_starts), line_ends)
+    counts = np.diff(np.append(0, tokens_before_end))
+    return counts[counts > 0]
+
+def parse_edge_rows(text, row_count=None):
+    """Parse rows of whitespace-separated numbers in the format of the edge
+    rows of .input and .ndds files (source, target, score, and possibly
+    further columns which are ignored). Every row must have the same
+    number of columns.
+
+    The whole of text is tokenized in one step by NumPy, rather than line by
+    line.
+
+    Args:
+        text: a string containing exactly row_count rows
+        row_count: the number of rows, or None if each non-blank line of
+            text is a row
+
+    Returns:
+        a tuple (src_ids, tgt_ids, scores) of NumPy arrays, of dtypes int64,
+        int64 and float64
+    """
+
+    tokens_per_line = _tokens_per_line(text)
+    if row_count is None:
+        row_count = len(tokens_per_line)
+    if row_count == 0:
+        if text.strip():
+            raise KidneyReadException("Unexpected data: {}".format(text.strip()[:40]))
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0)
+    if len(tokens_per_line) != row_count:
+        raise KidneyReadException("Malformed edge rows: expected {} rows, found {}"
+                                  .format(row_count, len(tokens_per_line)))
+    column_count = max(tokens_per_line[0], 3)
+    bad_rows = np.flatnonzero(tokens_per_line != column_count)
+    if len(bad_rows):
+        raise KidneyReadException("Malformed edge row: expected {} numbers, found {}"
+                                  .format(column_count, tokens_per_line[bad_rows[0]]))
+    values = np.fromstring(text, dtype=np.float64, sep=' ')
+    if len(values) != row_count * column_count:
+        raise KidneyReadException("Non-numeric data in edge rows")
+    values = values.reshape(row_count, column_count)
+    src_ids = values[:, 0].astype(np.int64)
+    tgt_ids = values[:, 1].astype(np.int64)
+    if (src_ids != values[:, 0]).any() or (tgt_ids != values[:, 1]).any():
+        raise KidneyReadException("Non-integer index in edge rows")
+    return src_ids, tgt_ids, values[:, 2].copy()
+
+def digraph_from_arrays(n, edge_src, edge_tgt, edge_score):
+    """Create a Digraph with n vertices and the given edges, without checking
+    that the edges are valid.
+
+    Args:
+        n: the number of vertices
+        edge_src, edge_tgt, edge_score: sequences (for example, NumPy
+            arrays) of source IDs, target IDs and scores of edges
+    """
+
+    digraph = Digraph(n)
+    digraph.edge_src.fromstring(np.asarray(edge_src, dtype=np.int32).tostring())
+    digraph.edge_tgt.fromstring(np.asarray(edge_tgt, dtype=np.int32).tostring())
+    digraph.edge_score.fromstring(np.asarray(edge_score, dtype=np.float64).tostring())
+    return digraph
+
+def digraph_from_edge_rows(vtx_count, src_ids, tgt_ids, scores):
+    """Create a Digraph from edge rows read by parse_edge_rows.
+
+    The rows are checked as a whole, but if any row is invalid then the
+    KidneyReadException raised is the one for the first invalid row.
+    """
+
+    n = vtx_count
+    out_of_range = (src_ids < 0) | (src_ids >= n) | (tgt_ids < 0) | (tgt_ids >= n)
+    invalid = out_of_range | (src_ids == tgt_ids)
+    __, first_idx = np.unique(src_ids * n + tgt_ids, return_index=True)
+    is_duplicate = np.ones(len(src_ids), dtype=bool)
+    is_duplicate[first_idx] = False
+    invalid |= is_duplicate
+
+    if invalid.any():
+        i = np.flatnonzero(invalid)[0]
+        src_id = int(src_ids[i])
+        tgt_id = int(tgt_ids[i])
         if src_id < 0 or src_id >= vtx_count:
             raise KidneyReadException("Vertex index {} out of range.".format(src_id))
         if tgt_id < 0 or tgt_id >= vtx_count:
             raise KidneyReadException("Vertex index {} out of range.".format(tgt_id))
         if src_id == tgt_id:
             raise KidneyReadException("Self-loop from {0} to {0} not permitted".format(src_id))
-        if digraph.edge_exists(digraph.vs[src_id], digraph.vs[tgt_id]):
-            raise KidneyReadException("Duplicate edge from {} to {}".format(src_id, tgt_id))
-        score = float(tokens[2])
-            
-        digraph.add_edge(score, digraph.vs[src_id], digraph.vs[tgt_id])
+        raise KidneyReadException("Duplicate edge from {} to {}".format(src_id, tgt_id))
+
+    return digraph_from_arrays(vtx_count, src_ids, tgt_ids, scores)
+
+def read_digraph(lines):
+    """Reads a digraph from an array of strings in the input format."""
+
+    vtx_count, edge_count = [int(x) for x in lines[0].split()]
+    edge_lines = lines[1:edge_count+1]
+    src_ids, tgt_ids, scores = parse_edge_rows("".join(edge_lines), len(edge_lines))
+    digraph = digraph_from_edge_rows(vtx_count, src_ids, tgt_ids, scores)
 
-    if lines[edge_count+1].split()[0] != "-1" or len(lines) < edge_count+2:
+    if len(lines) < edge_count+2 or lines[edge_count+1].split()[0] != "-1":
         raise KidneyReadException("Incorrect edge count")
 
     return digraph
@@ -4,6 +4,8 @@ import random
 import copy
 import sys
 import kidney_ndds
+import ip_backend
+import kidney_io
 import kidney_ip
 import kidney_utils
 from dynamic_kidney_graph import DynamicKidneyGraph
@@ -12,12 +14,18 @@ from graph_features import GraphFeatures
 
 
 class KidneyInterface:
-    def __init__(self, graph, cfg, formulation):
+    def __init__(self, graph, cfg, formulation, warm_start=False, previous_actions=None):
         self.digraph = graph
         self.cfg = cfg
         self.formulation = formulation
+        # If warm_start is True, the cycles and chains (as vertex and NDD
+        # names) found by the last solve are used as a MIP start for the next
+        self.warm_start = warm_start
+        self.previous_actions = previous_actions
 
     def get_legal_actions(self):
+        if self.warm_start and self.previous_actions is not None:
+            self.cfg.mip_start = self.named_mip_start(*self.previous_actions)
         actions = self.solve_kep()
         cy = actions.cycles
         cycle_scores = actions.cycle_scores
@@ -31,8 +39,18 @@ class KidneyInterface:
             chain = [self.digraph.ndd_id_name[c.ndd_index]]
             chain += [self.digraph.digraph_id_name[x] for x in c.vtx_indices]
             chains.append(chain)
+        self.previous_actions = (cycles, chains)
         return cycles, cycle_scores, chains, chain_scores
 
+    def named_mip_start(self, cycles, chains):
+        """Returns a MipStart for the current graph from cycles (lists of
+        vertex names) and chains (lists of an NDD name followed by vertex
+        names). Vertices and NDDs that have left the graph are dropped, as
+        described for MipStart.relabelled."""
+
+        named_start = kidney_ip.MipStart(cycles, [(c[0], c[1:]) for c in chains])
+        return named_start.relabelled(self.digraph.digraph_name_id, self.digraph.ndd_name_id)
+
     def add_nodes(self, edges):
         vertices = self.digraph._get_vertices_from_edges(edges)
         if len(vertices) <= 2:
@@ -80,8 +98,9 @@ class KidneyInterface:
                                   args.chain_cap, args.verbose,
                                   args.timelimit, args.edge_success_prob,
                                   args.eef_alt_constraints,
-                                  args.lp_file, args.relax)
-        return KidneyInterface(self.digraph, cfg, args.formulation)
+                                  args.lp_file, args.relax, backend=args.backend)
+        return KidneyInterface(self.digraph, cfg, args.formulation, self.warm_start,
+                               self.previous_actions)
 
     def solve_kep(self, formulation='picef', use_relabelled=True):
 
@@ -137,7 +156,10 @@ if __name__ == '__main__':
                         help="IP solver time limit in seconds (default: no time limit)")
     parser.add_argument("--verbose", "-v", required=False,
                         action="store_true",
-                        help="Log Gurobi output to screen and log file")
+                        help="Log IP solver output to screen and log file")
+    parser.add_argument("--backend", "-b", required=False,
+                        choices=ip_backend.BACKENDS, default=ip_backend.GUROBI,
+                        help="The IP solver (default: gurobi)")
     parser.add_argument("--edge-success-prob", "-p", required=False,
                         type=float, default=1.0,
                         help="Edge success probability, for failure-aware matching. " +
@@ -149,47 +171,31 @@ if __name__ == '__main__':
     parser.add_argument("--relax", "-x", required=False,
                         action='store_true',
                         help="Solve the LP relaxation.")
+    parser.add_argument("--warm-start", "-w", required=False,
+                        action='store_true',
+                        help="Start each solve from the cycles and chains of the \
+                    previous solve that are still valid (PICEF, cycle and edge \
+                    formulations).")
 
     args = parser.parse_args()
     args.formulation = args.formulation.lower()
 
-    digraph_edges = []
-    digraph_lines = open('example_data/input2').readlines()
-    # digraph_lines = open('example_data/input').readlines()
-    for line in digraph_lines:
-        tokens = [x for x in line.split()]
-        source = int(tokens[0])
-        target = int(tokens[1])
-        score = float(tokens[2])
-        digraph_edges.append((source, target, score))
-
-    ndd_edges = []
-    ndd_lines = open('example_data/ndds2').readlines()
-    # ndd_lines = open('example_data/ndds').readlines()
-    for line in ndd_lines:
-        tokens = [x for x in line.split()]
-        source = int(tokens[0])
-        target = int(tokens[1])
-        score = float(tokens[2])
-        ndd_edges.append((source, target, score))
+    digraph_edges = kidney_io.read_edge_list('example_data/input2')
+    # digraph_edges = kidney_io.read_edge_list('example_data/input')
+
+    ndd_edges = kidney_io.read_edge_list('example_data/ndds2')
+    # ndd_edges = kidney_io.read_edge_list('example_data/ndds')
     graph = DynamicKidneyGraph(digraph_edges, ndd_edges)
     ndds = [value for key, value in graph.ndds.items()]
 
-    add_edges = []
-    add_lines = open('example_data/input_add2').readlines()
-    for line in add_lines:
-        tokens = [x for x in line.split()]
-        source = int(tokens[0])
-        target = int(tokens[1])
-        score = float(tokens[2])
-        add_edges.append((source, target, score))
+    add_edges = kidney_io.read_edge_list('example_data/input_add2')
 
     cfg = kidney_ip.OptConfig(graph.digraph, ndds, args.cycle_cap,
                               args.chain_cap, args.verbose,
                               args.timelimit, args.edge_success_prob,
                               args.eef_alt_constraints,
-                              args.lp_file, args.relax)
-    interface = KidneyInterface(graph, cfg, args.formulation)
+                              args.lp_file, args.relax, backend=args.backend)
+    interface = KidneyInterface(graph, cfg, args.formulation, args.warm_start)
     # interface = copy.deepcopy(interface1)
 
     for it in range(10):
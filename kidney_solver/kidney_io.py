@@ -0,0 +1,407 @@
+"""Readers and writers for kidney-exchange instances.
+
+The text readers take a file object or a path, and read the file in large
+chunks. The edge rows in each chunk are tokenized in bulk by
+parse_edge_rows, and are checked in the same way as by read_digraph and
+read_ndds, so a KidneyReadException is raised for any invalid instance.
+
+The binary instance format holds the same data as a .input file followed
+by a .ndds file, as a header followed by flat arrays:
+
+    magic               8 bytes, "KEPINST1"
+    vertex count        int64
+    pair-edge count m   int64
+    NDD count           int64
+    NDD-edge count k    int64
+    pair edges          m int32 sources, m int32 targets, m float64 scores
+    NDD edges           k int32 NDD IDs, k int32 targets, k float64 scores
+
+All values are little-endian, and each array starts at a multiple of eight
+bytes from the start of the file (zero padding is added after an int32
+array if necessary). A file in this format can be loaded without parsing
+by load_binary_instance, which maps the arrays into memory. Since the
+mapping is read-only, the pages are shared between processes that load
+the same file.
+"""
+
+import argparse
+from contextlib import contextmanager
+import struct
+import sys
+
+import numpy as np
+
+from kidney_digraph import KidneyReadException, parse_edge_rows, digraph_from_arrays, \
+        digraph_from_edge_rows, _as_numpy
+from kidney_ndds import Ndd, NddEdge, ndds_from_edge_rows
+
+# Number of bytes read from the file at a time
+CHUNK_SIZE = 1 << 22
+
+class LineReader(object):
+    """Reads lines, or blocks of lines, from a file object in chunks."""
+
+    def __init__(self, f, chunk_size=CHUNK_SIZE):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        data = self.f.read(self.chunk_size)
+        if not data:
+            self.eof = True
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+
+    def readline(self):
+        """Returns the next line, or "" at the end of the file."""
+
+        while True:
+            end = self.buf.find("\n", self.pos)
+            if end >= 0:
+                line = self.buf[self.pos:end+1]
+                self.pos = end + 1
+                return line
+            if self.eof:
+                line = self.buf[self.pos:]
+                self.pos = len(self.buf)
+                return line
+            self._fill()
+
+    def read_line_blocks(self, line_count):
+        """Generate (text, count) pairs, where text is a block of count
+        consecutive lines. The blocks contain the next line_count lines in
+        total, or fewer at the end of the file."""
+
+        while line_count > 0:
+            newlines = np.flatnonzero(
+                    np.frombuffer(self.buf, dtype=np.uint8)[self.pos:] == ord("\n"))
+            if len(newlines) >= line_count:
+                end = self.pos + newlines[line_count-1] + 1
+                count = line_count
+            elif len(newlines) > 0:
+                end = self.pos + newlines[-1] + 1
+                count = len(newlines)
+            elif self.eof:
+                # A final line without a newline
+                if self.pos < len(self.buf):
+                    yield self.buf[self.pos:], 1
+                    self.pos = len(self.buf)
+                return
+            else:
+                self._fill()
+                continue
+            yield self.buf[self.pos:end], count
+            self.pos = end
+            line_count -= count
+            if line_count > 0 and self.pos == len(self.buf):
+                self._fill()
+
+    def peek(self, size):
+        """Returns the next size bytes (or fewer at the end of the file),
+        without consuming them."""
+
+        while len(self.buf) - self.pos < size and not self.eof:
+            self._fill()
+        return self.buf[self.pos:self.pos+size]
+
+    def read_rest(self):
+        """Returns the rest of the file."""
+
+        rest = self.buf[self.pos:] + self.f.read()
+        self.buf = ""
+        self.pos = 0
+        self.eof = True
+        return rest
+
+    def at_end(self):
+        """Returns True if and only if the rest of the file is whitespace."""
+
+        while not self.buf[self.pos:].strip():
+            if self.eof:
+                return True
+            self._fill()
+        return False
+
+def _read_rows(reader, row_count):
+    """Read row_count edge rows, returning arrays as for parse_edge_rows."""
+
+    return _concatenate_rows([parse_edge_rows(text, count)
+                              for text, count in reader.read_line_blocks(row_count)])
+
+def _concatenate_rows(blocks):
+    """Concatenate a list of (src_ids, tgt_ids, scores) tuples of arrays."""
+
+    if not blocks:
+        return parse_edge_rows("", 0)
+    if len(blocks) == 1:
+        return blocks[0]
+    return tuple(np.concatenate(arrays) for arrays in zip(*blocks))
+
+def _read_section(reader):
+    """Read a section of .input or .ndds data: a header line with the
+    number of vertices or NDDs and the number of edges, the edge rows, and
+    a terminating line beginning with -1. Blank lines before the header
+    are skipped. Returns a tuple (count, src_ids,
+    tgt_ids, scores, terminated), where terminated is True if and only if
+    the terminating line is present."""
+
+    line = reader.readline()
+    while line and not line.strip():
+        line = reader.readline()
+    header = line.split()
+    if len(header) < 2:
+        raise KidneyReadException("Missing header line")
+    count, edge_count = int(header[0]), int(header[1])
+    src_ids, tgt_ids, scores = _read_rows(reader, edge_count)
+    terminator = reader.readline().split()
+    terminated = len(terminator) > 0 and terminator[0] == "-1"
+    return count, src_ids, tgt_ids, scores, terminated
+
+def _read_digraph(reader):
+    vtx_count, src_ids, tgt_ids, scores, terminated = _read_section(reader)
+    digraph = digraph_from_edge_rows(vtx_count, src_ids, tgt_ids, scores)
+    if not terminated:
+        raise KidneyReadException("Incorrect edge count")
+    return digraph
+
+def _read_ndds(reader, digraph):
+    ndd_count, src_ids, tgt_ids, scores, terminated = _read_section(reader)
+    ndds = ndds_from_edge_rows(ndd_count, src_ids, tgt_ids, scores, digraph)
+    if not terminated:
+        raise KidneyReadException("Incorrect edge count")
+    return ndds
+
+@contextmanager
+def _open_input(f):
+    if isinstance(f, basestring):
+        with open(f) as opened:
+            yield opened
+    else:
+        yield f
+
+def read_digraph_file(f):
+    """Reads a digraph in the .input format from a file object or path."""
+
+    with _open_input(f) as opened:
+        return _read_digraph(LineReader(opened))
+
+def read_ndds_file(f, digraph):
+    """Reads NDDs in the .ndds format from a file object or path."""
+
+    with _open_input(f) as opened:
+        return _read_ndds(LineReader(opened), digraph)
+
+def read_instance(f):
+    """Reads an instance from a file object or path, in the .input format
+    optionally followed by the .ndds format (as on the standard input of
+    the command-line programs). Instances in the binary format are also
+    accepted; if f is a path, these are memory-mapped.
+
+    Returns:
+        a pair (digraph, ndds)
+    """
+
+    if isinstance(f, basestring) and is_binary_instance(f):
+        return load_binary_instance(f).instance()
+
+    with _open_input(f) as opened:
+        reader = LineReader(opened)
+        if reader.peek(len(BINARY_MAGIC)) == BINARY_MAGIC:
+            return BinaryInstance(np.frombuffer(reader.read_rest(), dtype=np.uint8)).instance()
+        digraph = _read_digraph(reader)
+        if reader.at_end():
+            ndds = []
+        else:
+            ndds = _read_ndds(reader, digraph)
+        return digraph, ndds
+
+def read_edge_rows(f):
+    """Reads edge rows (source, target and score, with no header line)
+    from a file object or path until the end of the file.
+
+    Returns:
+        a tuple (src_ids, tgt_ids, scores) of NumPy arrays
+    """
+
+    with _open_input(f) as opened:
+        reader = LineReader(opened)
+        blocks = [parse_edge_rows(text) for text, __ in reader.read_line_blocks(sys.maxint)]
+        return _concatenate_rows(blocks)
+
+def read_edge_list(f):
+    """Reads edge rows as for read_edge_rows, and returns them as a list of
+    (source, target, score) tuples."""
+
+    src_ids, tgt_ids, scores = read_edge_rows(f)
+    return zip(src_ids.tolist(), tgt_ids.tolist(), scores.tolist())
+
+def read_wmd(f):
+    """Reads an instance in the .wmd format (as used by PrefLib) from a
+    file object or path, in the same way as utils/convert.py. Edges to NDDs
+    are discarded, and all NDDs must appear after all pairs.
+
+    Returns:
+        a pair (digraph, ndds)
+    """
+
+    with _open_input(f) as opened:
+        reader = LineReader(opened)
+        vtx_count, edge_count = [int(x) for x in reader.readline().split(",")]
+        pair_count = 0
+        ndd_count = 0
+        for __ in range(vtx_count):
+            if "Pair" in reader.readline():
+                if ndd_count > 0:
+                    raise KidneyReadException("Didn't expect a pair to appear after NDDs")
+                pair_count += 1
+            else:
+                ndd_count += 1
+
+        blocks = [parse_edge_rows(text.replace(",", " "), count)
+                  for text, count in reader.read_line_blocks(edge_count)]
+        src_ids, tgt_ids, scores = _concatenate_rows(blocks)
+        if len(src_ids) < edge_count:
+            raise KidneyReadException("Incorrect edge count")
+
+    to_pair = tgt_ids < pair_count
+    from_pair = to_pair & (src_ids < pair_count)
+    from_ndd = to_pair & ~from_pair
+    digraph = digraph_from_edge_rows(pair_count, src_ids[from_pair], tgt_ids[from_pair],
+                                     scores[from_pair])
+    ndds = ndds_from_edge_rows(ndd_count, src_ids[from_ndd] - pair_count, tgt_ids[from_ndd],
+                               scores[from_ndd], digraph)
+    return digraph, ndds
+
+BINARY_MAGIC = "KEPINST1"
+
+# The header: magic, vertex count, pair-edge count, NDD count, NDD-edge count
+_BINARY_HEADER = struct.Struct("<8s4q")
+
+def _binary_layout(edge_count, ndd_edge_count):
+    """Returns a list of (name, dtype, count, byte offset) for the arrays in
+    a binary instance file, and the total file size in bytes."""
+
+    layout = []
+    pos = _BINARY_HEADER.size
+    for prefix, count in [("edge", edge_count), ("ndd_edge", ndd_edge_count)]:
+        for suffix, dtype in [("src", "<i4"), ("tgt", "<i4"), ("score", "<f8")]:
+            layout.append(("{}_{}".format(prefix, suffix), np.dtype(dtype), count, pos))
+            pos += count * np.dtype(dtype).itemsize
+            pos += -pos % 8
+    return layout, pos
+
+class BinaryInstance(object):
+    """An instance held in the binary format.
+
+    The array members are read-only views of the underlying buffer (a
+    memory map if the instance was loaded from a file), so creating a
+    BinaryInstance copies no edge data. The data are assumed to be valid,
+    as written by write_binary_instance; no edge is checked.
+
+    Data members:
+        n: the number of vertices (donor-patient pairs)
+        ndd_count: the number of NDDs
+        edge_src, edge_tgt, edge_score: arrays of the source IDs, target
+            IDs and scores of the pair-to-pair edges
+        ndd_edge_src, ndd_edge_tgt, ndd_edge_score: arrays of the NDD IDs,
+            target vertex IDs and scores of the NDD edges
+    """
+
+    def __init__(self, buf):
+        """Args:
+            buf: a uint8 NumPy array (or memory map) of the file's contents
+        """
+
+        if len(buf) < _BINARY_HEADER.size:
+            raise KidneyReadException("Binary instance is truncated")
+        magic, self.n, edge_count, self.ndd_count, ndd_edge_count = \
+                _BINARY_HEADER.unpack(buf[:_BINARY_HEADER.size].tostring())
+        if magic != BINARY_MAGIC:
+            raise KidneyReadException("Not a binary instance")
+        layout, size = _binary_layout(edge_count, ndd_edge_count)
+        if len(buf) != size:
+            raise KidneyReadException("Binary instance has {} bytes; expected {}"
+                                      .format(len(buf), size))
+        self.buf = buf
+        for name, dtype, count, pos in layout:
+            setattr(self, name, buf[pos:pos + count * dtype.itemsize].view(dtype))
+
+    def digraph(self):
+        """Returns a new Digraph with the instance's pair-to-pair edges."""
+
+        return digraph_from_arrays(self.n, self.edge_src, self.edge_tgt, self.edge_score)
+
+    def ndds(self, digraph):
+        """Returns a new list of Ndd objects, whose edges point to vertices
+        of digraph."""
+
+        ndds = [Ndd() for __ in range(self.ndd_count)]
+        vs = digraph.vs
+        for src_id, tgt_id, score in zip(self.ndd_edge_src.tolist(), self.ndd_edge_tgt.tolist(),
+                                         self.ndd_edge_score.tolist()):
+            ndds[src_id].add_edge(NddEdge(vs[tgt_id], score))
+        return ndds
+
+    def instance(self):
+        """Returns a pair (digraph, ndds) of new objects for the instance."""
+
+        digraph = self.digraph()
+        return digraph, self.ndds(digraph)
+
+def load_binary_instance(path):
+    """Maps a binary instance file into memory, and returns a BinaryInstance."""
+
+    return BinaryInstance(np.memmap(path, dtype=np.uint8, mode='r'))
+
+def is_binary_instance(path):
+    """Returns True if and only if the file at path begins with the magic
+    string of the binary instance format."""
+
+    with open(path, 'rb') as f:
+        return f.read(len(BINARY_MAGIC)) == BINARY_MAGIC
+
+def write_binary_instance(f, digraph, ndds):
+    """Writes an instance in the binary format to a file object (opened in
+    binary mode) or path."""
+
+    if isinstance(f, basestring):
+        with open(f, 'wb') as opened:
+            return write_binary_instance(opened, digraph, ndds)
+
+    ndd_edges = [(i, e.target_v.id, e.score) for i, ndd in enumerate(ndds) for e in ndd.edges]
+    ndd_edge_src, ndd_edge_tgt, ndd_edge_score = zip(*ndd_edges) if ndd_edges else ([], [], [])
+    arrays = {"edge_src": digraph.edge_src, "edge_tgt": digraph.edge_tgt,
+              "edge_score": digraph.edge_score, "ndd_edge_src": ndd_edge_src,
+              "ndd_edge_tgt": ndd_edge_tgt, "ndd_edge_score": ndd_edge_score}
+    layout, size = _binary_layout(len(digraph.edge_src), len(ndd_edges))
+
+    f.write(_BINARY_HEADER.pack(BINARY_MAGIC, digraph.n, len(digraph.edge_src),
+                                len(ndds), len(ndd_edges)))
+    pos = _BINARY_HEADER.size
+    for name, dtype, count, array_pos in layout:
+        f.write("\0" * (array_pos - pos))
+        f.write(_as_numpy(arrays[name], dtype).tostring())
+        pos = array_pos + count * dtype.itemsize
+    f.write("\0" * (size - pos))
+
+def start():
+    parser = argparse.ArgumentParser(
+            "Convert an instance from standard input to the binary format")
+    parser.add_argument("output",
+            help="The path of the binary file to write")
+    parser.add_argument("--wmd", required=False, action="store_true",
+            help="Read the .wmd format, rather than .input optionally followed by .ndds")
+
+    args = parser.parse_args()
+
+    if args.wmd:
+        digraph, ndds = read_wmd(sys.stdin)
+    else:
+        digraph, ndds = read_instance(sys.stdin)
+    write_binary_instance(args.output, digraph, ndds)
+
+if __name__=="__main__":
+    start()
@@ -1,13 +1,15 @@
-"""Solving the kidney-exchange problem using the Gurobi IP solver."""
+"""Solving the kidney-exchange problem using an IP solver (see ip_backend)."""
 
 import copy
 import sys
 
 from kidney_digraph import *
 from kidney_ndds import *
+import graph_reduction
 import kidney_utils
-
-from gurobipy import *
+from enumeration_cache import find_cycles_flat, find_cycle_set, find_chain_set_cached
+import ip_backend
+from ip_backend import LESS_EQUAL, GREATER_EQUAL, EQUAL
 
 ###################################################################################################
 #                                                                                                 #
@@ -23,17 +25,25 @@ class OptConfig(object):
         ndds
         max_cycle
         max_chain
-        verbose: True if and only if Gurobi output should be writtent to screen and log file
+        verbose: True if and only if solver output should be writtent to screen and log file
         timelimit
         edge_success_prob
         eef_alt_constraints: True if and only if alternative EEF constraints should be used
         lp_file: The name of a .lp file to write, or None if the file should not be written
         relax: True if and only if the LP relaxation should be solved also
+        jobs: The number of worker processes to use for cycle enumeration
+            (None means one per CPU)
+        cache: An EnumerationCache for enumerated cycles and chains, or None
+        mip_start: A MipStart whose cycles and chains, where they are still
+            valid, are given to the solver as a starting solution, or None.
+            This is used by the PICEF, cycle and edge formulations.
+        backend: The IP solver backend (ip_backend.GUROBI or ip_backend.CBC)
     """
 
     def __init__(self, digraph, ndds, max_cycle, max_chain, verbose=False,
                  timelimit=None, edge_success_prob=1, eef_alt_constraints=False,
-                 lp_file=None, relax=False):
+                 lp_file=None, relax=False, jobs=1, cache=None, mip_start=None,
+                 backend=ip_backend.GUROBI):
         self.digraph = digraph
         self.ndds = ndds
         self.max_cycle = max_cycle
@@ -44,12 +54,16 @@ class OptConfig(object):
         self.eef_alt_constraints = eef_alt_constraints
         self.lp_file = lp_file
         self.relax = relax
+        self.jobs = jobs
+        self.cache = cache
+        self.mip_start = mip_start
+        self.backend = backend
 
 class OptSolution(object):
     """An optimal solution for a kidney-exchange problem instance.
     
     Data members:
-        ip_model: The Gurobi Model object
+        ip_model: The ip_backend.IPModel object
         cycles: A list of cycles in the optimal solution, each represented
             as a list of vertices
         chains: A list of chains in the optimal solution, each represented
@@ -103,23 +117,90 @@ class OptSolution(object):
                                    [old_to_new_vertices[i].id for i in c.vtx_indices],
                                    c.score)
                              for c in self.chains]
-        return OptSolution(self.ip_model, relabelled_cycles, relabelled_chains,
-                           new_digraph, self.edge_success_prob)
+        relabelled = OptSolution(self.ip_model, relabelled_cycles, relabelled_chains,
+                                 new_digraph, self.edge_success_prob)
+        if hasattr(self, "column_generation"):
+            relabelled.column_generation = self.column_generation
+        if hasattr(self, "portfolio"):
+            relabelled.portfolio = self.portfolio
+        return relabelled
+
+    def mip_start(self):
+        """Returns the solution's cycles and chains as a MipStart."""
+
+        return MipStart([[v.id for v in c] for c in self.cycles],
+                        [(c.ndd_index, c.vtx_indices) for c in self.chains])
+
+class MipStart(object):
+    """Cycles and chains to give to the solver as a starting solution, for
+    example from the solution of an earlier instance that differs from the
+    current one by a few arrivals and departures.
+
+    The cycles and chains need not all be valid in the instance being
+    solved. Before the start is used, cycles that have lost an edge or
+    exceed the cycle cap are dropped, and chains are cut short before their
+    first missing edge and at the chain cap (see valid_mip_start).
+
+    Data members:
+        cycles: A list of cycles, each a list of vertex IDs
+        chains: A list of (NDD index, list of vertex IDs) pairs
+    """
 
-def optimise(model, cfg):
+    def __init__(self, cycles=(), chains=()):
+        self.cycles = [list(c) for c in cycles]
+        self.chains = [(ndd_index, list(vtx_ids)) for ndd_index, vtx_ids in chains]
+
+    def relabelled(self, vertex_map, ndd_map=None):
+        """Returns a copy of the MipStart with each vertex ID v replaced by
+        vertex_map[v], and each NDD index i replaced by ndd_map[i] if ndd_map
+        is not None. Each map may be a dict or a list; a missing key, or a
+        value of None, means that the vertex or NDD is no longer present.
+        Cycles that include a missing vertex are dropped, and chains are cut
+        short before their first missing vertex.
+        """
+
+        def lookup(mapping, key):
+            if isinstance(mapping, dict):
+                return mapping.get(key)
+            return mapping[key] if 0 <= key < len(mapping) else None
+
+        cycles = []
+        for c in self.cycles:
+            new_cycle = [lookup(vertex_map, v) for v in c]
+            if None not in new_cycle:
+                cycles.append(new_cycle)
+        chains = []
+        for ndd_index, vtx_ids in self.chains:
+            if ndd_map is not None:
+                ndd_index = lookup(ndd_map, ndd_index)
+                if ndd_index is None:
+                    continue
+            new_vtx_ids = [lookup(vertex_map, v) for v in vtx_ids]
+            if None in new_vtx_ids:
+                new_vtx_ids = new_vtx_ids[:new_vtx_ids.index(None)]
+            if new_vtx_ids:
+                chains.append((ndd_index, new_vtx_ids))
+        return MipStart(cycles, chains)
+
+def relabel_mip_start(cfg, relabelled_cfg, new_vertex_ids, new_ndd_indices=None):
+    """Set relabelled_cfg.mip_start to cfg.mip_start relabelled with the maps
+    new_vertex_ids and new_ndd_indices (see MipStart.relabelled), if
+    cfg.mip_start is not None."""
+
+    if cfg.mip_start is not None:
+        relabelled_cfg.mip_start = cfg.mip_start.relabelled(new_vertex_ids, new_ndd_indices)
+
+def optimise(model, cfg, lazy_cuts=None):
     if cfg.lp_file:
-        model.update()
         model.write(cfg.lp_file)
         sys.exit(0)
     elif cfg.relax:
-        model.update()
-        r = model.relax()
-        r.optimize()
-        print "lp_relax_obj_val:", r.obj_val
-        print "lp_relax_solver_status:", r.status
+        obj_val, status = model.solve_relaxation()
+        print "lp_relax_obj_val:", obj_val
+        print "lp_relax_solver_status:", status
         sys.exit(0)
     else:
-        model.optimize()
+        model.optimize(lazy_cuts)
 
 def optimise_relabelled(formulation_fun, cfg):
     """Optimise on a relabelled graph such that vertices are sorted in descending
@@ -145,20 +226,210 @@ def optimise_relabelled(formulation_fun, cfg):
     relabelled_cfg = copy.copy(cfg)
     relabelled_cfg.digraph = relabelled_digraph
     relabelled_cfg.ndds = relabelled_ndds
+    relabel_mip_start(cfg, relabelled_cfg, [v.id for v in old_to_new_vtx])
 
     opt_result = formulation_fun(relabelled_cfg)
     return opt_result.relabelled_copy(sorted_vertices, cfg.digraph)
 
-def create_ip_model(time_limit, verbose):
-    """Create a Gurobi Model."""
+def optimise_reduced(formulation_fun, cfg, uncapped=False):
+    """Optimise on a reduced copy of the instance, without the vertices and
+    edges that cannot be in any cycle or chain.
+
+    Args:
+        formulation_fun: the function to optimise the reduced instance
+        cfg: an OptConfig object
+        uncapped: True if and only if formulation_fun ignores the cycle
+            and chain caps
+
+    Returns:
+        an OptSolution object for the original instance, with an
+        additional member "reduction" (a GraphReduction)
+    """
+
+    max_cycle, max_chain = cfg.max_cycle, cfg.max_chain
+    if uncapped:
+        max_cycle = max_chain = cfg.digraph.n
+    reduction = graph_reduction.reduce_instance(cfg.digraph, cfg.ndds, max_cycle, max_chain)
 
-    m = Model("kidney-mip")
-    if not verbose:
-        m.params.outputflag = 0
-    m.params.mipGap = 0
-    if time_limit is not None:
-        m.params.timelimit = time_limit
-    return m
+    reduced_cfg = copy.copy(cfg)
+    reduced_cfg.digraph = reduction.digraph
+    reduced_cfg.ndds = reduction.ndds
+    relabel_mip_start(cfg, reduced_cfg, {v.id: i for i, v in enumerate(reduction.kept_vertices)})
+
+    opt_result = formulation_fun(reduced_cfg)
+    opt_result = opt_result.relabelled_copy(reduction.kept_vertices, cfg.digraph)
+    opt_result.reduction = reduction
+    return opt_result
+
+def create_ip_model(cfg, barrier=False, presolve=True):
+    """Create an IPModel using the solver backend and time limit in cfg (see
+    ip_backend.create_model for barrier and presolve)."""
+
+    return ip_backend.create_model(cfg.backend, cfg.timelimit, cfg.verbose, barrier, presolve)
+
+def add_flow_constr(m, in_vars, out_vars, sense):
+    """Add a constraint comparing the sum of in_vars minus the sum of
+    out_vars with zero, using sense LESS_EQUAL, GREATER_EQUAL or EQUAL."""
+
+    m.add_constr(in_vars + out_vars, [1.0] * len(in_vars) + [-1.0] * len(out_vars), sense, 0)
+
+class ChainVars(object):
+    """The variables for the chain edges of a model.
+
+    These are kept with the model, rather than on the instance's NddEdge
+    objects, so that one instance can be solved by several models at once
+    (for example in threads) without being copied.
+
+    Data members:
+        ndd_edge_vars: A list such that ndd_edge_vars[i][j] is the variable
+            for edge j of NDD i (or an empty list if the model has no
+            chain variables)
+        edge_vars: A list such that edge_vars[i] is a list of the variables
+            for the pair->pair edge with ID i
+        edge_var_positions: A list such that edge_var_positions[i][j] is the
+            chain position of the edge represented by edge_vars[i][j], or
+            None if edge_vars[i] is the single variable for edge i at any
+            position
+    """
+
+    def __init__(self, ndd_edge_vars, edge_vars, edge_var_positions=None):
+        self.ndd_edge_vars = ndd_edge_vars
+        self.edge_vars = edge_vars
+        self.edge_var_positions = edge_var_positions
+
+def add_ndd_edge_vars(ndds, m):
+    """Add a binary variable for each NDD edge, and return a list whose
+    element i is the list of variables for the edges of NDD i."""
+
+    all_vars = m.add_binary_vars(sum(len(ndd.edges) for ndd in ndds))
+    ndd_edge_vars = []
+    start = 0
+    for ndd in ndds:
+        ndd_edge_vars.append(all_vars[start:start + len(ndd.edges)])
+        start += len(ndd.edges)
+    return ndd_edge_vars
+
+def add_ndd_constraints(ndd_edge_vars, m):
+    """Add a constraint that each NDD's edges are used at most once, given
+    a list ndd_edge_vars as returned by add_ndd_edge_vars."""
+
+    for variables in ndd_edge_vars:
+        m.add_constr(variables, None, LESS_EQUAL, 1)
+
+def chain_objective_terms(digraph, ndds, chain_vars, edge_success_prob=1):
+    """Returns a pair (coeffs, variables) of lists of the objective terms
+    for the variables in the ChainVars chain_vars. If edge_success_prob is
+    not 1, chain_vars must record edge positions, and each score is
+    multiplied by the probability that the chain reaches the edge."""
+
+    coeffs = []
+    variables = []
+    for ndd, ndd_vars in zip(ndds, chain_vars.ndd_edge_vars):
+        coeffs.extend(e.score * edge_success_prob for e in ndd.edges)
+        variables.extend(ndd_vars)
+    edge_vars = chain_vars.edge_vars
+    for e in digraph.es:
+        if edge_success_prob == 1:
+            coeffs.extend([e.score] * len(edge_vars[e.id]))
+        else:
+            coeffs.extend(e.score * edge_success_prob**(pos+1)
+                          for pos in chain_vars.edge_var_positions[e.id])
+        variables.extend(edge_vars[e.id])
+    return coeffs, variables
+
+###################################################################################################
+#                                                                                                 #
+#                                            MIP starts                                           #
+#                                                                                                 #
+###################################################################################################
+
+def valid_mip_start(cfg):
+    """Find the parts of cfg.mip_start that are valid in the instance.
+
+    A cycle is kept if its vertices and edges exist, its length is at most
+    the cycle cap, and it shares no vertex with a cycle kept before it. A
+    chain is kept if its NDD exists and is not used by an earlier chain,
+    and it is cut short before its first vertex that does not exist, is
+    already used, or is not reached by an edge, and at the chain cap.
+
+    Args:
+        cfg: an OptConfig object whose mip_start is not None
+
+    Returns:
+        a pair (cycles, chains), where cycles is a list of cycles, each a
+        list of vertex IDs, and chains is a list of (NDD index, list of
+        vertex IDs) pairs
+    """
+
+    digraph = cfg.digraph
+    used = set()
+    cycles = []
+    for c in cfg.mip_start.cycles:
+        if (2 <= len(c) <= cfg.max_cycle and len(set(c)) == len(c) and
+                all(0 <= v < digraph.n and v not in used for v in c) and
+                all(digraph.get_edge(c[i-1], c[i]) is not None for i in range(len(c)))):
+            cycles.append(c)
+            used.update(c)
+
+    chains = []
+    ndds_used = set()
+    for ndd_index, vtx_ids in cfg.mip_start.chains:
+        if not 0 <= ndd_index < len(cfg.ndds) or ndd_index in ndds_used:
+            continue
+        chain = []
+        ndd_targets = set(e.target_v.id for e in cfg.ndds[ndd_index].edges)
+        for v in vtx_ids[:cfg.max_chain]:
+            if not 0 <= v < digraph.n or v in used:
+                break
+            if chain and digraph.get_edge(chain[-1], v) is None:
+                break
+            if not chain and v not in ndd_targets:
+                break
+            chain.append(v)
+            used.add(v)
+        if chain:
+            chains.append((ndd_index, chain))
+            ndds_used.add(ndd_index)
+    return cycles, chains
+
+def find_cycle_indices(cycles, start_cycles):
+    """Returns the indices in the CycleSet cycles of those of start_cycles
+    (lists of vertex IDs) that it contains."""
+
+    def canonical(c):
+        i = c.index(min(c))
+        return c[i:] + c[:i]
+
+    vtx_offsets, cycle_ids = cycles.vertex_incidence()
+    indices = []
+    for c in start_cycles:
+        target = canonical(c)
+        v = target[0]
+        for i in cycle_ids[vtx_offsets[v]:vtx_offsets[v+1]].tolist():
+            if cycles.lengths[i] == len(c) and canonical(cycles[i].tolist()) == target:
+                indices.append(i)
+                break
+    return indices
+
+def find_chain_edge_vars(digraph, ndds, start_chains, chain_vars):
+    """Returns the variables in the ChainVars chain_vars of the NDD edges and
+    pair->pair edges of the chains start_chains ((NDD index, vertex IDs)
+    pairs)."""
+
+    edge_vars = chain_vars.edge_vars
+    edge_var_positions = chain_vars.edge_var_positions
+    start_vars = []
+    for ndd_index, vtx_ids in start_chains:
+        for e, var in zip(ndds[ndd_index].edges, chain_vars.ndd_edge_vars[ndd_index]):
+            if e.target_v.id == vtx_ids[0]:
+                start_vars.append(var)
+        for pos, (src_id, tgt_id) in enumerate(zip(vtx_ids[:-1], vtx_ids[1:]), 1):
+            edge_id = digraph.get_edge(src_id, tgt_id).id
+            if edge_var_positions is None:
+                start_vars.append(edge_vars[edge_id][0])
+            else:
+                start_vars.append(edge_vars[edge_id][edge_var_positions[edge_id].index(pos)])
+    return start_vars
 
 ###################################################################################################
 #                                                                                                 #
@@ -172,40 +443,50 @@ def add_unlimited_vars_and_constraints(digraph, ndds, m):
     Args:
         digraph: the instance digraph
         ndds: a list of NDDs in the instance
-        m: The Gurobi model
+        m: The IPModel
+
+    Returns:
+        A ChainVars object, with a single variable for each pair->pair edge
     """
 
-    for v in digraph.vs:
-        v.grb_vars_in  = []
-        v.grb_vars_out = []
+    # For each vertex, the variables of edges into and out of the vertex
+    vtx_vars_in = [[] for __ in digraph.vs]
+    vtx_vars_out = [[] for __ in digraph.vs]
 
-    for ndd in ndds:
-        ndd_edge_vars = []
-        for e in ndd.edges:
-            edge_var = m.addVar(vtype=GRB.BINARY)
-            e.edge_var = edge_var
-            ndd_edge_vars.append(edge_var)
-            e.target_v.grb_vars_in.append(edge_var)
-        m.update()
-        m.addConstr(quicksum(ndd_edge_vars) <= 1)
+    ndd_edge_vars = add_ndd_edge_vars(ndds, m)
+    for ndd, ndd_vars in zip(ndds, ndd_edge_vars):
+        for e, edge_var in zip(ndd.edges, ndd_vars):
+            vtx_vars_in[e.target_v.id].append(edge_var)
 
     # Add pair->pair edge variables
-    for e in digraph.es:
-        e.grb_vars = []
-        edge_var = m.addVar(vtype=GRB.BINARY)
-        e.grb_vars.append(edge_var)
-        e.src.grb_vars_out.append(edge_var)
-        e.tgt.grb_vars_in.append(edge_var)
+    pair_edge_vars = m.add_binary_vars(len(digraph.es))
+    edge_vars = [[edge_var] for edge_var in pair_edge_vars]
+    for e, edge_var in zip(digraph.es, pair_edge_vars):
+        vtx_vars_out[e.src.id].append(edge_var)
+        vtx_vars_in[e.tgt.id].append(edge_var)
 
-    m.update()
+    add_ndd_constraints(ndd_edge_vars, m)
 
     for v in digraph.vs:
-        if len(v.grb_vars_in) > 1:
-            m.addConstr(quicksum(v.grb_vars_in) <= 1)
+        if len(vtx_vars_in[v.id]) > 1:
+            m.add_constr(vtx_vars_in[v.id], None, LESS_EQUAL, 1)
 
     # Sum of edges into a vertex must be >= sum of edges out
     for v in digraph.vs:
-        m.addConstr(quicksum(v.grb_vars_in) >= quicksum(v.grb_vars_out))
+        add_flow_constr(m, vtx_vars_in[v.id], vtx_vars_out[v.id], GREATER_EQUAL)
+
+    return ChainVars(ndd_edge_vars, edge_vars)
+
+def set_edge_mip_start(cfg, m, chain_vars):
+    """Set a MIP start for an edge formulation from cfg.mip_start, where
+    chain_vars is as returned by add_unlimited_vars_and_constraints."""
+
+    start_cycles, start_chains = valid_mip_start(cfg)
+    start_vars = find_chain_edge_vars(cfg.digraph, cfg.ndds, start_chains, chain_vars)
+    for c in start_cycles:
+        for src_id, tgt_id in zip(c, c[1:] + c[:1]):
+            start_vars.append(chain_vars.edge_vars[cfg.digraph.get_edge(src_id, tgt_id).id][0])
+    m.set_start(start_vars)
 
 def optimise_uuef(cfg):
     """Optimise using the uncapped edge formulation.
@@ -220,94 +501,210 @@ def optimise_uuef(cfg):
     if cfg.edge_success_prob != 1:
         raise ValueError("This formulation does not support failure-aware matching.")
 
-    m = create_ip_model(cfg.timelimit, cfg.verbose)
+    m = create_ip_model(cfg)
 
-    add_unlimited_vars_and_constraints(cfg.digraph, cfg.ndds, m)
+    chain_vars = add_unlimited_vars_and_constraints(cfg.digraph, cfg.ndds, m)
+    edge_vars = chain_vars.edge_vars
 
-    obj_expr = ( quicksum(e.score * e.edge_var for ndd in cfg.ndds for e in ndd.edges) +
-                 quicksum(e.score * var for e in cfg.digraph.es for var in e.grb_vars) )
-   
-    m.setObjective(obj_expr, GRB.MAXIMIZE)
+    obj_coeffs, obj_vars = chain_objective_terms(cfg.digraph, cfg.ndds, chain_vars)
+    m.set_objective(obj_vars, obj_coeffs)
+    if cfg.mip_start is not None:
+        set_edge_mip_start(cfg, m, chain_vars)
     optimise(m, cfg)
 
     # Try all possible cycle start positions
     cycle_start_vv = range(cfg.digraph.n)
 
-    cycle_next_vv = {}
-    for e in cfg.digraph.es:
-        for var in e.grb_vars:
-            if var.x > 0.1:
-                cycle_next_vv[e.src.id] = e.tgt.id
+    edge_vals = m.get_values([edge_vars[e.id][0] for e in cfg.digraph.es])
+    cycle_next_vv = {e.src.id: e.tgt.id for e, val in zip(cfg.digraph.es, edge_vals) if val > 0.1}
 
     return OptSolution(ip_model=m,
                        cycles=kidney_utils.selected_edges_to_cycles(
                                     cfg.digraph, cycle_start_vv, cycle_next_vv),
-                       chains=kidney_utils.get_optimal_chains(cfg.digraph, cfg.ndds),
+                       chains=kidney_utils.get_optimal_chains(m, cfg.digraph, cfg.ndds, chain_vars),
                        digraph=cfg.digraph)
         
+###################################################################################################
+#                                                                                                 #
+#                        Edge formulation with lazy cycle and chain caps                          #
+#                                                                                                 #
+###################################################################################################
+
+def find_cap_violations(next_vv, ndd_edge_targets, max_cycle, max_chain):
+    """Find the over-long cycles and chains in a set of selected edges, and
+    return lists of edges whose variables sum to at most some bound in any
+    solution that respects the caps.
+
+    A path of L = max(max_cycle, max_chain, 1) pair->pair edges can be in
+    neither a permitted cycle nor a permitted chain, so at most L-1 of its
+    edges may be selected. Each cycle longer than L yields one such path
+    for each of its vertices, and each shorter cycle that exceeds the cycle
+    cap is itself forbidden. For a chain with at least max_chain pair->pair
+    edges, the NDD edge and the following max_chain edges are forbidden.
+
+    Args:
+        next_vv: a dict from vertex ID to the target of the selected edge
+            leaving it
+        ndd_edge_targets: a list of (NDD edge index, target vertex ID) pairs
+            for the selected NDD edges
+        max_cycle, max_chain: the caps
+
+    Returns:
+        a list of (ndd_edge, edges, bound) triples, where ndd_edge is an
+        NDD edge index or None, edges is a list of (source ID, target ID)
+        pairs, and bound is the maximum number of the edges (including
+        ndd_edge) that may be selected
+    """
+
+    cuts = []
+    path_len = max(max_cycle, max_chain, 1)
+    in_chain = set()
+    for ndd_edge, v_id in ndd_edge_targets:
+        chain = kidney_utils.find_selected_path(v_id, next_vv)
+        in_chain.update(chain)
+        if len(chain) - 1 >= max_chain:
+            cuts.append((ndd_edge, zip(chain[:max_chain], chain[1:max_chain+1]), max_chain))
+
+    visited = set(in_chain)
+    for start in next_vv:
+        if start in visited:
+            continue
+        cycle = kidney_utils.find_selected_cycle(start, next_vv)
+        if cycle is None:
+            visited.update(kidney_utils.find_selected_path(start, next_vv))
+            continue
+        visited.update(cycle)
+        if len(cycle) <= max_cycle:
+            continue
+        cycle_edges = zip(cycle, cycle[1:] + cycle[:1])
+        if len(cycle) <= path_len:
+            cuts.append((None, cycle_edges, len(cycle) - 1))
+        else:
+            for i in range(len(cycle)):
+                path = (cycle_edges[i:] + cycle_edges[:i])[:path_len]
+                cuts.append((None, path, path_len - 1))
+    return cuts
+
+def optimise_lazy_ef(cfg):
+    """Optimise using the edge formulation, with one variable per edge, in
+    which the cycle and chain caps are enforced by lazy constraints.
+
+    The model has the constraints of the uncapped edge formulation. Each
+    time the solver finds an integer solution, a callback adds constraints
+    (from find_cap_violations) that cut off its over-long cycles and
+    chains.
+
+    Args:
+        cfg: an OptConfig object
+
+    Returns:
+        an OptSolution object
+    """
+
+    if cfg.edge_success_prob != 1:
+        raise ValueError("This formulation does not support failure-aware matching.")
+
+    m = create_ip_model(cfg)
+
+    chain_vars = add_unlimited_vars_and_constraints(cfg.digraph, cfg.ndds, m)
+    edge_vars = chain_vars.edge_vars
+    ndd_edges = [e for ndd in cfg.ndds for e in ndd.edges]
+
+    obj_coeffs, obj_vars = chain_objective_terms(cfg.digraph, cfg.ndds, chain_vars)
+    m.set_objective(obj_vars, obj_coeffs)
+
+    pair_edge_vars = [edge_vars[e.id][0] for e in cfg.digraph.es]
+    ndd_edge_vars = [var for ndd_vars in chain_vars.ndd_edge_vars for var in ndd_vars]
+    edge_var_lookup = {(e.src.id, e.tgt.id): var for e, var in zip(cfg.digraph.es, pair_edge_vars)}
+
+    def cap_constraints(get_values):
+        pair_vals = get_values(pair_edge_vars)
+        ndd_vals = get_values(ndd_edge_vars)
+        next_vv = {e.src.id: e.tgt.id for e, val in zip(cfg.digraph.es, pair_vals) if val > 0.5}
+        ndd_edge_targets = [(i, e.target_v.id) for i, (e, val) in enumerate(zip(ndd_edges, ndd_vals))
+                            if val > 0.5]
+        cuts = []
+        for ndd_edge, edges, bound in find_cap_violations(next_vv, ndd_edge_targets,
+                                                          cfg.max_cycle, cfg.max_chain):
+            cut_vars = [edge_var_lookup[e] for e in edges]
+            if ndd_edge is not None:
+                cut_vars.append(ndd_edge_vars[ndd_edge])
+            cuts.append((cut_vars, bound))
+        return cuts
+
+    if cfg.mip_start is not None:
+        set_edge_mip_start(cfg, m, chain_vars)
+    optimise(m, cfg, cap_constraints)
+
+    edge_vals = m.get_values([edge_vars[e.id][0] for e in cfg.digraph.es])
+    cycle_next_vv = {e.src.id: e.tgt.id for e, val in zip(cfg.digraph.es, edge_vals) if val > 0.1}
+
+    return OptSolution(ip_model=m,
+                       cycles=kidney_utils.selected_edges_to_cycles(
+                                    cfg.digraph, range(cfg.digraph.n), cycle_next_vv),
+                       chains=kidney_utils.get_optimal_chains(m, cfg.digraph, cfg.ndds, chain_vars),
+                       digraph=cfg.digraph)
+
 ###################################################################################################
 #                                                                                                 #
 #                  Chain vars and constraints (used by HPIEF', HPIEF'' and PICEF)                 #
 #                                                                                                 #
 ###################################################################################################
 
-def add_chain_vars_and_constraints(digraph, ndds, max_chain, m, vtx_to_vars,
-                                   store_edge_positions=False):
+def add_chain_vars_and_constraints(digraph, ndds, max_chain, m, vtx_to_vars):
     """Add the IP variables and constraints for chains in PICEF and HPIEF'.
 
     Args:
         ndds: a list of NDDs in the instance
         max_chain: the chain cap
-        m: The Gurobi model
+        m: The IPModel
         vtx_to_vars: A list such that for each Vertex v in the Digraph,
-            vtx_to_vars[v.id] will contain the Gurobi variables representing
+            vtx_to_vars[v.id] will contain the variables representing
             edges pointing to v.
-        store_edge_positions: if this is True, then an attribute grb_edge_positions
-            will be added to edges that have associated Gurobi variables.
-            edge.grb_edge_positions[i] will indicate the position of the edge respresented
-            by edge.grb_vars[i]. (default: False)
+
+    Returns:
+        A ChainVars object, with edge positions
     """
 
+    ndd_edge_vars = [[] for __ in ndds]
+    edge_vars = [[] for __ in digraph.es]
+    edge_var_positions = [[] for __ in digraph.es]
+
     if max_chain > 0:
-        for v in digraph.vs:
-            v.grb_vars_in  = [[] for i in range(max_chain-1)]
-            v.grb_vars_out = [[] for i in range(max_chain-1)]
-
-        for ndd in ndds:
-            ndd_edge_vars = []
-            for e in ndd.edges:
-                edge_var = m.addVar(vtype=GRB.BINARY)
-                e.edge_var = edge_var
-                ndd_edge_vars.append(edge_var)
+        # For each vertex and chain position, the variables of edges into
+        # and out of the vertex
+        vtx_vars_in = [[[] for i in range(max_chain-1)] for __ in digraph.vs]
+        vtx_vars_out = [[[] for i in range(max_chain-1)] for __ in digraph.vs]
+
+        ndd_edge_vars = add_ndd_edge_vars(ndds, m)
+        for ndd, ndd_vars in zip(ndds, ndd_edge_vars):
+            for e, edge_var in zip(ndd.edges, ndd_vars):
                 vtx_to_vars[e.target_v.id].append(edge_var)
-                if max_chain>1: e.target_v.grb_vars_in[0].append(edge_var)
-            m.update()
-            m.addConstr(quicksum(ndd_edge_vars) <= 1)
+                if max_chain>1: vtx_vars_in[e.target_v.id][0].append(edge_var)
 
         dists_from_ndd = kidney_utils.get_dist_from_nearest_ndd(digraph, ndds)
 
         # Add pair->pair edge variables, indexed by position in chain
-        for e in digraph.es:
-            e.grb_vars = []
-            if store_edge_positions:
-                e.grb_var_positions = []
-            for i in range(max_chain-1):
-                if dists_from_ndd[e.src.id] <= i+1:
-                    edge_var = m.addVar(vtype=GRB.BINARY)
-                    e.grb_vars.append(edge_var)
-                    if store_edge_positions:
-                        e.grb_var_positions.append(i+1)
-                    vtx_to_vars[e.tgt.id].append(edge_var)
-                    e.src.grb_vars_out[i].append(edge_var)
-                    if i < max_chain-2:
-                        e.tgt.grb_vars_in[i+1].append(edge_var)
-
-        m.update()
+        positions = [(e, i) for e in digraph.es for i in range(max_chain-1)
+                     if dists_from_ndd[e.src.id] <= i+1]
+        for (e, i), edge_var in zip(positions, m.add_binary_vars(len(positions))):
+            src_id = e.src.id
+            tgt_id = e.tgt.id
+            edge_vars[e.id].append(edge_var)
+            edge_var_positions[e.id].append(i+1)
+            vtx_to_vars[tgt_id].append(edge_var)
+            vtx_vars_out[src_id][i].append(edge_var)
+            if i < max_chain-2:
+                vtx_vars_in[tgt_id][i+1].append(edge_var)
+
+        add_ndd_constraints(ndd_edge_vars, m)
 
         # At each chain position, sum of edges into a vertex must be >= sum of edges out
         for i in range(max_chain-1):
             for v in digraph.vs:
-                m.addConstr(quicksum(v.grb_vars_in[i]) >= quicksum(v.grb_vars_out[i]))
+                add_flow_constr(m, vtx_vars_in[v.id][i], vtx_vars_out[v.id][i], GREATER_EQUAL)
+
+    return ChainVars(ndd_edge_vars, edge_vars, edge_var_positions)
 
 ###################################################################################################
 #                                                                                                 #
@@ -316,95 +713,102 @@ def add_chain_vars_and_constraints(digraph, ndds, max_chain, m, vtx_to_vars,
 ###################################################################################################
 
 def add_hpief_prime_vars_partial_red(max_cycle, digraph, m, hpief_2_prime=False):
-    vars_and_edges = [] # A list of (gurobi_var, position, edge, low_vertex) tuples
+    vars_and_edges = [] # A list of (var, position, edge, low_vertex) tuples
 
     # max_pos is the maximum edge position for which variables may be created
     max_pos = max_cycle-2 if hpief_2_prime else max_cycle-1
     
-    # Index i is in the list edge_vars_in[pos][v][low_v] if and only if
+    # Index i is in the list edge_vars_in[pos, v, low_v] if and only if
     # vars_and_edges[i] corresponds to an edge at position pos, pointing to vertex
-    # v, in low_v's graph copy 
-    edge_vars_in = [[[[] for __ in range(digraph.n)] for __ in range(digraph.n)] for __ in range(max_pos + 1)]
+    # v, in low_v's graph copy. Only non-empty lists are stored.
+    edge_vars_in = {}
 
-    # Index i is in the list edge_vars_out[pos][v][low_v] if and only if
+    # Index i is in the list edge_vars_out[pos, v, low_v] if and only if
     # vars_and_edges[i] corresponds to an edge at position pos, leaving vertex
-    # v, in low_v's graph copy 
-    edge_vars_out = [[[[] for __ in range(digraph.n)] for __ in range(digraph.n)] for __ in range(max_pos + 1)]
-
-    for low_vtx in range(digraph.n-1):
-        # Length of shortest path from low vertex to each vertex with a higher index
-        # Default value is 999999999 (which represents infinity)
-        shortest_path_from_lv = digraph.get_shortest_path_from_low_vtx(low_vtx, max_cycle-1) 
-        shortest_path_to_lv = digraph.get_shortest_path_to_low_vtx(low_vtx, max_cycle-1) 
-
-        for v1 in digraph.vs[low_vtx+1:]:
-            for e in v1.edges:
-                if e.tgt.id >=low_vtx:
-                    for pos in xrange(1, max_pos + 1):
-                        if (shortest_path_from_lv[e.src.id] <= pos and
-                                    shortest_path_to_lv[e.tgt.id] < max_cycle - pos):
-                            new_var = m.addVar(vtype=GRB.BINARY)
-                            vars_and_edges.append((new_var, pos, e, low_vtx))
-                            idx = len(vars_and_edges) - 1 # Index of tuple just added
-                            edge_vars_in[pos][e.tgt.id][low_vtx].append(idx)
-                            edge_vars_out[pos][e.src.id][low_vtx].append(idx)
-    m.update()
+    # v, in low_v's graph copy. Only non-empty lists are stored.
+    edge_vars_out = {}
+
+    csr = digraph.csr()
+    for low_vtx, shortest_path_from_lv, shortest_path_to_lv in \
+            digraph.generate_low_vtx_distances(max_cycle-1, range(digraph.n-1)):
+        # shortest_path_from_lv and shortest_path_to_lv map each vertex within
+        # max_cycle-1 edges of the low vertex to the length of its shortest
+        # path from and to the low vertex. Only reachable vertices can be
+        # the source of an edge in low_vtx's graph copy.
+        for v1_id in sorted(shortest_path_from_lv):
+            if v1_id == low_vtx:
+                continue
+            dist_from_lv = shortest_path_from_lv[v1_id]
+            for i in range(csr.offsets[v1_id], csr.offsets[v1_id+1]):
+                tgt_id = csr.targets[i]
+                dist_to_lv = shortest_path_to_lv.get(tgt_id, max_cycle)
+                for pos in xrange(dist_from_lv, max_pos + 1):
+                    if dist_to_lv < max_cycle - pos:
+                        e = digraph.es[csr.edge_ids[i]]
+                        vars_and_edges.append((pos, e, low_vtx))
+                        idx = len(vars_and_edges) - 1 # Index of tuple just added
+                        edge_vars_in.setdefault((pos, tgt_id, low_vtx), []).append(idx)
+                        edge_vars_out.setdefault((pos, v1_id, low_vtx), []).append(idx)
+    vars_and_edges = [(new_var,) + t
+                      for new_var, t in zip(m.add_binary_vars(len(vars_and_edges)), vars_and_edges)]
     return vars_and_edges, edge_vars_in, edge_vars_out
 
-def add_hpief_prime_vars_full_red(max_cycle, digraph, m, hpief_2_prime=False):
-    vars_and_edges = [] # A list of (gurobi_var, position, edge, low_vertex) tuples
+def add_hpief_prime_vars_full_red(max_cycle, digraph, m, hpief_2_prime=False, jobs=1, cache=None):
+    vars_and_edges = [] # A list of (var, position, edge, low_vertex) tuples
 
-    # max_pos is the maximum edge position for which variables may be created
-    max_pos = max_cycle-2 if hpief_2_prime else max_cycle-1
-    
-    edge_vars_in = [[[[] for __ in range(digraph.n)] for __ in range(digraph.n)] for __ in range(max_pos + 1)]
-    edge_vars_out = [[[[] for __ in range(digraph.n)] for __ in range(digraph.n)] for __ in range(max_pos + 1)]
+    edge_vars_in = {}
+    edge_vars_out = {}
 
     edges_seen = set()  # (low_v_id, src_v_id, tgt_v_id, pos) tuples
-    for cycle in digraph.generate_cycles(max_cycle):
+    cycle_vertices, cycle_offsets = find_cycles_flat(digraph, max_cycle, jobs, cache)
+    for start, end in zip(cycle_offsets[:-1], cycle_offsets[1:]):
+        cycle = cycle_vertices[start:end]
         for i in range(1, len(cycle)-1):
-            edges_seen.add((cycle[0].id, cycle[i].id, cycle[i+1].id, i))
+            edges_seen.add((cycle[0], cycle[i], cycle[i+1], i))
         if not hpief_2_prime or len(cycle) < max_cycle:
-            edges_seen.add((cycle[0].id, cycle[-1].id, cycle[0].id, len(cycle)-1))
+            edges_seen.add((cycle[0], cycle[-1], cycle[0], len(cycle)-1))
             
-    for low_v, src_v, tgt_v, pos in edges_seen:
-        new_var = m.addVar(vtype=GRB.BINARY)
-        e = digraph.adj_mat[src_v][tgt_v]
+    new_vars = m.add_binary_vars(len(edges_seen))
+    for new_var, (low_v, src_v, tgt_v, pos) in zip(new_vars, edges_seen):
+        e = digraph.get_edge(src_v, tgt_v)
         vars_and_edges.append((new_var, pos, e, low_v))
         idx = len(vars_and_edges) - 1 # Index of tuple just added
-        edge_vars_in[pos][tgt_v][low_v].append(idx)
-        edge_vars_out[pos][src_v][low_v].append(idx)
-    m.update()
+        edge_vars_in.setdefault((pos, tgt_v, low_v), []).append(idx)
+        edge_vars_out.setdefault((pos, src_v, low_v), []).append(idx)
     return vars_and_edges, edge_vars_in, edge_vars_out
 
-def add_hpief_prime_vars_and_constraints(max_cycle, digraph, vtx_to_in_edges, m, full_red, hpief_2_prime=False):
+def add_hpief_prime_vars_and_constraints(max_cycle, digraph, vtx_to_in_edges, m, full_red, hpief_2_prime=False,
+                                         jobs=1, cache=None):
     max_pos = max_cycle-2 if hpief_2_prime else max_cycle-1
 
     if full_red:
-        vars_and_edges, edge_vars_in, edge_vars_out = add_hpief_prime_vars_full_red(max_cycle, digraph, m, hpief_2_prime)
+        vars_and_edges, edge_vars_in, edge_vars_out = add_hpief_prime_vars_full_red(
+                max_cycle, digraph, m, hpief_2_prime, jobs, cache)
     else:
         vars_and_edges, edge_vars_in, edge_vars_out = add_hpief_prime_vars_partial_red(max_cycle, digraph, m, hpief_2_prime)
     
-    for grb_var, pos, edge, low_vtx in vars_and_edges:
-        vtx_to_in_edges[edge.tgt.id].append(grb_var)
+    for ip_var, pos, edge, low_vtx in vars_and_edges:
+        vtx_to_in_edges[edge.tgt.id].append(ip_var)
         if pos==1:
-            vtx_to_in_edges[edge.src.id].append(grb_var)
+            vtx_to_in_edges[edge.src.id].append(ip_var)
         if hpief_2_prime and pos == max_cycle - 2 and edge.tgt.id != low_vtx:
-            vtx_to_in_edges[low_vtx].append(grb_var)
+            vtx_to_in_edges[low_vtx].append(ip_var)
         
     # Capacity constraint for vertices
     for l in vtx_to_in_edges:
         if len(l) > 0:
-            m.addConstr(quicksum(l) <= 1)
+            m.add_constr(l, None, LESS_EQUAL, 1)
     
-    # Cycle flow-conservation constraint for vertices
-    for pos in range(1, max_pos):
-        for v in range(digraph.n):
-            for low_v_id in range(v):
-                in_vars  = [vars_and_edges[i][0] for i in edge_vars_in[pos][v][low_v_id]]
-                out_vars = [vars_and_edges[i][0] for i in edge_vars_out[pos+1][v][low_v_id]]
-                if len(in_vars) > 0 or len(out_vars) > 0:
-                    m.addConstr(quicksum(in_vars) == quicksum(out_vars))
+    # Cycle flow-conservation constraint for vertices, for each (pos, v, low_v)
+    # with low_v < v and an edge into v at position pos or out of v at
+    # position pos+1 in low_v's graph copy
+    flow_keys = set(key for key in edge_vars_in if 1 <= key[0] < max_pos)
+    flow_keys.update((pos-1, v, low_v_id) for pos, v, low_v_id in edge_vars_out if pos >= 2)
+    for pos, v, low_v_id in sorted(flow_keys):
+        if low_v_id < v:
+            in_vars  = [vars_and_edges[i][0] for i in edge_vars_in.get((pos, v, low_v_id), [])]
+            out_vars = [vars_and_edges[i][0] for i in edge_vars_out.get((pos+1, v, low_v_id), [])]
+            add_flow_constr(m, in_vars, out_vars, EQUAL)
 
     return vars_and_edges
 
@@ -429,41 +833,43 @@ def optimise_hpief_prime(cfg, full_red=False, hpief_2_prime=False):
     if cfg.max_cycle < 3:
         hpief_2_prime = False
 
-    m = create_ip_model(cfg.timelimit, cfg.verbose)
-    m.params.method = 2
-    m.params.presolve = 0
+    m = create_ip_model(cfg, barrier=True, presolve=False)
 
     # For each vertex v, a list of variables corresponding to in-edges to v
     vtx_to_in_edges = [[] for __ in cfg.digraph.vs]
 
-    add_chain_vars_and_constraints(cfg.digraph, cfg.ndds, cfg.max_chain, m, vtx_to_in_edges)
+    chain_vars = add_chain_vars_and_constraints(
+            cfg.digraph, cfg.ndds, cfg.max_chain, m, vtx_to_in_edges)
 
     vars_and_edges = add_hpief_prime_vars_and_constraints(
-            cfg.max_cycle, cfg.digraph, vtx_to_in_edges, m, full_red, hpief_2_prime)
+            cfg.max_cycle, cfg.digraph, vtx_to_in_edges, m, full_red, hpief_2_prime, cfg.jobs,
+            cfg.cache)
 
-    obj_terms = []
+    obj_coeffs = []
+    obj_vars = []
     for var, pos, edge, low_v_id in vars_and_edges:
         score = edge.score
         if pos==1:
-            score += cfg.digraph.adj_mat[low_v_id][edge.src.id].score
+            score += cfg.digraph.get_edge(low_v_id, edge.src.id).score
         if hpief_2_prime and pos==cfg.max_cycle - 2 and edge.tgt.id != low_v_id:
-            score += cfg.digraph.adj_mat[edge.tgt.id][low_v_id].score
-        obj_terms.append(score * var)
+            score += cfg.digraph.get_edge(edge.tgt.id, low_v_id).score
+        obj_coeffs.append(score)
+        obj_vars.append(var)
 
-    obj_expr = quicksum(obj_terms)
-   
     if cfg.max_chain > 0:
-        obj_expr += quicksum(e.score * e.edge_var for ndd in cfg.ndds for e in ndd.edges) 
-        obj_expr += quicksum(e.score * var for e in cfg.digraph.es for var in e.grb_vars)
+        chain_coeffs, chain_obj_vars = chain_objective_terms(cfg.digraph, cfg.ndds, chain_vars)
+        obj_coeffs += chain_coeffs
+        obj_vars += chain_obj_vars
     
-    m.setObjective(obj_expr, GRB.MAXIMIZE)
+    m.set_objective(obj_vars, obj_coeffs)
     optimise(m, cfg)
 
     cycle_start_vv = []
     cycle_next_vv = {}
     
-    for var, pos, edge, low_v_id in vars_and_edges:
-        if var.x > 0.1:
+    var_vals = m.get_values([var for var, pos, edge, low_v_id in vars_and_edges])
+    for (var, pos, edge, low_v_id), val in zip(vars_and_edges, var_vals):
+        if val > 0.1:
             cycle_next_vv[edge.src.id] = edge.tgt.id
             if pos == 1:
                 cycle_start_vv.append(low_v_id)
@@ -474,7 +880,8 @@ def optimise_hpief_prime(cfg, full_red=False, hpief_2_prime=False):
     return OptSolution(ip_model=m,
                        cycles=kidney_utils.selected_edges_to_cycles(
                                     cfg.digraph, cycle_start_vv, cycle_next_vv),
-                       chains=[] if cfg.max_chain==0 else kidney_utils.get_optimal_chains(cfg.digraph, cfg.ndds),
+                       chains=[] if cfg.max_chain==0 else kidney_utils.get_optimal_chains(m,
+                            cfg.digraph, cfg.ndds, chain_vars),
                        digraph=cfg.digraph)
 
 ###################################################################################################
@@ -504,6 +911,23 @@ def optimise_hpief_2prime_full_red(cfg):
 #                                                                                                 #
 ###################################################################################################
 
+def add_vars_to_vertex_lists(incidence, item_vars, vtx_to_vars):
+    """Given a vertex incidence index (vtx_offsets, item_ids) of a CycleSet
+    or ChainSet, append item_vars[i] to vtx_to_vars[v] for each cycle or
+    chain i and each vertex v in it."""
+
+    vtx_offsets, vtx_items = incidence
+    vtx_offsets = vtx_offsets.tolist()
+    vtx_items = vtx_items.tolist()
+    for v, l in enumerate(vtx_to_vars):
+        l.extend(item_vars[i] for i in vtx_items[vtx_offsets[v]:vtx_offsets[v+1]])
+
+def add_cycle_vars_to_vertex_lists(cycles, cycle_vars, vtx_to_vars):
+    """For each cycle i in the CycleSet cycles, append cycle_vars[i] to
+    vtx_to_vars[v] for each vertex v in the cycle."""
+
+    add_vars_to_vertex_lists(cycles.vertex_incidence(), cycle_vars, vtx_to_vars)
+
 def optimise_picef(cfg):
     """Optimise using the PICEF formulation.
 
@@ -514,49 +938,43 @@ def optimise_picef(cfg):
         an OptSolution object
     """
 
-    cycles = cfg.digraph.find_cycles(cfg.max_cycle)
+    cycles = find_cycle_set(cfg.digraph, cfg.max_cycle, cfg.jobs, cfg.cache)
 
-    m = create_ip_model(cfg.timelimit, cfg.verbose)
-    m.params.method = 2
+    m = create_ip_model(cfg, barrier=True)
 
-    cycle_vars = [m.addVar(vtype=GRB.BINARY) for __ in cycles]
-    m.update()
+    cycle_vars = m.add_binary_vars(len(cycles))
     
     vtx_to_vars = [[] for __ in cfg.digraph.vs]
     
-    add_chain_vars_and_constraints(cfg.digraph, cfg.ndds, cfg.max_chain, m,
-            vtx_to_vars, store_edge_positions=cfg.edge_success_prob!=1)
+    chain_vars = add_chain_vars_and_constraints(
+            cfg.digraph, cfg.ndds, cfg.max_chain, m, vtx_to_vars)
 
-    for i, c in enumerate(cycles):
-        for v in c:
-            vtx_to_vars[v.id].append(cycle_vars[i])
+    add_cycle_vars_to_vertex_lists(cycles, cycle_vars, vtx_to_vars)
 
     for l in vtx_to_vars:
         if len(l) > 0:
-            m.addConstr(quicksum(l) <= 1)
-
-    if cfg.max_chain==0:
-        obj_expr = quicksum(failure_aware_cycle_score(c, cfg.digraph, cfg.edge_success_prob) * var
-                            for c, var in zip(cycles, cycle_vars))
-    elif cfg.edge_success_prob == 1:
-        obj_expr = ( quicksum(cycle_score(c, cfg.digraph) * var for c, var in zip(cycles, cycle_vars)) +
-                     quicksum(e.score * e.edge_var for ndd in cfg.ndds for e in ndd.edges) +
-                     quicksum(e.score * var for e in cfg.digraph.es for var in e.grb_vars) )
-    else:
-        obj_expr = ( quicksum(failure_aware_cycle_score(c, cfg.digraph, cfg.edge_success_prob) * var
-                              for c, var in zip(cycles, cycle_vars)) +
-                     quicksum(e.score*cfg.edge_success_prob * e.edge_var
-                              for ndd in cfg.ndds for e in ndd.edges) +
-                     quicksum(e.score*cfg.edge_success_prob**(pos+1) * var
-                            for e in cfg.digraph.es for var, pos in zip(e.grb_vars, e.grb_var_positions)))
-
-    m.setObjective(obj_expr, GRB.MAXIMIZE)
+            m.add_constr(l, None, LESS_EQUAL, 1)
+
+    obj_coeffs = cycles.failure_aware_scores(cfg.edge_success_prob).tolist()
+    obj_vars = list(cycle_vars)
+    if cfg.max_chain > 0:
+        chain_coeffs, chain_obj_vars = chain_objective_terms(
+                cfg.digraph, cfg.ndds, chain_vars, cfg.edge_success_prob)
+        obj_coeffs += chain_coeffs
+        obj_vars += chain_obj_vars
+
+    m.set_objective(obj_vars, obj_coeffs)
+    if cfg.mip_start is not None:
+        start_cycles, start_chains = valid_mip_start(cfg)
+        m.set_start([cycle_vars[i] for i in find_cycle_indices(cycles, start_cycles)] +
+                         find_chain_edge_vars(cfg.digraph, cfg.ndds, start_chains, chain_vars))
     optimise(m, cfg)
 
     return OptSolution(ip_model=m,
-                       cycles=[c for c, v in zip(cycles, cycle_vars) if v.x > 0.5],
-                       chains=[] if cfg.max_chain==0 else kidney_utils.get_optimal_chains(
-                            cfg.digraph, cfg.ndds, cfg.edge_success_prob),
+                       cycles=[cycles.vertex_list(i)
+                               for i, val in enumerate(m.get_values(cycle_vars)) if val > 0.5],
+                       chains=[] if cfg.max_chain==0 else kidney_utils.get_optimal_chains(m,
+                            cfg.digraph, cfg.ndds, chain_vars, cfg.edge_success_prob),
                        digraph=cfg.digraph,
                        edge_success_prob=cfg.edge_success_prob)
 
@@ -566,6 +984,22 @@ def optimise_picef(cfg):
 #                                                                                                 #
 ###################################################################################################
 
+def find_chain_indices(chains, start_chains, n):
+    """Returns the indices in the ChainSet chains, for a digraph with n
+    vertices, of those of start_chains ((NDD index, vertex IDs) pairs) that
+    it contains."""
+
+    vtx_offsets, chain_ids = chains.vertex_incidence(n)
+    indices = []
+    for ndd_index, vtx_ids in start_chains:
+        v = vtx_ids[0]
+        for i in chain_ids[vtx_offsets[v]:vtx_offsets[v+1]].tolist():
+            if (chains.ndd_indices[i] == ndd_index and chains.lengths[i] == len(vtx_ids) and
+                    chains.vertices[chains.offsets[i]:chains.offsets[i+1]].tolist() == vtx_ids):
+                indices.append(i)
+                break
+    return indices
+
 def optimise_ccf(cfg):
     """Optimise using the cycle formulation (with one var per cycle and one var per chain).
 
@@ -576,43 +1010,44 @@ def optimise_ccf(cfg):
         an OptSolution object
     """
 
-    cycles = cfg.digraph.find_cycles(cfg.max_cycle)
-    chains = find_chains(cfg.digraph, cfg.ndds, cfg.max_chain, cfg.edge_success_prob)
+    cycles = find_cycle_set(cfg.digraph, cfg.max_cycle, cfg.jobs, cfg.cache)
+    chains = find_chain_set_cached(cfg.digraph, cfg.ndds, cfg.max_chain, cfg.edge_success_prob,
+                                   cfg.cache)
         
-    m = create_ip_model(cfg.timelimit, cfg.verbose)
-    m.params.method = 2
+    m = create_ip_model(cfg, barrier=True)
 
-    cycle_vars = [m.addVar(vtype=GRB.BINARY) for __ in cycles]
-    chain_vars = [m.addVar(vtype=GRB.BINARY) for __ in chains]
-    m.update()
+    cycle_vars = m.add_binary_vars(len(cycles))
+    chain_vars = m.add_binary_vars(len(chains))
     
     ndd_to_vars = [[] for __ in cfg.ndds]
     vtx_to_vars = [[] for __ in cfg.digraph.vs]
     
-    for var, c in zip(cycle_vars, cycles):
-        for v in c:
-            vtx_to_vars[v.id].append(var)
+    add_cycle_vars_to_vertex_lists(cycles, cycle_vars, vtx_to_vars)
 
-    for var, c in zip(chain_vars, chains):
-        ndd_to_vars[c.ndd_index].append(var)
-        for v in c.vtx_indices:
-            vtx_to_vars[v].append(var)
+    for var, ndd_index in zip(chain_vars, chains.ndd_indices.tolist()):
+        ndd_to_vars[ndd_index].append(var)
+    add_vars_to_vertex_lists(chains.vertex_incidence(cfg.digraph.n), chain_vars, vtx_to_vars)
 
     # Each donor-patient pair and each each NDD is in at most one chosen cycle or chain
     for l in vtx_to_vars + ndd_to_vars:
         if len(l) > 0:
-            m.addConstr(quicksum(l) <= 1)
-
-    obj_expr = (quicksum(failure_aware_cycle_score(c, cfg.digraph, cfg.edge_success_prob) * var
-                         for (c, var) in zip(cycles, cycle_vars)) +
-                quicksum(c.score * var for (c, var) in zip(chains, chain_vars)))
-        
-    m.setObjective(obj_expr, GRB.MAXIMIZE)
+            m.add_constr(l, None, LESS_EQUAL, 1)
+
+    m.set_objective(cycle_vars + chain_vars,
+                    cycles.failure_aware_scores(cfg.edge_success_prob).tolist() +
+                    chains.scores.tolist())
+    if cfg.mip_start is not None:
+        start_cycles, start_chains = valid_mip_start(cfg)
+        m.set_start([cycle_vars[i] for i in find_cycle_indices(cycles, start_cycles)] +
+                    [chain_vars[i] for i in find_chain_indices(chains, start_chains,
+                                                               cfg.digraph.n)])
     optimise(m, cfg)
 
     return OptSolution(ip_model=m,
-                       cycles=[c for c, v in zip(cycles, cycle_vars) if v.x > 0.5],
-                       chains=[c for c, v in zip(chains, chain_vars) if v.x > 0.5],
+                       cycles=[cycles.vertex_list(i)
+                               for i, val in enumerate(m.get_values(cycle_vars)) if val > 0.5],
+                       chains=[chains[i]
+                               for i, val in enumerate(m.get_values(chain_vars)) if val > 0.5],
                        digraph=cfg.digraph,
                        edge_success_prob=cfg.edge_success_prob)
 
@@ -623,81 +1058,90 @@ def optimise_ccf(cfg):
 ###################################################################################################
 
 def add_eef_vars_partial_red(max_cycle, digraph, m):
-    vars_and_edges = [] # A list of (gurobi_var, edge, low_vertex) tuples
-
-    # Index i is in the list edge_vars_in[low_v][v] if and only if
-    # vars_and_edges[i] corresponds to an edge pointing to vertex v, in low_v's graph copy 
-    edge_vars_in = [[[] for __ in range(digraph.n)] for __ in range(digraph.n)]
-
-    # Index i is in the list edge_vars_out[low_v][v] if and only if
-    # vars_and_edges[i] corresponds to an edge leaving vertex v, in low_v's graph copy 
-    edge_vars_out = [[[] for __ in range(digraph.n)] for __ in range(digraph.n)]
-
-    for low_vtx in range(digraph.n-1):
-        # Length of shortest path from low vertex to each vertex with a higher index
-        # Default value is 999999999 (which represents infinity)
-        shortest_path_from_lv = digraph.get_shortest_path_from_low_vtx(low_vtx, max_cycle-1) 
-        shortest_path_to_lv = digraph.get_shortest_path_to_low_vtx(low_vtx, max_cycle-1) 
-
-        for v1 in digraph.vs[low_vtx:]:
-            for e in v1.edges:
-                if e.tgt.id >=low_vtx:
-                    if (shortest_path_from_lv[e.src.id] +
-                                shortest_path_to_lv[e.tgt.id] < max_cycle):
-                        new_var = m.addVar(vtype=GRB.BINARY)
-                        vars_and_edges.append((new_var, e, low_vtx))
-                        idx = len(vars_and_edges) - 1 # Index of tuple just added
-                        edge_vars_in[low_vtx][e.tgt.id].append(idx)
-                        edge_vars_out[low_vtx][e.src.id].append(idx)
-    m.update()
+    vars_and_edges = [] # A list of (var, edge, low_vertex) tuples
+
+    # Index i is in the list edge_vars_in[low_v, v] if and only if
+    # vars_and_edges[i] corresponds to an edge pointing to vertex v, in low_v's graph copy.
+    # Only non-empty lists are stored.
+    edge_vars_in = {}
+
+    # Index i is in the list edge_vars_out[low_v, v] if and only if
+    # vars_and_edges[i] corresponds to an edge leaving vertex v, in low_v's graph copy.
+    # Only non-empty lists are stored.
+    edge_vars_out = {}
+
+    csr = digraph.csr()
+    for low_vtx, shortest_path_from_lv, shortest_path_to_lv in \
+            digraph.generate_low_vtx_distances(max_cycle-1, range(digraph.n-1)):
+        # shortest_path_from_lv and shortest_path_to_lv map each vertex within
+        # max_cycle-1 edges of the low vertex to the length of its shortest
+        # path from and to the low vertex. Only reachable vertices can be
+        # the source of an edge in low_vtx's graph copy.
+        for v1_id in sorted(shortest_path_from_lv):
+            dist_from_lv = shortest_path_from_lv[v1_id]
+            for i in range(csr.offsets[v1_id], csr.offsets[v1_id+1]):
+                tgt_id = csr.targets[i]
+                if dist_from_lv + shortest_path_to_lv.get(tgt_id, max_cycle) < max_cycle:
+                    vars_and_edges.append((digraph.es[csr.edge_ids[i]], low_vtx))
+                    idx = len(vars_and_edges) - 1 # Index of tuple just added
+                    edge_vars_in.setdefault((low_vtx, tgt_id), []).append(idx)
+                    edge_vars_out.setdefault((low_vtx, v1_id), []).append(idx)
+    vars_and_edges = [(new_var,) + t
+                      for new_var, t in zip(m.add_binary_vars(len(vars_and_edges)), vars_and_edges)]
     return vars_and_edges, edge_vars_in, edge_vars_out
 
-def add_eef_vars_full_red(max_cycle, digraph, m):
-    vars_and_edges = [] # A list of (gurobi_var, edge, low_vertex) tuples
+def add_eef_vars_full_red(max_cycle, digraph, m, jobs=1, cache=None):
+    vars_and_edges = [] # A list of (var, edge, low_vertex) tuples
 
-    edge_vars_in = [[[] for __ in range(digraph.n)] for __ in range(digraph.n)]
-    edge_vars_out = [[[] for __ in range(digraph.n)] for __ in range(digraph.n)]
+    edge_vars_in = {}
+    edge_vars_out = {}
 
     edges_seen = set()  # (low_v_id, src_v_id, tgt_v_id) tuples
-    for cycle in digraph.generate_cycles(max_cycle):
+    cycle_vertices, cycle_offsets = find_cycles_flat(digraph, max_cycle, jobs, cache)
+    for start, end in zip(cycle_offsets[:-1], cycle_offsets[1:]):
+        cycle = cycle_vertices[start:end]
         for i in range(len(cycle)):
-            edges_seen.add((cycle[0].id, cycle[i-1].id, cycle[i].id))
+            edges_seen.add((cycle[0], cycle[i-1], cycle[i]))
             
-    for low_v, src_v, tgt_v in edges_seen:
-        new_var = m.addVar(vtype=GRB.BINARY)
-        e = digraph.adj_mat[src_v][tgt_v]
+    new_vars = m.add_binary_vars(len(edges_seen))
+    for new_var, (low_v, src_v, tgt_v) in zip(new_vars, edges_seen):
+        e = digraph.get_edge(src_v, tgt_v)
         vars_and_edges.append((new_var, e, low_v))
         idx = len(vars_and_edges) - 1 # Index of tuple just added
-        edge_vars_in[low_v][tgt_v].append(idx)
-        edge_vars_out[low_v][src_v].append(idx)
-    m.update()
+        edge_vars_in.setdefault((low_v, tgt_v), []).append(idx)
+        edge_vars_out.setdefault((low_v, src_v), []).append(idx)
     return vars_and_edges, edge_vars_in, edge_vars_out
 
-def add_eef_vars_and_constraints(max_cycle, digraph, m, full_red, eef_alt_constraints, vtx_to_in_edges):
+def add_eef_vars_and_constraints(max_cycle, digraph, m, full_red, eef_alt_constraints, vtx_to_in_edges,
+                                 jobs=1, cache=None):
     if full_red:
-        vars_and_edges, edge_vars_in, edge_vars_out = add_eef_vars_full_red(max_cycle, digraph, m)
+        vars_and_edges, edge_vars_in, edge_vars_out = add_eef_vars_full_red(max_cycle, digraph, m, jobs, cache)
     else:
         vars_and_edges, edge_vars_in, edge_vars_out = add_eef_vars_partial_red(max_cycle, digraph, m)
     
-    for grb_var, edge, low_vtx in vars_and_edges:
-        vtx_to_in_edges[edge.tgt.id].append(grb_var)
+    for ip_var, edge, low_vtx in vars_and_edges:
+        vtx_to_in_edges[edge.tgt.id].append(ip_var)
         
     # Capacity constraint for vertices
     for l in vtx_to_in_edges:
         if len(l) > 0:
-            m.addConstr(quicksum(l) <= 1)
+            m.add_constr(l, None, LESS_EQUAL, 1)
     
     # Cycle flow-conservation constraint for vertices
-    for v in range(digraph.n):
-        for low_v_id in range(v):
-            in_vars  = [vars_and_edges[i][0] for i in edge_vars_in[low_v_id][v]]
-            out_vars = [vars_and_edges[i][0] for i in edge_vars_out[low_v_id][v]]
-            if len(in_vars) > 0 or len(out_vars) > 0:
-                m.addConstr(quicksum(in_vars) == quicksum(out_vars))
+    for low_v_id, v in sorted(set(edge_vars_in) | set(edge_vars_out), key=lambda key: (key[1], key[0])):
+        if low_v_id < v:
+            in_vars  = [vars_and_edges[i][0] for i in edge_vars_in.get((low_v_id, v), [])]
+            out_vars = [vars_and_edges[i][0] for i in edge_vars_out.get((low_v_id, v), [])]
+            add_flow_constr(m, in_vars, out_vars, EQUAL)
+
+    # The indices of the edges in each non-empty graph copy
+    edge_indices_by_graph_copy = {}
+    for low_v_id, v in sorted(edge_vars_in):
+        edge_indices_by_graph_copy.setdefault(low_v_id, []).extend(edge_vars_in[low_v_id, v])
 
     if eef_alt_constraints:
-        for low_v_id in range(v):
-            edge_indices_in_graph_copy = [i for indices in edge_vars_in[low_v_id] for i in indices]
+        for low_v_id in sorted(edge_indices_by_graph_copy):
+            edge_indices_in_graph_copy = edge_indices_by_graph_copy[low_v_id]
 
             edge_vars_leaving_l = []
             edge_vars_not_involving_l = []    # Edge vars where low_v_id is neither the src nor the tgt
@@ -711,28 +1155,30 @@ def add_eef_vars_and_constraints(max_cycle, digraph, m, full_red, eef_alt_constr
             # Number of edges constraint for each graph copy
             # (Note that this is redundant, but removing it seems to slow the program down
             # quite a bit.)
-            m.addConstr(quicksum(edge_vars_not_involving_l) <= max_cycle-2) 
+            m.add_constr(edge_vars_not_involving_l, None, LESS_EQUAL, max_cycle-2) 
 
             # In each graph copy, if any edge is selected then an edge is selected
             # that leaves the low-numbered vertex in the graph copy
             # Note: this differs from (9e) in Constantino et al.
-            m.addConstr(quicksum(edge_vars_not_involving_l) <=
-                        (max_cycle-2) * quicksum(edge_vars_leaving_l))
+            m.add_constr(edge_vars_not_involving_l + edge_vars_leaving_l,
+                         [1.0] * len(edge_vars_not_involving_l) +
+                         [2.0 - max_cycle] * len(edge_vars_leaving_l), LESS_EQUAL, 0)
 
     else:
-        for low_v_id in range(v):
-            edge_indices_in_graph_copy = [i for indices in edge_vars_in[low_v_id] for i in indices]
+        for low_v_id in sorted(edge_indices_by_graph_copy):
+            edge_indices_in_graph_copy = edge_indices_by_graph_copy[low_v_id]
 
             # Number of edges constraint for each graph copy
-            m.addConstr(quicksum(vars_and_edges[i][0] for i in edge_indices_in_graph_copy) <= max_cycle)        
+            m.add_constr([vars_and_edges[i][0] for i in edge_indices_in_graph_copy],
+                         None, LESS_EQUAL, max_cycle)
 
-            # Constraint (9e) from Constantino et al.
-            sum_of_edge_vars_leaving_l = quicksum(
-                    vars_and_edges[i][0] for i in edge_vars_out[low_v_id][low_v_id])
-            for i in range(low_v_id+1, digraph.n):
-                vars_leaving_i = [vars_and_edges[j][0] for j in edge_vars_out[low_v_id][i]]
-                if len(vars_leaving_i):
-                    m.addConstr(quicksum(vars_leaving_i) <= sum_of_edge_vars_leaving_l)
+        # Constraint (9e) from Constantino et al.
+        for low_v_id, i in sorted(edge_vars_out):
+            if i > low_v_id:
+                vars_leaving_i = [vars_and_edges[j][0] for j in edge_vars_out[low_v_id, i]]
+                edge_vars_leaving_l = [vars_and_edges[j][0]
+                                       for j in edge_vars_out.get((low_v_id, low_v_id), [])]
+                add_flow_constr(m, vars_leaving_i, edge_vars_leaving_l, LESS_EQUAL)
 
 
     return vars_and_edges
@@ -754,38 +1200,42 @@ def optimise_eef(cfg, full_red=False):
     if cfg.edge_success_prob != 1:
         raise ValueError("This formulation does not support failure-aware matching.")
 
-    m = create_ip_model(cfg.timelimit, cfg.verbose)
-    m.params.method = 2
-    m.params.presolve = 0
+    m = create_ip_model(cfg, barrier=True, presolve=False)
 
     # For each vertex v, a list of variables corresponding to in-edges to v
     vtx_to_in_edges = [[] for __ in cfg.digraph.vs]
 
-    add_chain_vars_and_constraints(cfg.digraph, cfg.ndds, cfg.max_chain, m, vtx_to_in_edges)
+    chain_vars = add_chain_vars_and_constraints(
+            cfg.digraph, cfg.ndds, cfg.max_chain, m, vtx_to_in_edges)
 
     vars_and_edges = add_eef_vars_and_constraints(cfg.max_cycle, cfg.digraph, m, full_red,
-                                                  cfg.eef_alt_constraints, vtx_to_in_edges)
+                                                  cfg.eef_alt_constraints, vtx_to_in_edges, cfg.jobs,
+                                                  cfg.cache)
 
-    obj_expr = quicksum(edge.score * var for var, edge, low_v_id in vars_and_edges)
+    obj_coeffs = [edge.score for var, edge, low_v_id in vars_and_edges]
+    obj_vars = [var for var, edge, low_v_id in vars_and_edges]
     if cfg.max_chain > 0:
-        obj_expr += quicksum(e.score * e.edge_var for ndd in cfg.ndds for e in ndd.edges) 
-        obj_expr += quicksum(e.score * var for e in cfg.digraph.es for var in e.grb_vars)
+        chain_coeffs, chain_obj_vars = chain_objective_terms(cfg.digraph, cfg.ndds, chain_vars)
+        obj_coeffs += chain_coeffs
+        obj_vars += chain_obj_vars
 
-    m.setObjective(obj_expr, GRB.MAXIMIZE)
+    m.set_objective(obj_vars, obj_coeffs)
     optimise(m, cfg)
 
     cycle_start_vv = []
     cycle_next_vv = {}
     
-    for var, edge, low_v_id in vars_and_edges:
-        if var.x > 0.1:
+    var_vals = m.get_values([var for var, edge, low_v_id in vars_and_edges])
+    for (var, edge, low_v_id), val in zip(vars_and_edges, var_vals):
+        if val > 0.1:
             cycle_next_vv[edge.src.id] = edge.tgt.id
             cycle_start_vv.append(edge.src.id)
         
     return OptSolution(ip_model=m,
                        cycles=kidney_utils.selected_edges_to_cycles(
                                     cfg.digraph, cycle_start_vv, cycle_next_vv),
-                       chains=[] if cfg.max_chain==0 else kidney_utils.get_optimal_chains(cfg.digraph, cfg.ndds),
+                       chains=[] if cfg.max_chain==0 else kidney_utils.get_optimal_chains(m,
+                            cfg.digraph, cfg.ndds, chain_vars),
                        digraph=cfg.digraph)
 
 def optimise_eef_full_red(cfg):
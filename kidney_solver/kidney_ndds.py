@@ -7,7 +7,9 @@ each of these edges points towards a vertex (which represents a donor-patient pa
 in the directed graph.
 """
 
-from kidney_digraph import KidneyReadException
+import numpy as np
+
+from kidney_digraph import KidneyReadException, flat_vertex_incidence, parse_edge_rows, _edge_key
 
 class Ndd:
     """A non-directed donor"""
@@ -24,6 +26,67 @@ class NddEdge:
         self.target_v = target_v
         self.score = score
 
+class NddEdgeIndex(object):
+    """A hashed index of the edges of a collection of NDDs, keyed on the
+    NDD's index and the target vertex's ID.
+
+    The index uses memory linear in the number of NDD edges, and looks up
+    an edge in constant time. It must be kept up to date by adding and
+    removing edges through it when the NDDs change.
+    """
+
+    def __init__(self, ndds=()):
+        """Index the edges of ndds, which is a list of Ndd objects or a dict
+        from NDD index to Ndd object.
+
+        Raises:
+            KidneyReadException: if an NDD has two edges to the same vertex
+        """
+
+        self._edges = {}
+        for ndd_idx, ndd in (ndds.items() if isinstance(ndds, dict) else enumerate(ndds)):
+            for e in ndd.edges:
+                if not self.add(ndd_idx, e):
+                    raise KidneyReadException("Duplicate edge from NDD {0} to vertex {1}.".format(
+                            ndd_idx, e.target_v.id))
+
+    def __len__(self):
+        return len(self._edges)
+
+    def add(self, ndd_idx, edge):
+        """Index NddEdge edge of NDD ndd_idx. Returns False, leaving the
+        index unchanged, if the NDD already has an edge to edge's target."""
+
+        key = _edge_key(ndd_idx, edge.target_v.id)
+        if key in self._edges:
+            return False
+        self._edges[key] = edge
+        return True
+
+    def get_edge(self, ndd_idx, tgt_id):
+        """Returns the NddEdge from NDD ndd_idx to the vertex with ID
+        tgt_id, or None if there is no such edge."""
+
+        return self._edges.get(_edge_key(ndd_idx, tgt_id))
+
+    def edge_exists(self, ndd_idx, tgt_id):
+        """Returns true if and only if NDD ndd_idx has an edge to the vertex
+        with ID tgt_id."""
+
+        return _edge_key(ndd_idx, tgt_id) in self._edges
+
+    def remove(self, ndd_idx, tgt_id):
+        """Remove the edge from NDD ndd_idx to the vertex with ID tgt_id
+        from the index, and return it (or None if there is no such edge)."""
+
+        return self._edges.pop(_edge_key(ndd_idx, tgt_id), None)
+
+    def remove_ndd(self, ndd_idx, ndd):
+        """Remove the edges of Ndd ndd, whose index is ndd_idx."""
+
+        for e in ndd.edges:
+            self.remove(ndd_idx, e.target_v.id)
+
 def create_relabelled_ndds(ndds, old_to_new_vtx):
     """Creates a copy of a n array of NDDs, with target vertices changed.
 
@@ -37,46 +100,63 @@ def create_relabelled_ndds(ndds, old_to_new_vtx):
 
     return new_ndds
 
-def read_ndds(lines, digraph):
-    """Reads NDDs from an array of strings in the .ndd format."""
+def ndds_from_edge_rows(ndd_count, src_ids, tgt_ids, scores, digraph):
+    """Create a list of NDDs from edge rows read by parse_edge_rows.
 
-    ndds = []
-    ndd_count, edge_count = [int(x) for x in lines[0].split()]
-    ndds = [Ndd() for _ in range(ndd_count)]
+    The rows are checked as a whole, but if any row is invalid then the
+    KidneyReadException raised is the one for the first invalid row.
+    """
 
-    # Keep track of which edges have been created already so that we can
-    # detect duplicates
-    edge_exists = [[False for v in digraph.vs] for ndd in ndds]
+    n = digraph.n
+    invalid = (src_ids < 0) | (src_ids >= ndd_count) | (tgt_ids < 0) | (tgt_ids >= n)
+    __, first_idx = np.unique(src_ids * n + tgt_ids, return_index=True)
+    is_duplicate = np.ones(len(src_ids), dtype=bool)
+    is_duplicate[first_idx] = False
+    invalid |= is_duplicate
 
-    for line in lines[1:edge_count+1]:
-        tokens = [t for t in line.split()]
-        src_id = int(tokens[0])
-        tgt_id = int(tokens[1])
-        score = float(tokens[2])
+    if invalid.any():
+        i = np.flatnonzero(invalid)[0]
+        src_id = int(src_ids[i])
+        tgt_id = int(tgt_ids[i])
         if src_id < 0 or src_id >= ndd_count:
             raise KidneyReadException("NDD index {} out of range.".format(src_id))
-        if tgt_id < 0 or tgt_id >= digraph.n:
+        if tgt_id < 0 or tgt_id >= n:
             raise KidneyReadException("Vertex index {} out of range.".format(tgt_id))
-        if edge_exists[src_id][tgt_id]:
-            raise KidneyReadException(
-                    "Duplicate edge from NDD {0} to vertex {1}.".format(src_id, tgt_id))
-        ndds[src_id].add_edge(NddEdge(digraph.vs[tgt_id], score))
-        edge_exists[src_id][tgt_id] = True
+        raise KidneyReadException(
+                "Duplicate edge from NDD {0} to vertex {1}.".format(src_id, tgt_id))
+
+    ndds = [Ndd() for _ in range(ndd_count)]
+    vs = digraph.vs
+    for src_id, tgt_id, score in zip(src_ids.tolist(), tgt_ids.tolist(), scores.tolist()):
+        ndds[src_id].add_edge(NddEdge(vs[tgt_id], score))
+    return ndds
+
+def read_ndds(lines, digraph):
+    """Reads NDDs from an array of strings in the .ndd format."""
 
-    if lines[edge_count+1].split()[0] != "-1" or len(lines) < edge_count+2:
+    ndd_count, edge_count = [int(x) for x in lines[0].split()]
+    edge_lines = lines[1:edge_count+1]
+    src_ids, tgt_ids, scores = parse_edge_rows("".join(edge_lines), len(edge_lines))
+    ndds = ndds_from_edge_rows(ndd_count, src_ids, tgt_ids, scores, digraph)
+
+    if len(lines) < edge_count+2 or lines[edge_count+1].split()[0] != "-1":
         raise KidneyReadException("Incorrect edge count")
     return ndds
 
 def read_ndd_edges(edges, digraph):
-    ndds = []
+    """Create a list of NDDs from a list of (NDD index, vertex ID, score)
+    tuples."""
+
     ndd_count = len(set([e[0] for e in edges]))
-    edge_count = len(edges)
     ndds = [Ndd() for _ in range(ndd_count)]
-    edge_exists = [[False for v in digraph.vs] for ndd in ndds]
+    edge_index = NddEdgeIndex()
     for edge in edges:
         source, target, score = edge
-        ndds[source].add_edge(NddEdge(digraph.vs[target], score))
-        edge_exists[source][target] = True
+        ndd_edge = NddEdge(digraph.vs[target], score)
+        if not edge_index.add(source, ndd_edge):
+            raise KidneyReadException(
+                    "Duplicate edge from NDD {0} to vertex {1}.".format(source, target))
+        ndds[source].add_edge(ndd_edge)
     return ndds
     
 
@@ -89,6 +169,9 @@ class Chain(object):
         score: the chain's score
     """
 
+    # Chains can be numerous, so they have no per-instance __dict__
+    __slots__ = ("ndd_index", "vtx_indices", "score")
+
     def __init__(self, ndd_index, vtx_indices, score):
         self.ndd_index = ndd_index
         self.vtx_indices = vtx_indices
@@ -122,23 +205,299 @@ class Chain(object):
                     return 1
         return 0
             
+# The default number of chains in each ChainSet yielded by generate_chain_sets
+CHAIN_BATCH_SIZE = 1 << 16
+
+# The maximum number of chains built by each extension step of ChainExpander
+CHAIN_BLOCK_SIZE = 1 << 14
+
+class ChainSet(object):
+    """A compact, flat representation of a list of chains.
+
+    Chain i is initiated by NDD ndd_indices[i], and its vertices are
+    vertices[offsets[i]:offsets[i+1]], in order.
+
+    Data members:
+        ndd_indices: NumPy int32 array of the NDD index of each chain
+        vertices: NumPy int32 array of the vertex IDs of all chains
+        offsets: NumPy int64 array of length len(self)+1
+        lengths: NumPy array of the number of vertices in each chain
+        scores: NumPy float64 array of chain scores
+    """
+
+    def __init__(self, ndd_indices, vertices, offsets, scores):
+        self.ndd_indices = np.asarray(ndd_indices, dtype=np.int32)
+        self.vertices = np.asarray(vertices, dtype=np.int32)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.lengths = np.diff(self.offsets).astype(np.int32)
+        self.scores = np.asarray(scores, dtype=np.float64)
+
+    def __len__(self):
+        return len(self.ndd_indices)
+
+    def __getitem__(self, i):
+        """Returns chain i as a Chain object."""
+
+        if i < 0:
+            i += len(self)
+        return Chain(int(self.ndd_indices[i]),
+                     self.vertices[self.offsets[i]:self.offsets[i+1]].tolist(),
+                     float(self.scores[i]))
+
+    def vertex_incidence(self, n):
+        """Returns a pair (vtx_offsets, chain_ids) of arrays, such that
+        chain_ids[vtx_offsets[v]:vtx_offsets[v+1]] lists the indices of the
+        chains containing vertex v, in ascending order, for each of the n
+        vertices of the digraph."""
+
+        return flat_vertex_incidence(n, self.vertices, self.offsets)
+
+    def __iter__(self):
+        ndd_indices = self.ndd_indices.tolist()
+        vertices = self.vertices.tolist()
+        offsets = self.offsets.tolist()
+        scores = self.scores.tolist()
+        for i in range(len(ndd_indices)):
+            yield Chain(ndd_indices[i], vertices[offsets[i]:offsets[i+1]], scores[i])
+
+def _concatenate_chain_sets(chain_sets):
+    if len(chain_sets) == 1:
+        return chain_sets[0]
+    offsets = [np.zeros(1, dtype=np.int64)]
+    base = 0
+    for chain_set in chain_sets:
+        offsets.append(chain_set.offsets[1:] + base)
+        base += chain_set.offsets[-1]
+    return ChainSet(np.concatenate([c.ndd_indices for c in chain_sets]),
+                    np.concatenate([c.vertices for c in chain_sets]),
+                    np.concatenate(offsets),
+                    np.concatenate([c.scores for c in chain_sets]))
+
+class ChainExpander(object):
+    """Finds the chains that begin with given NDD edges.
+
+    Rather than searching one chain at a time, chains are extended one edge
+    at a time in blocks, with chains of the same length held in a NumPy
+    matrix (one row per chain). A chain is extended along each out-edge of
+    its last vertex whose target is not already in the chain. A block is
+    extended a range of chains at a time, so that each range has at most
+    CHAIN_BLOCK_SIZE extensions (or one chain), and the extensions of each
+    range are expanded before the next range. Memory use is therefore
+    bounded by the chain cap and the block size, not by the number of
+    chains. Each chain is emitted just before its extensions, so chains
+    come out in the order in which a depth-first search would find them.
+    """
+
+    def __init__(self, digraph, max_chain, edge_success_prob=1):
+        csr = digraph.csr()
+        self.offsets = np.frombuffer(csr.offsets, dtype=csr.offsets.typecode).astype(np.int64)
+        self.targets = np.frombuffer(csr.targets, dtype=csr.targets.typecode).astype(np.int32)
+        self.edge_scores = np.frombuffer(csr.scores, dtype=np.float64)
+        self.degrees = np.diff(self.offsets)
+        self.max_chain = max_chain
+        self.edge_success_prob = edge_success_prob
+        self._edge_keys = None
+
+    def _range_end(self, cum_degrees, start):
+        """Returns the end of the range of chains from start whose
+        extensions number at most CHAIN_BLOCK_SIZE (or start+1 if chain
+        start alone has more), given the cumulative out-degrees of the
+        chains' last vertices."""
+
+        base = cum_degrees[start-1] if start else 0
+        end = np.searchsorted(cum_degrees, base + CHAIN_BLOCK_SIZE, 'right')
+        return max(int(end), start + 1)
+
+    def _extend(self, paths, scores=None):
+        """Extend each chain (a row of paths, with scores in scores) by one
+        edge, in all possible ways.
+
+        Returns:
+            a triple (parents, new_paths, new_scores), in which new_paths[i]
+            extends paths[parents[i]]. The extensions are in order of
+            parent and then CSR position. new_scores is None if scores is
+            None.
+        """
+
+        last = paths[:, -1]
+        starts = self.offsets[last]
+        degrees = self.degrees[last]
+        parents = np.repeat(np.arange(len(paths)), degrees)
+        first_in_group = np.cumsum(degrees) - degrees
+        pos = np.arange(len(parents)) - np.repeat(first_in_group - starts, degrees)
+        tgts = self.targets[pos]
+        keep = (paths[parents] != tgts[:, None]).all(axis=1)
+        parents, pos, tgts = parents[keep], pos[keep], tgts[keep]
+        new_paths = np.column_stack((paths[parents], tgts))
+        if scores is None:
+            return parents, new_paths, None
+        factor = self.edge_success_prob**(paths.shape[1] + 1)
+        return parents, new_paths, scores[parents] + self.edge_scores[pos] * factor
+
+    def _count_extensions(self, paths):
+        """Returns the number of one-edge extensions of the chains in paths,
+        without building them: the out-degrees of their last vertices, less
+        the number of edges from each last vertex back into its chain."""
+
+        if self._edge_keys is None:
+            srcs = np.repeat(np.arange(len(self.degrees), dtype=np.int64), self.degrees)
+            self._edge_keys = np.sort(srcs << 32 | self.targets)
+        edge_keys = self._edge_keys
+        last = paths[:, -1].astype(np.int64)
+        count = int(self.degrees[last].sum())
+        if len(edge_keys) == 0:
+            return count
+        for j in range(paths.shape[1]):
+            keys = last << 32 | paths[:, j]
+            found = np.minimum(np.searchsorted(edge_keys, keys), len(edge_keys) - 1)
+            count -= int((edge_keys[found] == keys).sum())
+        return count
+
+    def _subtree(self, paths, scores):
+        """Generate the chains in the block paths (of chains of equal length,
+        in depth-first order, with scores scores) and all of their
+        extensions, in depth-first order.
+
+        Yields:
+            triples (paths, scores, roots) of arrays, where the paths are
+            padded to max_chain columns with -1, and roots[i] is the row of
+            the block from which chain i descends
+        """
+
+        count, length = paths.shape
+        padded = np.full((count, self.max_chain), -1, dtype=np.int32)
+        padded[:, :length] = paths
+        if length == self.max_chain:
+            yield padded, scores, np.arange(count)
+            return
+
+        cum_degrees = np.cumsum(self.degrees[paths[:, -1]])
+        emitted = 0
+        start = 0
+        while start < count:
+            end = self._range_end(cum_degrees, start)
+            parents, child_paths, child_scores = self._extend(paths[start:end], scores[start:end])
+            parents += start
+            start = end
+            if len(parents) == 0:
+                continue
+            for sub_paths, sub_scores, sub_roots in self._subtree(child_paths, child_scores):
+                roots = parents[sub_roots]
+                # Insert each chain of the block just before its first extension
+                new = np.arange(emitted, roots[-1] + 1)
+                at = np.searchsorted(roots, new)
+                yield (np.insert(sub_paths, at, padded[new], axis=0),
+                       np.insert(sub_scores, at, scores[new]),
+                       np.insert(roots, at, new))
+                emitted = roots[-1] + 1
+        if emitted < count:
+            yield padded[emitted:], scores[emitted:], np.arange(emitted, count)
+
+    def chain_sets(self, ndd_indices, tgt_ids, scores):
+        """Generate ChainSets of the chains that begin with the NDD edges
+        from NDDs ndd_indices[i] to vertices tgt_ids[i] with scores
+        scores[i], in depth-first order (taking the edges in order)."""
+
+        if self.max_chain == 0 or len(tgt_ids) == 0:
+            return
+        ndd_indices = np.asarray(ndd_indices, dtype=np.int32)
+        paths = np.asarray(tgt_ids, dtype=np.int32).reshape(-1, 1)
+        for paths, scores, roots in self._subtree(paths, np.asarray(scores, dtype=np.float64)):
+            offsets = np.zeros(len(paths) + 1, dtype=np.int64)
+            np.cumsum((paths >= 0).sum(axis=1), out=offsets[1:])
+            yield ChainSet(ndd_indices[roots], paths[paths >= 0], offsets, scores)
+
+    def add_chain_counts(self, tgt_ids, counts_by_size):
+        """For each vertex ID in tgt_ids, count the chains that begin with an
+        NDD edge to that vertex, adding the number with k vertices to
+        counts_by_size[k]. The chains are extended in blocks as by
+        chain_sets, but are not scored or put in order, and chains of the
+        maximum length are counted without being built."""
+
+        if self.max_chain == 0 or len(tgt_ids) == 0:
+            return
+        paths = np.asarray(tgt_ids, dtype=np.int32).reshape(-1, 1)
+        counts_by_size[1] += len(paths)
+        if self.max_chain == 1:
+            return
+        if self.max_chain == 2:
+            counts_by_size[2] += self._count_extensions(paths)
+            return
+        # A stack of (block, cumulative degrees, next chain to extend)
+        stack = [(paths, np.cumsum(self.degrees[paths[:, -1]]), 0)]
+        while stack:
+            paths, cum_degrees, start = stack.pop()
+            if start == len(paths):
+                continue
+            end = self._range_end(cum_degrees, start)
+            stack.append((paths, cum_degrees, end))
+            children = self._extend(paths[start:end])[1]
+            if len(children) == 0:
+                continue
+            length = children.shape[1]
+            counts_by_size[length] += len(children)
+            if length == self.max_chain - 1:
+                counts_by_size[length+1] += self._count_extensions(children)
+            else:
+                stack.append((children, np.cumsum(self.degrees[children[:, -1]]), 0))
+
+def generate_chain_sets(digraph, ndds, max_chain, edge_success_prob=1,
+                        batch_size=CHAIN_BATCH_SIZE):
+    """Generate all chains with up to max_chain edges (including the edge
+    from the NDD), as a sequence of ChainSets. The chains are in the same
+    order as those returned by find_chains.
+
+    Each ChainSet (except perhaps the last) contains at least batch_size
+    chains, and is yielded as soon as it does. Chains are found in blocks
+    (see ChainExpander), so they can be streamed into a model without all
+    of them being stored at once, however many chains begin with one NDD
+    edge.
+
+    Args:
+        batch_size: the minimum size of each ChainSet but the last, or None
+            if all chains should be in a single ChainSet
+    """
+
+    ndd_edges = [(ndd_idx, e) for ndd_idx, ndd in enumerate(ndds) for e in ndd.edges]
+    expander = ChainExpander(digraph, max_chain, edge_success_prob)
+    batch = []
+    batch_count = 0
+    for chain_set in expander.chain_sets([ndd_idx for ndd_idx, e in ndd_edges],
+                                         [e.target_v.id for ndd_idx, e in ndd_edges],
+                                         [e.score * edge_success_prob for ndd_idx, e in ndd_edges]):
+        batch.append(chain_set)
+        batch_count += len(chain_set)
+        if batch_size is not None and batch_count >= batch_size:
+            yield _concatenate_chain_sets(batch)
+            batch = []
+            batch_count = 0
+    if batch:
+        yield _concatenate_chain_sets(batch)
+    elif batch_size is None:
+        yield ChainSet([], [], [0], [])
+
+def find_chain_set(digraph, ndds, max_chain, edge_success_prob=1):
+    """Find all chains with up to max_chain edges, as a ChainSet.
+
+    The chains are in the same order as those returned by find_chains.
+    """
+
+    return next(generate_chain_sets(digraph, ndds, max_chain, edge_success_prob, None))
+
+def generate_chains(digraph, ndds, max_chain, edge_success_prob=1):
+    """Generate all chains with up to max_chain edges, as Chain objects, in
+    the same order as find_chains. Only one batch of chains is stored at a
+    time."""
+
+    for chain_set in generate_chain_sets(digraph, ndds, max_chain, edge_success_prob):
+        for chain in chain_set:
+            yield chain
+
 def find_chains(digraph, ndds, max_chain, edge_success_prob=1):
     """Generate all chains with up to max_chain edges."""
 
-    def find_chains_recurse(vertices, score):
-        chains.append(Chain(ndd_idx, vertices[:], score))
-        if len(vertices) < max_chain:
-            for e in digraph.vs[vertices[-1]].edges:
-                if e.tgt.id not in vertices:
-                    vertices.append(e.tgt.id)
-                    find_chains_recurse(vertices, score+e.score*edge_success_prob**len(vertices))
-                    del vertices[-1]
     chains = []
-    if max_chain == 0:
-        return chains
-    for ndd_idx, ndd in enumerate(ndds):
-        for e in ndd.edges:
-            vertices = [e.target_v.id]
-            find_chains_recurse(vertices, e.score*edge_success_prob)
+    for chain_set in generate_chain_sets(digraph, ndds, max_chain, edge_success_prob):
+        chains.extend(chain_set)
     return chains
 
@@ -3,18 +3,40 @@ IP formulations for kidney exchange, including PICEF
 """
 
 import argparse
+import functools
 import time
 import sys
 
+import column_generation
+import decomposition
+import enumeration_cache
+import ip_backend
 import kidney_digraph
+import kidney_io
 import kidney_ip
 import kidney_utils
 import kidney_ndds
+import portfolio
 
-def solve_kep(cfg, formulation, use_relabelled=True):
+# The formulations raced by the portfolio mode unless others are given
+DEFAULT_PORTFOLIO = ["picef", "hpief_2prime_full_red", "cf", "eef"]
+
+def solve_kep(cfg, formulation, use_relabelled=True, use_reduced=False, use_components=False,
+              portfolio_formulations=None, portfolio_deadline=None):
+    """Solve an instance with the named formulation.
+
+    If formulation is "portfolio", the formulations in portfolio_formulations
+    (default: DEFAULT_PORTFOLIO) are raced in parallel processes (see
+    portfolio.optimise_portfolio). Each element of portfolio_formulations is
+    a formulation name or a pair (name, time limit in seconds), and
+    portfolio_deadline is the time after which the best solution so far is
+    returned. The returned OptSolution then has a member "portfolio"
+    recording which formulation won.
+    """
 
     formulations = {
         "uef":  ("Uncapped edge formulation", kidney_ip.optimise_uuef),
+        "ef_lazy": ("Edge formulation with lazy cycle and chain caps", kidney_ip.optimise_lazy_ef),
         "eef": ("EEF", kidney_ip.optimise_eef),
         "eef_full_red": ("EEF with full reduction by cycle generation", kidney_ip.optimise_eef_full_red),
         "hpief_prime": ("HPIEF'", kidney_ip.optimise_hpief_prime),
@@ -23,21 +45,52 @@ def solve_kep(cfg, formulation, use_relabelled=True):
         "hpief_2prime_full_red": ("HPIEF'' with full reduction by cycle generation", kidney_ip.optimise_hpief_2prime_full_red),
         "picef": ("PICEF", kidney_ip.optimise_picef),
         "cf":   ("Cycle formulation",
-                  kidney_ip.optimise_ccf)
+                  kidney_ip.optimise_ccf),
+        "cf_cg": ("Cycle formulation with column generation",
+                  column_generation.optimise_ccf_column_generation)
     }
-    
-    if formulation in formulations:
-        formulation_name, formulation_fun = formulations[formulation]
+
+    def wrap(formulation_fun):
         if use_relabelled:
-            opt_result = kidney_ip.optimise_relabelled(formulation_fun, cfg)
-        else:
-            opt_result = formulation_fun(cfg)
-        kidney_utils.check_validity(opt_result, cfg.digraph, cfg.ndds, cfg.max_cycle, cfg.max_chain)
-        opt_result.formulation_name = formulation_name
-        return opt_result
+            formulation_fun = functools.partial(kidney_ip.optimise_relabelled, formulation_fun)
+        if use_components:
+            formulation_fun = functools.partial(decomposition.optimise_components, formulation_fun)
+        return formulation_fun
+
+    if formulation == "portfolio":
+        entries = []
+        for entry in portfolio_formulations or DEFAULT_PORTFOLIO:
+            name, timelimit = entry if isinstance(entry, tuple) else (entry, None)
+            if name not in formulations:
+                raise ValueError("Unrecognised IP formulation name")
+            entries.append(portfolio.PortfolioEntry(name, wrap(formulations[name][1]), timelimit))
+        formulation_fun = functools.partial(portfolio.optimise_portfolio, entries,
+                                            deadline=portfolio_deadline)
+        uncapped = any(entry.name == "uef" for entry in entries)
+    elif formulation in formulations:
+        formulation_fun = wrap(formulations[formulation][1])
+        uncapped = formulation == "uef"
     else:
         raise ValueError("Unrecognised IP formulation name")
 
+    if use_reduced:
+        opt_result = kidney_ip.optimise_reduced(formulation_fun, cfg, uncapped)
+    else:
+        opt_result = formulation_fun(cfg)
+    kidney_utils.check_validity(opt_result, cfg.digraph, cfg.ndds, cfg.max_cycle, cfg.max_chain)
+    if formulation == "portfolio":
+        opt_result.formulation_name = "Portfolio (won by {})".format(
+                formulations[opt_result.portfolio.winner][0])
+    else:
+        opt_result.formulation_name = formulations[formulation][0]
+    return opt_result
+
+def parse_portfolio_entry(text):
+    """Parse a portfolio formulation given as NAME or NAME:SECONDS."""
+
+    name, __, timelimit = text.lower().partition(":")
+    return (name, float(timelimit)) if timelimit else name
+
 def start():
     parser = argparse.ArgumentParser("Solve a kidney-exchange instance")
     parser.add_argument("cycle_cap", type=int,
@@ -45,10 +98,27 @@ def start():
     parser.add_argument("chain_cap", type=int,
             help="The maximum permitted number of edges in a chain")
     parser.add_argument("formulation",
-            help="The IP formulation (uef, eef, eef_full_red, hpief_prime, hpief_2prime, hpief_prime_full_red, hpief_2prime_full_red, picef, cf)")
+            help="The IP formulation (uef, ef_lazy, eef, eef_full_red, hpief_prime, hpief_2prime, hpief_prime_full_red, hpief_2prime_full_red, picef, cf, cf_cg, portfolio)")
     parser.add_argument("--use-relabelled", "-r", required=False,
             action="store_true",
             help="Relabel vertices in descending order of in-deg + out-deg")
+    parser.add_argument("--reduce", "-g", required=False,
+            action="store_true",
+            help="Remove vertices and edges that cannot be in any cycle or chain " +
+                 "before building the model")
+    parser.add_argument("--components", "-d", required=False,
+            action="store_true",
+            help="Optimise each weakly connected component separately, " +
+                 "using the worker processes set by --jobs")
+    parser.add_argument("--portfolio", required=False, nargs="+",
+            type=parse_portfolio_entry, default=None, metavar="NAME[:SECONDS]",
+            help="The formulations raced by the portfolio formulation, each " +
+                 "optionally with its own time limit (default: " +
+                 " ".join(DEFAULT_PORTFOLIO) + ")")
+    parser.add_argument("--portfolio-deadline", required=False,
+            type=float, default=None, metavar="SECONDS",
+            help="Return the portfolio's best solution so far after SECONDS " +
+                 "(default: wait for an optimal solution or every formulation)")
     parser.add_argument("--eef-alt-constraints", "-e", required=False,
             action="store_true",
             help="Use slightly-modified EEF constraints (ignored for other formulations)")
@@ -57,7 +127,11 @@ def start():
             help="IP solver time limit in seconds (default: no time limit)")
     parser.add_argument("--verbose", "-v", required=False,
             action="store_true",
-            help="Log Gurobi output to screen and log file")
+            help="Log IP solver output to screen and log file")
+    parser.add_argument("--backend", "-b", required=False,
+            choices=ip_backend.BACKENDS, default=ip_backend.GUROBI,
+            help="The IP solver: gurobi, or cbc (through PuLP) where Gurobi " +
+                 "is not licensed (default: gurobi)")
     parser.add_argument("--edge-success-prob", "-p", required=False,
             type=float, default=1.0,
             help="Edge success probability, for failure-aware matching. " +
@@ -68,38 +142,42 @@ def start():
     parser.add_argument("--relax", "-x", required=False,
             action='store_true',
             help="Solve the LP relaxation.")
+    parser.add_argument("--jobs", "-j", required=False,
+            type=int, default=1, metavar='N',
+            help="Use N worker processes for cycle enumeration, or one " +
+                 "per CPU if N is 0 (default: 1)")
+    parser.add_argument("--cache-dir", required=False, default=None,
+            metavar='DIR',
+            help="Cache enumerated cycles and chains in directory DIR")
+    parser.add_argument("--cache-size", required=False,
+            type=float, default=1024, metavar='MB',
+            help="Maximum size of the cycle and chain cache in megabytes " +
+                 "(default: 1024)")
             
     args = parser.parse_args()
     args.formulation = args.formulation.lower()
 
-    digraph_edges = []
-    digraph_lines = open('example_data/input').readlines()
-    for line in digraph_lines:
-        tokens = [x for x in line.split()]
-        source = int(tokens[0])
-        target = int(tokens[1])
-        score = float(tokens[2])
-        digraph_edges.append((source, target, score))
+    digraph_edges = kidney_io.read_edge_list('example_data/input')
     d = kidney_digraph.read_edges(digraph_edges)
 
-    ndd_edges = []
-    ndd_lines = open('example_data/ndds').readlines()
-    for line in ndd_lines:
-        tokens = [x for x in line.split()]
-        source = int(tokens[0])
-        target = int(tokens[1])
-        score = float(tokens[2])
-        ndd_edges.append((source, target, score))
+    ndd_edges = kidney_io.read_edge_list('example_data/ndds')
 
     altruists = []
     altruists = kidney_ndds.read_ndd_edges(ndd_edges, d)
         
+    cache = None
+    if args.cache_dir is not None:
+        cache = enumeration_cache.EnumerationCache(args.cache_dir,
+                                                   int(args.cache_size * (1 << 20)))
+
     # start_time = time.time()
     cfg = kidney_ip.OptConfig(d, altruists, args.cycle_cap, args.chain_cap, 
             args.verbose, args.timelimit, args.edge_success_prob, 
-            args.eef_alt_constraints, args.lp_file, args.relax)
+            args.eef_alt_constraints, args.lp_file, args.relax, args.jobs or None,
+            cache, backend=args.backend)
 
-    opt_solution = solve_kep(cfg, args.formulation, args.use_relabelled)
+    opt_solution = solve_kep(cfg, args.formulation, args.use_relabelled, args.reduce,
+                             args.components, args.portfolio, args.portfolio_deadline)
     '''
     time_taken = time.time() - start_time
     print "formulation: {}".format(args.formulation)
@@ -109,13 +187,19 @@ def start():
     print "chain_cap: {}".format(args.chain_cap)
     print "edge_success_prob: {}".format(args.edge_success_prob)
     print "ip_time_limit: {}".format(args.timelimit)
-    print "ip_vars: {}".format(opt_solution.ip_model.numVars)
-    print "ip_constrs: {}".format(opt_solution.ip_model.numConstrs)
+    print "ip_vars: {}".format(opt_solution.ip_model.num_vars)
+    print "ip_constrs: {}".format(opt_solution.ip_model.num_constrs)
     print "total_time: {}".format(time_taken)
     print "ip_solve_time: {}".format(opt_solution.ip_model.runtime)
     print "solver_status: {}".format(opt_solution.ip_model.status)
     print "total_score: {}".format(opt_solution.total_score)
     '''
+    if args.reduce:
+        opt_solution.reduction.display()
+    if hasattr(opt_solution, "column_generation"):
+        opt_solution.column_generation.display()
+    if hasattr(opt_solution, "portfolio"):
+        opt_solution.portfolio.display()
     opt_solution.display()
 
 if __name__=="__main__":
@@ -19,13 +19,14 @@ def check_validity(opt_result, digraph, ndds, max_cycle, max_chain):
     """
 
     # all used edges exist
+    ndd_edge_index = kidney_ndds.NddEdgeIndex(ndds)
     for chain in opt_result.chains:
-        if chain.vtx_indices[0] not in [e.target_v.id for e in ndds[chain.ndd_index].edges]:
+        if not ndd_edge_index.edge_exists(chain.ndd_index, chain.vtx_indices[0]):
             raise KidneyOptimException("Edge from NDD {} to vertex {} is used but does not exist".format(
                     chain.ndd_index, chain.vtx_indices[0]))
     for cycle in opt_result.cycles:
         for i in range(len(cycle)):
-            if digraph.adj_mat[cycle[i-1].id][cycle[i].id] is None:
+            if digraph.get_edge(cycle[i-1].id, cycle[i].id) is None:
                 raise KidneyOptimException("Edge from vertex {} to vertex {} is used but does not exist".format(
                         cycle[i-1].id, cycle[i].id))
                 
@@ -80,8 +81,8 @@ def get_dist_from_nearest_ndd(digraph, ndds):
 
     while q:
         v = q.popleft()
-        for e in v.edges:
-            w = e.tgt
+        for w_id in digraph.out_neighbour_ids(v.id):
+            w = digraph.vs[w_id]
             if distances[w.id] == 999999999:
                 distances[w.id] = distances[v.id] + 1
                 q.append(w)
@@ -105,23 +106,34 @@ def find_selected_cycle(v_id, next_vv):
             cycle.append(v_id)
     return None
         
-def get_optimal_chains(digraph, ndds, edge_success_prob=1):
+def get_optimal_chains(ip_model, digraph, ndds, chain_vars, edge_success_prob=1):
+    """Returns the chains selected in a solved model.
+
+    Args:
+        ip_model: the solved ip_backend.IPModel
+        chain_vars: the kidney_ip.ChainVars of the model's chain edges
+    """
+
     # Chain edges
+    edge_vars = chain_vars.edge_vars
+    edges = [e for e in digraph.es for var in edge_vars[e.id]]
+    edge_vals = ip_model.get_values([var for e in digraph.es for var in edge_vars[e.id]])
     chain_next_vv = {e.src.id: e.tgt.id
-                        for e in digraph.es
-                        for var in e.grb_vars
-                        if var.x > 0.1}
+                        for e, val in zip(edges, edge_vals)
+                        if val > 0.1}
         
+    ndd_edge_vals = iter(ip_model.get_values(
+            [var for ndd_vars in chain_vars.ndd_edge_vars for var in ndd_vars]))
     optimal_chains = []
     for i, ndd in enumerate(ndds):
         for e in ndd.edges:
-            if e.edge_var.x > 0.1:
+            if next(ndd_edge_vals) > 0.1:
                 vtx_indices = find_selected_path(e.target_v.id, chain_next_vv)
                 # Get score of edge from NDD
                 score = e.score * edge_success_prob
                 # Add scores of edges between vertices
                 for j in range(len(vtx_indices) - 1):
-                    score += digraph.adj_mat[vtx_indices[j]][vtx_indices[j+1]].score * edge_success_prob**(j+2)
+                    score += digraph.get_edge(vtx_indices[j], vtx_indices[j+1]).score * edge_success_prob**(j+2)
                 optimal_chains.append(kidney_ndds.Chain(i, vtx_indices, score))
     
     return optimal_chains
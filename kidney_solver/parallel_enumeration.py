@@ -0,0 +1,281 @@
+"""Parallel cycle enumeration, and cycle and chain counting, using a pool of
+worker processes.
+
+The cycles whose lowest-indexed vertex is v can be found independently of
+the cycles for any other low vertex, so the low vertices are divided into
+shards which are handed out to the workers. Shards are balanced using a
+cheap estimate of the size of each low vertex's search tree, and the
+results are merged so that they are identical to those of a serial run.
+Chains are counted in the same way, with shards of NDD edges.
+"""
+
+import heapq
+import multiprocessing
+from array import array
+
+from kidney_digraph import CycleEnumerator
+from kidney_ndds import ChainExpander
+
+# Number of shards per worker process. Using more shards than workers lets
+# the pool even out errors in the work estimates.
+SHARDS_PER_JOB = 4
+
+# Minimum number of shards when counting with progress reports, so that
+# reports are made regularly even with few workers
+PROGRESS_SHARDS = 64
+
+def get_job_count(jobs):
+    """Returns the number of worker processes to use, given a requested
+    number of jobs (None means one per CPU)."""
+
+    if jobs is None:
+        return multiprocessing.cpu_count()
+    return max(1, jobs)
+
+def estimate_cycle_work(digraph, max_length):
+    """Estimate the size of the cycle-search tree for each low vertex.
+
+    The search from low vertex v only visits vertices with higher indices,
+    so the estimate is the product of v's out- and in-degrees counting only
+    higher-indexed neighbours, scaled down by the proportion of vertices
+    above v for each additional level of the search.
+
+    Returns:
+        a list of estimates, indexed by vertex ID
+    """
+
+    n = digraph.n
+    out_high = [0] * n
+    in_high = [0] * n
+    for src_id, tgt_id in zip(digraph.edge_src, digraph.edge_tgt):
+        if tgt_id > src_id:
+            out_high[src_id] += 1
+        else:
+            in_high[tgt_id] += 1
+
+    estimates = []
+    for v in range(n):
+        frac_above = float(n - v) / n
+        estimates.append(out_high[v] * in_high[v] * frac_above ** max(0, max_length - 2))
+    return estimates
+
+def partition_by_estimate(items, estimates, n_shards):
+    """Divide items into at most n_shards lists with roughly equal total
+    estimated work, by greedily placing the most expensive remaining item in
+    the least-loaded shard. Each shard is returned in ascending order.
+
+    Args:
+        items: a list of items (for example, low vertex IDs)
+        estimates: estimates[i] is the estimated work for items[i]
+        n_shards: the maximum number of shards
+    """
+
+    n_shards = max(1, min(n_shards, len(items)))
+    shards = [[] for __ in range(n_shards)]
+    loads = [(0, i) for i in range(n_shards)]
+    order = sorted(range(len(items)), key=lambda i: estimates[i], reverse=True)
+    for i in order:
+        load, shard_idx = heapq.heappop(loads)
+        shards[shard_idx].append(items[i])
+        heapq.heappush(loads, (load + estimates[i], shard_idx))
+    return [sorted(shard) for shard in shards if shard]
+
+# The CycleEnumerator or ChainExpander used by tasks in a worker process
+_worker_state = None
+
+def _init_cycle_worker(digraph, max_length):
+    global _worker_state
+    _worker_state = CycleEnumerator(digraph, max_length)
+
+def _init_chain_worker(digraph, max_chain):
+    global _worker_state
+    _worker_state = ChainExpander(digraph, max_chain)
+
+def _find_cycles_task(low_vertices):
+    cycle_vertices = array('i')
+    cycle_offsets = array('l', [0])
+    _worker_state.add_cycles_for_low_vertices(low_vertices, cycle_vertices, cycle_offsets)
+    return cycle_vertices, cycle_offsets
+
+def _count_cycles_task(low_vertices):
+    counts_by_size = [0] * (_worker_state.max_length + 1)
+    _worker_state.add_cycles_for_low_vertices(low_vertices, None, None, counts_by_size)
+    return counts_by_size
+
+def _count_chains_task(tgt_ids):
+    counts_by_size = [0] * (_worker_state.max_chain + 1)
+    _worker_state.add_chain_counts(tgt_ids, counts_by_size)
+    return counts_by_size
+
+def _map_shards(jobs, initializer, initargs, task, shards):
+    """Generate the results of task on each shard, in completion order, using
+    a pool of jobs worker processes that are set up by calling initializer
+    with initargs. If jobs is 1, the tasks are run in this process."""
+
+    global _worker_state
+    if jobs == 1:
+        saved_state = _worker_state
+        initializer(*initargs)
+        try:
+            for shard in shards:
+                yield task(shard)
+        finally:
+            _worker_state = saved_state
+        return
+
+    pool = multiprocessing.Pool(jobs, initializer, initargs)
+    try:
+        for result in pool.imap_unordered(task, shards):
+            yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+def _cycle_shards(digraph, max_length, low_vertices, n_shards):
+    """Divide the list low_vertices into at most n_shards shards of roughly
+    equal estimated work."""
+
+    all_estimates = estimate_cycle_work(digraph, max_length)
+    return partition_by_estimate(low_vertices, [all_estimates[v] for v in low_vertices],
+                                 n_shards)
+
+def _sum_counts(shard_results, counts_by_size, shard_count, progress):
+    """Add each count list generated by shard_results to counts_by_size.
+    If progress is not None, call progress(shards_done, shard_count,
+    counts_by_size) after each shard."""
+
+    for shards_done, shard_counts in enumerate(shard_results, 1):
+        for k, count in enumerate(shard_counts):
+            counts_by_size[k] += count
+        if progress is not None:
+            progress(shards_done, shard_count, counts_by_size)
+    return counts_by_size
+
+def find_cycles_flat(digraph, max_length, jobs=None, low_vertices=None):
+    """Find cycles of length up to max_length using a pool of worker processes.
+
+    The result is the same as that of Digraph.find_cycles_flat, with cycles
+    in the same order.
+
+    Args:
+        digraph: the Digraph
+        max_length: the cycle cap
+        jobs: the number of worker processes (default: one per CPU)
+        low_vertices: if not None, only cycles whose lowest-indexed
+            vertex is in this iterable of vertex IDs are found
+
+    Returns:
+        a pair (cycle_vertices, cycle_offsets) of arrays, as for
+        Digraph.find_cycles_flat
+    """
+
+    jobs = get_job_count(jobs)
+    if jobs == 1 or digraph.n < 2:
+        return digraph.find_cycles_flat(max_length, low_vertices)
+
+    if low_vertices is None:
+        low_vertices = range(digraph.n)
+    low_vertices = list(low_vertices)
+    shards = _cycle_shards(digraph, max_length, low_vertices, jobs * SHARDS_PER_JOB)
+    results = list(_map_shards(jobs, _init_cycle_worker, (digraph, max_length),
+                               _find_cycles_task, shards))
+
+    # Each cycle starts with its low vertex, and each shard's cycles are grouped
+    # by low vertex. Find each low vertex's run of cycles, then copy the runs
+    # in the order of low_vertices to reproduce the serial ordering.
+    rank = {low_vtx: i for i, low_vtx in enumerate(low_vertices)}
+    runs = []   # (rank of low vertex, result index, first cycle, end cycle)
+    for result_idx, (vertices, offsets) in enumerate(results):
+        n_cycles = len(offsets) - 1
+        i = 0
+        while i < n_cycles:
+            low_vtx = vertices[offsets[i]]
+            j = i + 1
+            while j < n_cycles and vertices[offsets[j]] == low_vtx:
+                j += 1
+            runs.append((rank[low_vtx], result_idx, i, j))
+            i = j
+    runs.sort()
+
+    cycle_vertices = array('i')
+    cycle_offsets = array('l', [0])
+    for __, result_idx, i, j in runs:
+        vertices, offsets = results[result_idx]
+        base = len(cycle_vertices) - offsets[i]
+        cycle_vertices.extend(vertices[offsets[i]:offsets[j]])
+        cycle_offsets.extend(array('l', [base + pos for pos in offsets[i+1:j+1]]))
+    return cycle_vertices, cycle_offsets
+
+def _shard_count(jobs, progress):
+    if progress is None:
+        return jobs * SHARDS_PER_JOB
+    return max(jobs * SHARDS_PER_JOB, PROGRESS_SHARDS)
+
+def count_cycles(digraph, max_length, jobs=None, progress=None):
+    """Count cycles of length up to max_length using a pool of worker processes.
+
+    Args:
+        digraph: the Digraph
+        max_length: the cycle cap
+        jobs: the number of worker processes (default: one per CPU)
+        progress: if not None, a function that is called as
+            progress(shards_done, shard_count, counts_by_size) each time a
+            shard of the low vertices has been counted, with the partial
+            counts so far
+
+    Returns:
+        a list counts_by_size of length max_length+1, where counts_by_size[k]
+        is the number of cycles with k vertices
+    """
+
+    jobs = get_job_count(jobs)
+    counts_by_size = [0] * (max_length + 1)
+    if max_length < 2:
+        return counts_by_size
+
+    if progress is None and (jobs == 1 or digraph.n < 2):
+        enumerator = CycleEnumerator(digraph, max_length)
+        enumerator.add_cycles_for_low_vertices(range(digraph.n), None, None, counts_by_size)
+        return counts_by_size
+
+    shards = _cycle_shards(digraph, max_length, range(digraph.n), _shard_count(jobs, progress))
+    results = _map_shards(jobs, _init_cycle_worker, (digraph, max_length), _count_cycles_task,
+                          shards)
+    return _sum_counts(results, counts_by_size, len(shards), progress)
+
+def count_chains(digraph, ndds, max_chain, jobs=None, progress=None):
+    """Count chains with up to max_chain edges (including the edge from the
+    NDD) using a pool of worker processes, which each count the chains
+    beginning with a shard of the NDD edges.
+
+    Args:
+        digraph: the Digraph
+        ndds: the list of NDDs
+        max_chain: the chain cap
+        jobs: the number of worker processes (default: one per CPU)
+        progress: as for count_cycles, but called after each shard of the
+            NDD edges
+
+    Returns:
+        a list counts_by_size of length max_chain+1, where counts_by_size[k]
+        is the number of chains with k vertices (that is, with k edges)
+    """
+
+    jobs = get_job_count(jobs)
+    counts_by_size = [0] * (max_chain + 1)
+    tgt_ids = [e.target_v.id for ndd in ndds for e in ndd.edges]
+    if max_chain == 0 or not tgt_ids:
+        return counts_by_size
+
+    if progress is None and jobs == 1:
+        ChainExpander(digraph, max_chain).add_chain_counts(tgt_ids, counts_by_size)
+        return counts_by_size
+
+    # Estimate the work for each NDD edge by the out-degree of its target
+    csr = digraph.csr()
+    estimates = [1 + csr.offsets[v+1] - csr.offsets[v] for v in tgt_ids]
+    shards = partition_by_estimate(tgt_ids, estimates, _shard_count(jobs, progress))
+    results = _map_shards(jobs, _init_chain_worker, (digraph, max_chain), _count_chains_task,
+                          shards)
+    return _sum_counts(results, counts_by_size, len(shards), progress)
@@ -0,0 +1,230 @@
+"""Racing several formulations on the same instance.
+
+Which formulation solves an instance fastest depends heavily on the
+instance. optimise_portfolio runs several formulations at once, each in its
+own process with its own solver time limit, and returns the first solution
+that is proved optimal. If none has been proved optimal by the deadline, the
+best solution reported so far is returned instead. The remaining processes
+are then terminated.
+
+A formulation reports its solution only when it finishes, so the solutions
+available at the deadline are those of formulations that stopped at their
+own time limits, or whose optimality could not be proved (for example
+column generation with a positive gap).
+"""
+
+import copy
+import multiprocessing
+import Queue
+import time
+
+from kidney_ndds import Chain
+from kidney_ip import OptSolution
+
+# How often, in seconds, to check for formulations that died without reporting
+POLL_INTERVAL = 1.0
+
+# A column-generation solution is proved optimal only if its gap is below this
+GAP_TOLERANCE = 1e-9
+
+class PortfolioEntry(object):
+    """A formulation in a portfolio.
+
+    Data members:
+        name: the formulation's name, as used by solve_kep
+        formulation_fun: the function to optimise an OptConfig
+        timelimit: the solver time limit in seconds for this formulation,
+            or None to use the OptConfig's time limit
+    """
+
+    def __init__(self, name, formulation_fun, timelimit=None):
+        self.name = name
+        self.formulation_fun = formulation_fun
+        self.timelimit = timelimit
+
+class PortfolioOutcome(object):
+    """How one formulation in a portfolio finished.
+
+    Data members:
+        name: the formulation's name
+        elapsed: the time in seconds from the start of the race until the
+            formulation reported, or None if it was terminated
+        total_score: the score of its solution, or None
+        optimal: True if and only if its solution was proved optimal
+        error: a description of the error if the formulation failed, or None
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.elapsed = None
+        self.total_score = None
+        self.optimal = False
+        self.error = None
+
+    def summary(self):
+        if self.error is not None:
+            return "failed after {:.3f}s ({})".format(self.elapsed, self.error)
+        if self.elapsed is None:
+            return "terminated"
+        return "{} score {} after {:.3f}s".format(
+                "optimal" if self.optimal else "feasible", self.total_score, self.elapsed)
+
+class PortfolioResult(object):
+    """The outcome of a portfolio race.
+
+    Data members:
+        winner: the name of the formulation whose solution was returned
+        optimal: True if and only if the winner's solution was proved optimal
+        elapsed: the duration of the race in seconds
+        outcomes: a list of PortfolioOutcome objects, one per formulation
+    """
+
+    def __init__(self, winner, optimal, elapsed, outcomes):
+        self.winner = winner
+        self.optimal = optimal
+        self.elapsed = elapsed
+        self.outcomes = outcomes
+
+    def display(self):
+        """Print the winner and each formulation's outcome to standard output."""
+
+        print "portfolio_winner: {}".format(self.winner)
+        print "portfolio_optimal: {}".format(self.optimal)
+        print "portfolio_time: {}".format(self.elapsed)
+        for outcome in self.outcomes:
+            print "portfolio_{}: {}".format(outcome.name, outcome.summary())
+
+def is_proven_optimal(opt_result, timelimit):
+    """Returns True if and only if opt_result, found with solver time limit
+    timelimit, is known to be optimal."""
+
+    if hasattr(opt_result, "column_generation") and \
+            opt_result.column_generation.gap > GAP_TOLERANCE:
+        return False
+    if opt_result.ip_model is None:
+        # The components were solved separately; with no time limit, each
+        # was solved to optimality
+        return timelimit is None
+    return opt_result.ip_model.is_optimal
+
+def _run_entry(index, entry, cfg, results):
+    """Optimise cfg with a portfolio entry, and put its solution on the queue
+    results as vertex IDs and (NDD index, vertex IDs, score) tuples."""
+
+    try:
+        opt_result = entry.formulation_fun(cfg)
+        results.put((index,
+                     [[v.id for v in c] for c in opt_result.cycles],
+                     [(c.ndd_index, list(c.vtx_indices), c.score) for c in opt_result.chains],
+                     is_proven_optimal(opt_result, cfg.timelimit),
+                     None))
+    except Exception as e:
+        results.put((index, None, None, False, "{}: {}".format(type(e).__name__, e)))
+
+def optimise_portfolio(entries, cfg, deadline=None):
+    """Race the formulations in entries on an instance.
+
+    Each formulation runs in its own process, with cycle enumeration in
+    that process only (cfg.jobs is ignored). The race ends when a
+    formulation's solution is proved optimal, when every formulation has
+    finished, or at the deadline if some formulation has reported a
+    solution by then (otherwise, when the first one does).
+
+    Args:
+        entries: a list of PortfolioEntry objects
+        cfg: an OptConfig object
+        deadline: the time in seconds after which the best solution so far
+            is returned, or None to wait for every formulation
+
+    Returns:
+        an OptSolution object for the best solution reported, with ties
+        going to the first to report. Its ip_model member is None, and it
+        has an additional member "portfolio" (a PortfolioResult).
+    """
+
+    if cfg.lp_file or cfg.relax:
+        raise ValueError("A portfolio cannot write an LP file or solve the LP relaxation")
+    if not entries:
+        raise ValueError("A portfolio needs at least one formulation")
+
+    results = multiprocessing.Queue()
+    processes = []
+    for i, entry in enumerate(entries):
+        entry_cfg = copy.copy(cfg)
+        entry_cfg.jobs = 1
+        if entry.timelimit is not None:
+            entry_cfg.timelimit = entry.timelimit
+        process = multiprocessing.Process(target=_run_entry, args=(i, entry, entry_cfg, results))
+        process.daemon = True
+        processes.append(process)
+
+    outcomes = [PortfolioOutcome(entry.name) for entry in entries]
+    reported = [False] * len(entries)
+    best = None
+    best_index = None
+    start_time = time.time()
+    try:
+        for process in processes:
+            process.start()
+        while not all(reported):
+            timeout = POLL_INTERVAL
+            if deadline is not None and best is not None:
+                remaining = deadline - (time.time() - start_time)
+                if remaining <= 0:
+                    break
+                timeout = min(timeout, remaining)
+            try:
+                message = results.get(True, timeout)
+            except Queue.Empty:
+                dead = [i for i, process in enumerate(processes)
+                        if not reported[i] and not process.is_alive()]
+                if not dead:
+                    continue
+                # A process may put its result and exit just after the get
+                # times out. A process's result is flushed to the queue
+                # before it exits, so a dead process has crashed only if
+                # its result is still missing once the queue is empty
+                try:
+                    message = results.get_nowait()
+                except Queue.Empty:
+                    for i in dead:
+                        reported[i] = True
+                        outcomes[i].elapsed = time.time() - start_time
+                        outcomes[i].error = "exited with code {}".format(processes[i].exitcode)
+                    continue
+
+            index, cycles, chains, optimal, error = message
+            reported[index] = True
+            outcome = outcomes[index]
+            outcome.elapsed = time.time() - start_time
+            if error is not None:
+                outcome.error = error
+                continue
+            vs = cfg.digraph.vs
+            opt_result = OptSolution(None,
+                                     [[vs[v_id] for v_id in c] for c in cycles],
+                                     [Chain(ndd_index, vtx_indices, score)
+                                      for ndd_index, vtx_indices, score in chains],
+                                     cfg.digraph, cfg.edge_success_prob)
+            outcome.total_score = opt_result.total_score
+            outcome.optimal = optimal
+            if best is None or opt_result.total_score > best.total_score:
+                best = opt_result
+                best_index = index
+            if optimal:
+                best = opt_result
+                best_index = index
+                break
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        for process in processes:
+            process.join()
+
+    if best is None:
+        raise RuntimeError("No formulation in the portfolio found a solution: " +
+                           "; ".join("{} {}".format(o.name, o.error) for o in outcomes))
+    best.portfolio = PortfolioResult(entries[best_index].name, outcomes[best_index].optimal,
+                                     time.time() - start_time, outcomes)
+    return best
@@ -6,8 +6,7 @@ import argparse
 import random
 import sys
 
-import kidney_digraph
-import kidney_ndds
+import kidney_io
 
 def write_edges(n, edges):
     """Writes an instance in .input or .ndds format
@@ -34,17 +33,7 @@ if __name__=="__main__":
     if not 0 < args.p < 1:
         raise ValueError("p should be in the interval (0, 1)")
 
-    input_lines = [line for line in sys.stdin]
-    n_digraph_edges = int(input_lines[0].split()[1])
-    digraph_lines = input_lines[:n_digraph_edges + 2]
-
-    d = kidney_digraph.read_digraph(digraph_lines)
-
-    if len(input_lines) > len(digraph_lines):
-        ndd_lines = input_lines[n_digraph_edges + 2:]
-        ndds = kidney_ndds.read_ndds(ndd_lines, d)
-    else:
-        ndds = []
+    d, ndds = kidney_io.read_instance(sys.stdin)
 
     pair_pair_edges = []
     for e in d.es:
@@ -0,0 +1,71 @@
+"""
+A program for timing IP model construction for each of a list of
+formulations on a kidney-exchange instance.
+
+The build time reported for a formulation is the time from the creation of
+its IP model until the solver is started (IPModel.build_time). It excludes
+the enumeration of cycles and chains that precedes model creation, but the
+_full_red formulations enumerate cycles while building their models, so
+their build times include it.
+"""
+
+import argparse
+import sys
+
+import ip_backend
+import kidney_io
+import kidney_ip
+from kidney_solver import solve_kep
+
+def time_formulation(cfg, formulation, repeats):
+    """Returns the smallest build time, and the corresponding solve time
+    and total score, from repeats runs of the formulation.
+
+    Raises ValueError if the formulation does not solve a single IP model
+    in this process (as for the portfolio)."""
+
+    best = None
+    for __ in range(repeats):
+        opt_solution = solve_kep(cfg, formulation, use_relabelled=False)
+        ip_model = opt_solution.ip_model
+        if ip_model is None:
+            raise ValueError("{} does not build a single IP model".format(formulation))
+        if best is None or ip_model.build_time < best[0]:
+            best = (ip_model.build_time, ip_model.runtime, opt_solution.total_score)
+    return best
+
+def start():
+    parser = argparse.ArgumentParser(
+            "Time IP model construction for a kidney-exchange instance")
+    parser.add_argument("cycle_cap", type=int,
+            help="The maximum permitted cycle length")
+    parser.add_argument("chain_cap", type=int,
+            help="The maximum permitted number of edges in a chain")
+    parser.add_argument("formulations", nargs="+",
+            help="The IP formulations to time (as for kidney_solver.py)")
+    parser.add_argument("--repeats", "-n", type=int, default=3,
+            help="The number of runs of each formulation; the fastest is reported " +
+                 "(default: 3)")
+    parser.add_argument("--timelimit", "-t", type=float, default=None,
+            help="IP solver time limit in seconds (default: no time limit)")
+    parser.add_argument("--backend", "-b", choices=ip_backend.BACKENDS,
+            default=ip_backend.GUROBI,
+            help="The IP solver (default: gurobi)")
+
+    args = parser.parse_args()
+
+    d, altruists = kidney_io.read_instance(sys.stdin)
+    cfg = kidney_ip.OptConfig(d, altruists, args.cycle_cap, args.chain_cap,
+                              timelimit=args.timelimit, backend=args.backend)
+
+    print "formulation\tbuild_time\tsolve_time"
+    for formulation in args.formulations:
+        try:
+            build_time, solve_time, __ = time_formulation(cfg, formulation.lower(), args.repeats)
+        except ValueError as e:
+            print "{}\tfailed: {}".format(formulation, e)
+            continue
+        print "{}\t{:.3f}\t{:.3f}".format(formulation, build_time, solve_time)
+
+if __name__=="__main__":
+    start()
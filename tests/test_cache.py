@@ -0,0 +1,64 @@
+import os
+import shutil
+import tempfile
+
+from kidney_solver.kidney_digraph import *
+import kidney_solver.kidney_ndds as k_ndds
+import kidney_solver.enumeration_cache as k_cache
+from test_ip import read_with_ndds
+
+def flat_to_lists(cycle_vertices, cycle_offsets):
+    return [list(cycle_vertices[cycle_offsets[i]:cycle_offsets[i+1]])
+            for i in range(len(cycle_offsets) - 1)]
+
+def chain_tuples(chains):
+    return [(c.ndd_index, c.vtx_indices, c.score) for c in chains]
+
+class TestEnumerationCache(object):
+    def setup(self):
+        self.directory = tempfile.mkdtemp()
+
+    def teardown(self):
+        shutil.rmtree(self.directory)
+
+    def test_cycles(self):
+        d, ndds = read_with_ndds("test-fixtures/100-random-weights")
+        cache = k_cache.EnumerationCache(self.directory)
+        for max_length in [4, 4, 3, 2, 5]:
+            expected = flat_to_lists(*d.find_cycles_flat(max_length))
+            assert flat_to_lists(*cache.find_cycles_flat(d, max_length)) == expected
+            cycles = k_cache.find_cycle_set(d, max_length, cache=cache)
+            assert [cycles[i].tolist() for i in range(len(cycles))] == expected
+            assert cycles.scores.tolist() == d.find_cycle_set(max_length).scores.tolist()
+        # Caps 4 and 5 were enumerated; caps 2 and 3 were found by filtering
+        assert len(os.listdir(self.directory)) == 2
+
+    def test_chains(self):
+        d, ndds = read_with_ndds("test-fixtures/100-random-weights")
+        cache = k_cache.EnumerationCache(self.directory)
+        for max_chain, p in [(3, 1), (3, 1), (2, 1), (0, 1), (2, 0.5)]:
+            expected = chain_tuples(k_ndds.find_chains(d, ndds, max_chain, p))
+            assert chain_tuples(cache.find_chains(d, ndds, max_chain, p)) == expected
+        assert len(os.listdir(self.directory)) == 2
+
+    def test_fingerprint_depends_on_edges(self):
+        d, ndds = read_with_ndds("test-fixtures/100-random-weights")
+        fingerprint = k_cache.instance_fingerprint(d, ndds)
+        assert k_cache.instance_fingerprint(d, ndds) == fingerprint
+        assert k_cache.instance_fingerprint(d) != fingerprint
+        d.remove_edge(d.es[0].src.id, d.es[0].tgt.id)
+        assert k_cache.instance_fingerprint(d, ndds) != fingerprint
+
+    def test_eviction(self):
+        d, ndds = read_with_ndds("test-fixtures/100-random-weights")
+        cache = k_cache.EnumerationCache(self.directory)
+        cache.find_cycles_flat(d, 2)
+        cache.find_cycles_flat(d.induced_subgraph(d.vs[:50]), 2)
+        sizes = sorted(os.path.getsize(os.path.join(self.directory, f))
+                       for f in os.listdir(self.directory))
+        cache.max_bytes = sizes[-1]
+        old = os.path.join(self.directory, sorted(os.listdir(self.directory))[0])
+        os.utime(old, (0, 0))
+        cache.evict()
+        assert len(os.listdir(self.directory)) == 1
+        assert not os.path.exists(old)
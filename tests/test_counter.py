@@ -29,3 +29,62 @@ def test_counter():
     assert chain_counts == ccc.count_chains(d, ndds, max_length)
     
     
+
+def test_parallel_counter():
+    d, ndds = read_with_ndds("test-fixtures/100-random-weights")
+    for max_length in [0, 2, 3, 4]:
+        assert ccc.count_cycles(d, max_length, jobs=3) == ccc.count_cycles(d, max_length)
+
+def test_parallel_chain_counter():
+    d, ndds = read_with_ndds("test-fixtures/100-random-weights")
+    for max_chain in [0, 1, 3, 4]:
+        assert ccc.count_chains(d, ndds, max_chain, jobs=3) == ccc.count_chains(d, ndds, max_chain)
+
+def test_counter_progress():
+    d, ndds = read_with_ndds("test-fixtures/100-random-weights")
+    for jobs in [1, 2]:
+        reports = []
+        progress = lambda done, count, counts: reports.append((done, count, sum(counts)))
+        counts = ccc.count_cycles(d, 4, jobs, progress)
+        assert counts == ccc.count_cycles(d, 4)
+        assert [r[0] for r in reports] == range(1, reports[0][1] + 1)
+        assert reports[-1][2] == sum(counts)
+        assert [r[2] for r in reports] == sorted(r[2] for r in reports)
+
+        reports = []
+        counts = ccc.count_chains(d, ndds, 4, jobs, progress)
+        assert counts == ccc.count_chains(d, ndds, 4)
+        assert [r[0] for r in reports] == range(1, reports[0][1] + 1)
+        assert reports[-1][2] == sum(counts)
+
+def test_closed_form_counter():
+    import kidney_solver.closed_form_counts as cfc
+    import kidney_solver.parallel_enumeration as pe
+    for basename in ["test-fixtures/100-random-weights", "test-fixtures/MD-00001-00000100",
+                     "test-fixtures/chain-finding", "test-fixtures/no-cycles"]:
+        d, ndds = read_with_ndds(basename)
+        for cap in range(4):
+            assert cfc.count_cycles(d, cap) == pe.count_cycles(d, cap, jobs=1)
+            assert cfc.count_chains(d, ndds, cap) == pe.count_chains(d, ndds, cap, jobs=1)
+
+def test_approximate_counter():
+    import kidney_solver.approximate_counting as ac
+    d, ndds = read_with_ndds("test-fixtures/100-random-weights")
+    for cap in [0, 1, 2, 3, 4]:
+        for estimate, exact in [(ac.estimate_cycle_counts(d, cap, 5000, seed=1),
+                                 ccc.count_cycles(d, cap)),
+                                (ac.estimate_chain_counts(d, ndds, cap, 5000, seed=1),
+                                 ccc.count_chains(d, ndds, cap))]:
+            assert len(estimate.counts_by_size) == cap + 1
+            for count, half_width, exact_count in zip(estimate.counts_by_size,
+                                                      estimate.half_widths, exact):
+                # Allow for the 5% of intervals that miss the true count
+                assert abs(count - exact_count) <= 2 * half_width + 1e-6 * exact_count
+            if sum(exact) == 0:
+                assert estimate.total == 0
+
+    e1 = ac.estimate_cycle_counts(d, 4, 1000, seed=2)
+    e2 = ac.estimate_cycle_counts(d, 4, 1000, seed=2)
+    assert e1.counts_by_size == e2.counts_by_size
+    assert e1.samples == 1000
+    assert abs(ac.normal_quantile(0.975) - 1.959964) < 1e-5
@@ -1,6 +1,7 @@
 import time
 
 import nose.tools
+import numpy
 
 from kidney_solver.kidney_digraph import *
 from simple_find_cycles import simple_find_cycles
@@ -88,3 +89,163 @@ def test_raises_exception_on_index_out_of_range_3():
 @nose.tools.raises(KidneyReadException)
 def test_raises_exception_on_index_out_of_range_4():
     d = read("test-fixtures/out-of-range4.input")
+
+def test_sparse_edge_lookup():
+    d = Digraph(3)
+    d.add_edge(2.5, d.vs[0], d.vs[2])
+    d.add_edge(1, d.vs[2], d.vs[1])
+    assert d.get_edge(0, 2).score == 2.5
+    assert d.get_edge(2, 0) is None
+    assert d.edge_exists(d.vs[2], d.vs[1])
+    assert not d.edge_exists(d.vs[1], d.vs[2])
+
+    csr = d.csr()
+    assert list(csr.offsets) == [0, 1, 1, 2]
+    assert list(csr.targets) == [2, 1]
+    assert list(csr.scores) == [2.5, 1]
+
+    d.remove_edge(0, 2)
+    assert d.get_edge(0, 2) is None
+    assert [e.id for e in d.es] == [0]
+    assert list(d.csr().targets) == [1]
+
+def test_induced_subgraph():
+    d = read("test-fixtures/100.input")
+    vertices = list(reversed(d.vs[10:60]))
+    sub = d.induced_subgraph(vertices)
+    for i, v in enumerate(vertices):
+        for j, w in enumerate(vertices):
+            assert sub.edge_exists(sub.vs[i], sub.vs[j]) == d.edge_exists(v, w)
+
+def test_edge_views():
+    d = Digraph(3)
+    d.add_edge(1.5, d.vs[0], d.vs[1])
+    d.add_edge(2, d.vs[0], d.vs[2])
+    assert [e.tgt.id for e in d.vs[0].edges] == [1, 2]
+    assert d.vs[0].edges[1] == d.es[1] == d.get_edge(0, 2)
+    assert d.es[0] != d.es[1]
+    assert d.es[-1].score == 2
+    assert not hasattr(d.es[0], "__dict__")
+    assert not hasattr(d.vs[0], "__dict__")
+
+def test_find_cycles_flat():
+    d = read("test-fixtures/100.input")
+    for max_cycle in [0, 1, 2, 3, 4]:
+        cycle_vertices, cycle_offsets = d.find_cycles_flat(max_cycle)
+        flat_cycles = [list(cycle_vertices[cycle_offsets[i]:cycle_offsets[i+1]])
+                       for i in range(len(cycle_offsets) - 1)]
+        slow_cycles = simple_find_cycles(d, max_cycle)
+        assert sorted(flat_cycles) == sorted([v.id for v in c] for c in slow_cycles)
+        assert flat_cycles == [[v.id for v in c] for c in d.find_cycles(max_cycle)]
+
+    cycle_vertices, cycle_offsets = d.find_cycles_flat(3, low_vertices=[5, 7])
+    for i in range(len(cycle_offsets) - 1):
+        assert cycle_vertices[cycle_offsets[i]] in [5, 7]
+
+def test_find_cycles_parallel():
+    d = read("test-fixtures/100.input")
+    for max_cycle in [0, 2, 3, 4]:
+        serial = d.find_cycles_flat(max_cycle)
+        assert d.find_cycles_flat(max_cycle, jobs=3) == serial
+        assert ([[v.id for v in c] for c in d.find_cycles(max_cycle, jobs=2)] ==
+                [[v.id for v in c] for c in d.find_cycles(max_cycle)])
+    assert (d.find_cycles_flat(3, low_vertices=[40, 5, 7], jobs=2) ==
+            d.find_cycles_flat(3, low_vertices=[40, 5, 7]))
+
+def test_low_vtx_distances():
+    d = read("test-fixtures/100.input")
+    for v in d.vs:
+        assert (sorted(d.in_neighbour_ids(v.id)) ==
+                sorted(e.src.id for e in d.es if e.tgt.id == v.id))
+    for max_dist in [0, 1, 3]:
+        low_vertices = []
+        for low_vtx, dist_from_lv, dist_to_lv in d.generate_low_vtx_distances(max_dist):
+            low_vertices.append(low_vtx)
+            for dists, expected in [
+                    (dist_from_lv, d.get_shortest_path_from_low_vtx(low_vtx, max_dist)),
+                    (dist_to_lv, d.get_shortest_path_to_low_vtx(low_vtx, max_dist))]:
+                assert [dists.get(v.id, 999999999) for v in d.vs] == expected
+        assert low_vertices == range(d.n)
+
+def test_bounded_bfs_engine():
+    d = read("test-fixtures/100.input")
+    for max_dist in [0, 1, 2, 4]:
+        dist_from, dist_to = d.low_vtx_distance_matrices(max_dist)
+        assert dist_from.dtype == numpy.int8 and dist_from.shape == (d.n, d.n)
+        for low_vtx in range(d.n):
+            expected_from = d.get_shortest_path_from_low_vtx(low_vtx, max_dist)
+            expected_to = d.get_shortest_path_to_low_vtx(low_vtx, max_dist)
+            for v in range(d.n):
+                assert dist_from[low_vtx, v] == min(expected_from[v], INT8_UNREACHABLE)
+                assert dist_to[low_vtx, v] == min(expected_to[v], INT8_UNREACHABLE)
+
+    # The sparse and dense frontier expansions give the same distances
+    sparse_engine = BoundedBfsEngine(d.n, d.csr())
+    sparse_engine.DENSE_COST_RATIO = 0
+    dense_engine = BoundedBfsEngine(d.n, d.csr())
+    dense_engine.DENSE_COST_RATIO = d.n ** 3
+    low_vertices = [3, 50, 0, 99]
+    assert (sparse_engine.distances(low_vertices, 3) ==
+            dense_engine.distances(low_vertices, 3)).all()
+
+def test_cycle_set():
+    d = read("test-fixtures/100.input")
+    cycles = d.find_cycles(4)
+    cycle_set = d.find_cycle_set(4)
+    assert len(cycle_set) == len(cycles)
+    assert [c.tolist() for c in cycle_set] == [[v.id for v in c] for c in cycles]
+    assert cycle_set.vertices.dtype == numpy.int32
+    assert cycle_set.lengths.tolist() == [len(c) for c in cycles]
+    assert cycle_set.scores.tolist() == [cycle_score(c, d) for c in cycles]
+    assert (cycle_set.failure_aware_scores(.5).tolist() ==
+            [failure_aware_cycle_score(c, d, .5) for c in cycles])
+    assert cycle_set.vertex_list(-1) == cycles[-1]
+
+    vtx_offsets, vtx_cycles = cycle_set.vertex_incidence()
+    for v in d.vs:
+        assert (vtx_cycles[vtx_offsets[v.id]:vtx_offsets[v.id+1]].tolist() ==
+                [i for i, c in enumerate(cycles) if v in c])
+
+    part = cycle_set[10:20]
+    assert len(part) == 10
+    assert numpy.may_share_memory(part.vertices, cycle_set.vertices)
+    assert [c.tolist() for c in part] == [[v.id for v in c] for c in cycles[10:20]]
+    assert part.scores.tolist() == cycle_set.scores[10:20].tolist()
+    assert [c.tolist() for c in part[2:4]] == [[v.id for v in c] for c in cycles[12:14]]
+    vtx_offsets, vtx_cycles = part.vertex_incidence()
+    assert sorted(vtx_cycles.tolist()) == sorted(i for i in range(10) for v in cycles[10+i])
+    assert len(d.find_cycle_set(1)) == 0
+
+def test_strongly_connected_components():
+    d = Digraph(7)
+    for src, tgt in [(0, 1), (1, 2), (2, 0), (2, 3), (3, 4), (4, 3), (5, 6)]:
+        d.add_edge(1, d.vs[src], d.vs[tgt])
+    component_ids = d.strongly_connected_components()
+    assert len(set(component_ids[:3])) == 1
+    assert component_ids[3] == component_ids[4]
+    assert len(set(component_ids)) == 4
+    # Components are in reverse topological order
+    assert component_ids[3] < component_ids[0]
+    assert component_ids[6] < component_ids[5]
+
+    d = read("test-fixtures/300.input")
+    component_ids = d.strongly_connected_components()
+    for cycle in d.find_cycles(3):
+        assert len(set(component_ids[v.id] for v in cycle)) == 1
+
+def test_reduce_instance():
+    import kidney_solver.kidney_ndds as k_ndds
+    import kidney_solver.graph_reduction as k_red
+    d = Digraph(7)
+    for src, tgt in [(0, 1), (1, 0), (1, 2), (3, 4), (4, 5), (5, 6)]:
+        d.add_edge(1, d.vs[src], d.vs[tgt])
+    ndd = k_ndds.Ndd()
+    ndd.add_edge(k_ndds.NddEdge(d.vs[3], 1))
+    reduction = k_red.reduce_instance(d, [ndd], 3, 2)
+    assert [v.id for v in reduction.kept_vertices] == [0, 1, 3, 4]
+    assert [(e.src.id, e.tgt.id) for e in reduction.digraph.es] == [(0, 1), (1, 0), (2, 3)]
+    assert [e.target_v.id for e in reduction.ndds[0].edges] == [2]
+
+    reduction = k_red.reduce_instance(d, [ndd], 3, 0)
+    assert [v.id for v in reduction.kept_vertices] == [0, 1]
+    assert reduction.ndds[0].edges == []
@@ -0,0 +1,92 @@
+import StringIO
+import nose.tools
+
+from kidney_solver.kidney_digraph import *
+import kidney_solver.kidney_ndds as k_ndds
+import kidney_solver.kidney_io as k_io
+
+def read_lines(filename):
+    with open(filename) as f:
+        return f.readlines()
+
+def check_same_digraph(d1, d2):
+    assert d1.n == d2.n
+    assert [(e.src.id, e.tgt.id, e.score) for e in d1.es] == \
+           [(e.src.id, e.tgt.id, e.score) for e in d2.es]
+
+def test_read_instance_matches_line_readers():
+    for name in ["MD-00001-00000100", "100-random-weights", "chain-finding"]:
+        input_lines = read_lines("test-fixtures/{}.input".format(name))
+        ndd_lines = read_lines("test-fixtures/{}.ndds".format(name))
+        expected_d = read_digraph(input_lines)
+        expected_ndds = k_ndds.read_ndds(ndd_lines, expected_d)
+
+        # Small chunk sizes make lines straddle chunk boundaries
+        for chunk_size in [7, 64, k_io.CHUNK_SIZE]:
+            reader = k_io.LineReader(StringIO.StringIO("".join(input_lines + ndd_lines)),
+                                     chunk_size)
+            d = k_io._read_digraph(reader)
+            ndds = k_io._read_ndds(reader, d)
+            check_same_digraph(d, expected_d)
+            assert [[(e.target_v.id, e.score) for e in ndd.edges] for ndd in ndds] == \
+                   [[(e.target_v.id, e.score) for e in ndd.edges] for ndd in expected_ndds]
+
+def test_read_instance_without_ndds():
+    d, ndds = k_io.read_instance("test-fixtures/300.input")
+    check_same_digraph(d, read_digraph(read_lines("test-fixtures/300.input")))
+    assert ndds == []
+
+def test_read_edge_list():
+    edges = k_io.read_edge_list(StringIO.StringIO("0 1 1.5\n1 2 2\n2 0 0.25"))
+    assert edges == [(0, 1, 1.5), (1, 2, 2.0), (2, 0, 0.25)]
+    assert k_io.read_edge_list(StringIO.StringIO("")) == []
+    for text in ["0 1 2 3\n2 0", "0 1 2\n1 2\n", "0 1 2\n1 2 3 4\n", "0 1 x\n"]:
+        nose.tools.assert_raises(KidneyReadException, k_io.read_edge_list,
+                                 StringIO.StringIO(text))
+
+def test_raises_exception_on_invalid_instances():
+    for name in ["self-loop", "duplicate-edge", "incorrect_edge_count1",
+                 "incorrect_edge_count2", "out-of-range1", "out-of-range2",
+                 "out-of-range3", "out-of-range4", "ragged-rows"]:
+        nose.tools.assert_raises(KidneyReadException, k_io.read_digraph_file,
+                                 "test-fixtures/{}.input".format(name))
+    d = k_io.read_digraph_file("test-fixtures/duplicate-ndd-edge.input")
+    nose.tools.assert_raises(KidneyReadException, k_io.read_ndds_file,
+                             "test-fixtures/duplicate-ndd-edge.ndds", d)
+
+def check_same_instance(instance1, instance2):
+    d1, ndds1 = instance1
+    d2, ndds2 = instance2
+    check_same_digraph(d1, d2)
+    assert [[(e.target_v.id, e.score) for e in ndd.edges] for ndd in ndds1] == \
+           [[(e.target_v.id, e.score) for e in ndd.edges] for ndd in ndds2]
+
+def test_binary_instance_round_trip():
+    import os, tempfile
+    expected = k_io.read_instance("test-fixtures/MD-00001-00000100.input")
+    d = expected[0]
+    expected = (d, k_io.read_ndds_file("test-fixtures/MD-00001-00000100.ndds", d))
+    f = StringIO.StringIO()
+    k_io.write_binary_instance(f, *expected)
+    data = f.getvalue()
+    assert len(data) % 8 == 0
+    check_same_instance(k_io.read_instance(StringIO.StringIO(data)), expected)
+
+    fd, path = tempfile.mkstemp(suffix=".bin")
+    os.close(fd)
+    try:
+        k_io.write_binary_instance(path, *expected)
+        check_same_instance(k_io.read_instance(path), expected)
+        instance = k_io.load_binary_instance(path)
+        assert instance.n == d.n and instance.ndd_count == len(expected[1])
+        assert instance.edge_tgt.tolist() == list(d.edge_tgt)
+    finally:
+        os.remove(path)
+
+    nose.tools.assert_raises(KidneyReadException, k_io.read_instance,
+                             StringIO.StringIO(data[:-8]))
+
+def test_read_wmd():
+    d, ndds = k_io.read_wmd("example_data/MD-00001-00000100.wmd")
+    assert d.n == 64 and len(d.es) == 1025
+    assert len(ndds) == 6 and sum(len(ndd.edges) for ndd in ndds) == 188
@@ -145,3 +145,232 @@ def test_relabelled_solve():
                     k_ip.optimise_picef, k_ip.OptConfig(d, ndds, max_cycle, max_chain))
             print "   ", opt_result.total_score
             assert abs(opt_result.total_score - opt_result_0.total_score) < EPS
+
+def test_reduced_solve():
+    """Checks that removing vertices and edges that cannot be in any cycle
+    or chain does not affect the result
+    """
+    EPS = 0.000001
+    for basename in ["test-fixtures/100-random-weights", "test-fixtures/MD-00001-00000100"]:
+        d, ndds = read_with_ndds(basename)
+        for max_cycle in [0, 2, 3]:
+            for max_chain in [0, 1, 3]:
+                for fn in [k_ip.optimise_picef, k_ip.optimise_hpief_prime]:
+                    opt_result_0 = fn(k_ip.OptConfig(d, ndds, max_cycle, max_chain))
+                    opt_result = k_ip.optimise_reduced(
+                            fn, k_ip.OptConfig(d, ndds, max_cycle, max_chain))
+                    k_utils.check_validity(opt_result, d, ndds, max_cycle, max_chain)
+                    assert abs(opt_result.total_score - opt_result_0.total_score) < EPS
+                    assert opt_result.reduction.digraph.n <= d.n
+
+def test_component_solve():
+    """Checks that solving the components of an instance separately gives
+    the same result as solving the whole instance
+    """
+    import kidney_solver.decomposition as k_dec
+    EPS = 0.000001
+    d1, ndds1 = read_with_ndds("test-fixtures/100-random-weights")
+    d2, ndds2 = read_with_ndds("test-fixtures/MD-00001-00000100")
+    # The disjoint union of the two instances
+    d = Digraph(d1.n + d2.n)
+    for e in d1.es:
+        d.add_edge(e.score, d.vs[e.src.id], d.vs[e.tgt.id])
+    for e in d2.es:
+        d.add_edge(e.score, d.vs[d1.n + e.src.id], d.vs[d1.n + e.tgt.id])
+    ndds = k_ndds.create_relabelled_ndds(ndds1, d.vs) + \
+           k_ndds.create_relabelled_ndds(ndds2, d.vs[d1.n:])
+    assert len(k_dec.split_instance(d, ndds)) == 2
+
+    for max_cycle, max_chain in [(3, 0), (3, 3)]:
+        opt_result_0 = k_ip.optimise_picef(k_ip.OptConfig(d, ndds, max_cycle, max_chain))
+        for jobs in [1, 2]:
+            for fn in [k_ip.optimise_picef, k_ip.optimise_ccf]:
+                cfg = k_ip.OptConfig(d, ndds, max_cycle, max_chain, jobs=jobs)
+                opt_result = k_dec.optimise_components(fn, cfg)
+                k_utils.check_validity(opt_result, d, ndds, max_cycle, max_chain)
+                assert abs(opt_result.total_score - opt_result_0.total_score) < EPS
+
+def test_portfolio_solve():
+    """Checks that racing formulations gives an optimal solution, and
+    records a winner from the portfolio
+    """
+    import kidney_solver.kidney_solver as k_solver
+    EPS = 0.000001
+    d, ndds = read_with_ndds("test-fixtures/100-random-weights")
+    portfolio = ["picef", "cf", ("eef", 60)]
+    for max_cycle, max_chain in [(3, 0), (3, 3)]:
+        cfg = k_ip.OptConfig(d, ndds, max_cycle, max_chain)
+        opt_result_0 = k_ip.optimise_picef(cfg)
+        for use_reduced in [False, True]:
+            opt_result = k_solver.solve_kep(cfg, "portfolio", use_reduced=use_reduced,
+                                            portfolio_formulations=portfolio)
+            k_utils.check_validity(opt_result, d, ndds, max_cycle, max_chain)
+            assert abs(opt_result.total_score - opt_result_0.total_score) < EPS
+            assert opt_result.portfolio.optimal
+            assert opt_result.portfolio.winner in ["picef", "cf", "eef"]
+            assert len(opt_result.portfolio.outcomes) == 3
+
+def _empty_solution(cfg):
+    return k_ip.OptSolution(None, [], [], cfg.digraph)
+
+def test_portfolio_result_at_poll_boundary():
+    """Checks that a formulation that reports and exits just as the wait
+    for results times out is not taken to have crashed
+    """
+    import kidney_solver.portfolio as k_portfolio
+    d, ndds = read_with_ndds("test-fixtures/one-cycle")
+    cfg = k_ip.OptConfig(d, ndds, 3, 0)
+    # With time limits, the solutions are not known to be optimal, so the
+    # race waits for every formulation
+    entries = [k_portfolio.PortfolioEntry(str(i), _empty_solution, 1) for i in range(4)]
+    poll_interval = k_portfolio.POLL_INTERVAL
+    k_portfolio.POLL_INTERVAL = 0.0001
+    try:
+        for __ in range(20):
+            opt_result = k_portfolio.optimise_portfolio(entries, cfg)
+            for outcome in opt_result.portfolio.outcomes:
+                assert outcome.error is None
+                assert outcome.total_score == 0
+    finally:
+        k_portfolio.POLL_INTERVAL = poll_interval
+
+def test_column_generation():
+    """Checks that the column-generation solver finds a valid solution,
+    and an LP bound no less than the optimal objective value
+    """
+    import kidney_solver.column_generation as k_cg
+    EPS = 0.000001
+    for basename, p in [("test-fixtures/100-random-weights", 0.7),
+                        ("test-fixtures/MD-00001-00000100", 1)]:
+        d, ndds = read_with_ndds(basename)
+        for max_cycle, max_chain in [(0, 3), (3, 0), (3, 3), (4, 2)]:
+            cfg = k_ip.OptConfig(d, ndds, max_cycle, max_chain, edge_success_prob=p)
+            opt_result_0 = k_ip.optimise_ccf(cfg)
+            opt_result = k_ip.optimise_relabelled(k_cg.optimise_ccf_column_generation, cfg)
+            k_utils.check_validity(opt_result, d, ndds, max_cycle, max_chain)
+            stats = opt_result.column_generation
+            assert opt_result.total_score <= opt_result_0.total_score + EPS
+            assert stats.lp_bound >= opt_result_0.total_score - EPS
+            assert abs(stats.obj_val - opt_result.total_score) < EPS
+            assert stats.gap >= 0
+
+def test_lazy_edge_formulation():
+    """Checks that the edge formulation with lazy cap constraints gives
+    valid solutions, with the same objective values as PICEF
+    """
+    EPS = 0.000001
+    for basename in ["test-fixtures/no-cycles", "test-fixtures/one-cycle",
+                     "test-fixtures/two_2cycles", "test-fixtures/3cycle_and_3chain"]:
+        d, ndds = read_with_ndds(basename)
+        for max_cycle, max_chain in [(0, 2), (2, 1), (3, 3), (4, 0)]:
+            cfg = k_ip.OptConfig(d, ndds, max_cycle, max_chain)
+            opt_result_0 = k_ip.optimise_picef(cfg)
+            opt_result = k_ip.optimise_lazy_ef(cfg)
+            k_utils.check_validity(opt_result, d, ndds, max_cycle, max_chain)
+            assert abs(opt_result.total_score - opt_result_0.total_score) < EPS
+
+def test_mip_start():
+    """Checks that solving with a MIP start from a previous solution, on
+    the same instance and after some vertices have left, gives valid
+    solutions with the same objective values as solving without one
+    """
+    EPS = 0.000001
+    d, ndds = read_with_ndds("test-fixtures/100-random-weights")
+    max_cycle, max_chain = 3, 3
+    opt_result_0 = k_ip.optimise_picef(k_ip.OptConfig(d, ndds, max_cycle, max_chain))
+    mip_start = opt_result_0.mip_start()
+
+    # Remove the vertices of the first cycle and the first NDD
+    removed = set(v.id for v in opt_result_0.cycles[0])
+    kept = [v for v in d.vs if v.id not in removed]
+    d2 = d.induced_subgraph(kept)
+    old_to_new_vtx = [None] * d.n
+    for i, v in enumerate(kept):
+        old_to_new_vtx[v.id] = d2.vs[i]
+    ndds2 = []
+    for ndd in ndds[1:]:
+        new_ndd = k_ndds.Ndd()
+        for e in ndd.edges:
+            if e.target_v.id not in removed:
+                new_ndd.add_edge(k_ndds.NddEdge(old_to_new_vtx[e.target_v.id], e.score))
+        ndds2.append(new_ndd)
+    mip_start2 = mip_start.relabelled([None if v is None else v.id for v in old_to_new_vtx],
+                                      {i: i-1 for i in range(1, len(ndds))})
+    assert len(mip_start2.cycles) == len(mip_start.cycles) - 1
+    opt_result2_0 = k_ip.optimise_picef(k_ip.OptConfig(d2, ndds2, max_cycle, max_chain))
+
+    for digraph, ndd_list, start, expected in [(d, ndds, mip_start, opt_result_0),
+                                               (d2, ndds2, mip_start2, opt_result2_0)]:
+        for fn in [k_ip.optimise_picef, k_ip.optimise_ccf]:
+            cfg = k_ip.OptConfig(digraph, ndd_list, max_cycle, max_chain, mip_start=start)
+            start_cycles, start_chains = k_ip.valid_mip_start(cfg)
+            assert len(start_cycles) == len(start.cycles)
+            for opt_result in [fn(cfg), k_ip.optimise_relabelled(fn, cfg)]:
+                k_utils.check_validity(opt_result, digraph, ndd_list, max_cycle, max_chain)
+                assert abs(opt_result.total_score - expected.total_score) < EPS
+
+def test_cbc_backend():
+    """Checks that the formulations give valid solutions with the same
+    objective values using the CBC backend, which needs no Gurobi licence
+    """
+    import nose
+    import kidney_solver.column_generation as k_cg
+    import kidney_solver.ip_backend as k_backend
+    if k_backend.pulp is None:
+        raise nose.SkipTest("pulp is not installed")
+    EPS = 0.000001
+    fns = [k_ip.optimise_picef, k_ip.optimise_ccf, k_ip.optimise_hpief_prime,
+           k_ip.optimise_hpief_2prime_full_red, k_ip.optimise_eef,
+           k_cg.optimise_ccf_column_generation]
+    for basename in ["test-fixtures/two_2cycles", "test-fixtures/100-random-weights"]:
+        d, ndds = read_with_ndds(basename)
+        for max_cycle, max_chain in [(3, 0), (3, 3)]:
+            cfg = k_ip.OptConfig(d, ndds, max_cycle, max_chain, backend=k_backend.CBC)
+            opt_result_0 = k_ip.optimise_picef(cfg)
+            for fn in fns + [k_ip.optimise_lazy_ef]:
+                if fn == k_ip.optimise_lazy_ef and basename.endswith("weights"):
+                    # Lazy constraints need a re-solve per round with CBC
+                    continue
+                opt_result = fn(cfg)
+                k_utils.check_validity(opt_result, d, ndds, max_cycle, max_chain)
+                assert abs(opt_result.total_score - opt_result_0.total_score) < EPS
+
+def test_time_formulation():
+    import nose
+    import kidney_solver.ip_backend as k_backend
+    import kidney_solver.time_model_build as k_time
+    if k_backend.pulp is None:
+        raise nose.SkipTest("pulp is not installed")
+    d, ndds = read_with_ndds("test-fixtures/100-random-weights")
+    cfg = k_ip.OptConfig(d, ndds, 3, 3, backend=k_backend.CBC)
+    build_time, solve_time, total_score = k_time.time_formulation(cfg, "picef", 2)
+    assert 0 <= build_time and 0 <= solve_time
+    assert abs(total_score - k_ip.optimise_picef(cfg).total_score) < 0.000001
+    nose.tools.assert_raises(ValueError, k_time.time_formulation, cfg, "portfolio", 1)
+
+def test_concurrent_solves_share_instance():
+    """Checks that several formulations can solve one in-memory instance
+    at once in threads, without storing solver state on the instance
+    """
+    import threading
+    EPS = 0.000001
+    d, ndds = read_with_ndds("test-fixtures/100-random-weights")
+    fns = [k_ip.optimise_picef, k_ip.optimise_uuef, k_ip.optimise_hpief_prime,
+           k_ip.optimise_eef, k_ip.optimise_picef]
+    for max_cycle, max_chain in [(3, 3), (4, 2)]:
+        cfg = k_ip.OptConfig(d, ndds, max_cycle, max_chain)
+        opt_result_0 = k_ip.optimise_picef(cfg)
+        results = [None] * len(fns)
+        def solve(i):
+            results[i] = fns[i](cfg)
+        threads = [threading.Thread(target=solve, args=(i,)) for i in range(len(fns))]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        for fn, opt_result in zip(fns, results):
+            if fn == k_ip.optimise_uuef:
+                continue
+            k_utils.check_validity(opt_result, d, ndds, max_cycle, max_chain)
+            assert abs(opt_result.total_score - opt_result_0.total_score) < EPS
+    assert not any(hasattr(e, "edge_var") for ndd in ndds for e in ndd.edges)
@@ -24,3 +24,99 @@ def test_chain_finding():
 
     chains = k_ndds.find_chains(d, ndds, 0)
     assert len(chains) == 0
+
+def simple_find_chains(d, ndds, max_chain, edge_success_prob):
+    """Depth-first chain search, used to check find_chains"""
+    def recurse(ndd_idx, vertices, score):
+        chains.append((ndd_idx, vertices[:], score))
+        if len(vertices) < max_chain:
+            for e in d.vs[vertices[-1]].edges:
+                if e.tgt.id not in vertices:
+                    vertices.append(e.tgt.id)
+                    recurse(ndd_idx, vertices, score + e.score * edge_success_prob**len(vertices))
+                    del vertices[-1]
+    chains = []
+    if max_chain > 0:
+        for ndd_idx, ndd in enumerate(ndds):
+            for e in ndd.edges:
+                recurse(ndd_idx, [e.target_v.id], e.score * edge_success_prob)
+    return chains
+
+def test_chain_set():
+    d, ndds = read_with_ndds("test-fixtures/100-random-weights")
+    for max_chain in [0, 1, 2, 4]:
+        for p in [1, 0.5]:
+            expected = simple_find_chains(d, ndds, max_chain, p)
+            chain_set = k_ndds.find_chain_set(d, ndds, max_chain, p)
+            assert len(chain_set) == len(expected)
+            chains = [(c.ndd_index, c.vtx_indices, c.score) for c in chain_set]
+            assert [c[:2] for c in chains] == [c[:2] for c in expected]
+            for c, e in zip(chains, expected):
+                nose.tools.assert_almost_equal(c[2], e[2])
+            assert [(c.ndd_index, c.vtx_indices) for c in k_ndds.find_chains(d, ndds, max_chain, p)] == \
+                    [c[:2] for c in expected]
+            assert [(c.ndd_index, c.vtx_indices) for c in k_ndds.generate_chains(d, ndds, max_chain, p)] == \
+                    [c[:2] for c in expected]
+
+            batches = list(k_ndds.generate_chain_sets(d, ndds, max_chain, p, batch_size=10))
+            assert all(len(b) >= 10 for b in batches[:-1])
+            assert [(c.ndd_index, c.vtx_indices) for b in batches for c in b] == \
+                    [c[:2] for c in expected]
+
+def test_chain_blocks():
+    # With a small block size, check that no extension step builds more than
+    # a block of chains (or the extensions of a single chain), and that
+    # chains of the maximum length are counted without being built
+    d, ndds = read_with_ndds("test-fixtures/100-random-weights")
+    max_degree = max(len(v.edges) for v in d.vs)
+    block_size = 64
+    built = []
+    extend = k_ndds.ChainExpander._extend
+    def recording_extend(self, paths, scores=None):
+        result = extend(self, paths, scores)
+        built.append(result[1].shape)
+        return result
+    old_block_size = k_ndds.CHAIN_BLOCK_SIZE
+    k_ndds.CHAIN_BLOCK_SIZE = block_size
+    k_ndds.ChainExpander._extend = recording_extend
+    try:
+        for max_chain in [1, 2, 3, 4]:
+            expected = simple_find_chains(d, ndds, max_chain, 1)
+            del built[:]
+            chain_set = k_ndds.find_chain_set(d, ndds, max_chain)
+            assert [(c.ndd_index, c.vtx_indices) for c in chain_set] == \
+                    [c[:2] for c in expected]
+            assert all(rows <= max(block_size, max_degree) for rows, cols in built)
+
+            expected_counts = [0] * (max_chain + 1)
+            for c in expected:
+                expected_counts[len(c[1])] += 1
+            del built[:]
+            counts = [0] * (max_chain + 1)
+            expander = k_ndds.ChainExpander(d, max_chain)
+            expander.add_chain_counts([e.target_v.id for ndd in ndds for e in ndd.edges], counts)
+            assert counts == expected_counts
+            assert all(rows <= max(block_size, max_degree) for rows, cols in built)
+            assert all(cols < max_chain for rows, cols in built)
+    finally:
+        k_ndds.CHAIN_BLOCK_SIZE = old_block_size
+        k_ndds.ChainExpander._extend = extend
+
+def test_ndd_edge_index():
+    d, ndds = read_with_ndds("test-fixtures/chain-finding")
+    index = k_ndds.NddEdgeIndex(ndds)
+    assert len(index) == sum(len(ndd.edges) for ndd in ndds)
+    for ndd_idx, ndd in enumerate(ndds):
+        for v in d.vs:
+            targets = [e.target_v.id for e in ndd.edges]
+            assert index.edge_exists(ndd_idx, v.id) == (v.id in targets)
+    e = ndds[0].edges[0]
+    assert index.get_edge(0, e.target_v.id) is e
+    assert not index.add(0, k_ndds.NddEdge(e.target_v, 1))
+    assert index.remove(0, e.target_v.id) is e
+    assert not index.edge_exists(0, e.target_v.id)
+
+@nose.tools.raises(KidneyReadException)
+def test_read_ndd_edges_raises_exception_on_duplicate_edge():
+    d = read_edges([(0, 1, 1), (1, 0, 1)])
+    k_ndds.read_ndd_edges([(0, 1, 1.0), (0, 0, 2.0), (0, 1, 3.0)], d)
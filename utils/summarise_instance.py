@@ -26,4 +26,4 @@ def summarise(lines):
             n_arcs_between_pairs + n_arcs_from_ndd)
 
 if __name__=="__main__":
-    summarise(sys.stdin.readlines())
+    summarise(sys.stdin)